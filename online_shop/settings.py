@@ -127,3 +127,51 @@ STATIC_URL = '/static/'
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# Local memory cache is used by default, set CACHE_BACKEND and CACHE_LOCATION to use
+# a shared one in production (e.g. django.core.cache.backends.memcached.PyMemcacheCache)
+
+CACHES = {
+    'default':
+        {
+            'BACKEND':
+                os.environ.get(
+                    'CACHE_BACKEND',
+                    'django.core.cache.backends.locmem.LocMemCache'
+                ),
+            'LOCATION': os.environ.get('CACHE_LOCATION', 'online-shop'),
+        }
+}
+
+# Cache alias and lifetime (in seconds) of the cached catalog responses, see products/cache.py
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 3600))
+
+# Product search
+# The search index is kept in memory of every process, see products/search.py
+
+# How often (in seconds) the index is rebuilt to pick up changes made by other processes
+PRODUCT_SEARCH_INDEX_TTL = int(os.environ.get('PRODUCT_SEARCH_INDEX_TTL', 300))
+
+# The maximum number of products returned by /products/search
+PRODUCT_SEARCH_RESULTS_LIMIT = 1000
+
+# The maximum number of suggestions returned by /products/autocomplete, see products/autocomplete.py
+AUTOCOMPLETE_SUGGESTIONS_LIMIT = 50
+
+# Orders
+
+# For how long (in seconds) the stock of a new order is reserved for its customer, see orders/reservations.py
+ORDER_RESERVATION_TIMEOUT = int(os.environ.get('ORDER_RESERVATION_TIMEOUT', 30 * 60))
+
+# For how long (in seconds) the responses of the requests with the Idempotency-Key header are kept, see orders/idempotency.py
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# After how many seconds without a response a request with the Idempotency-Key header is considered abandoned
+# (e.g. its worker died) and a retry may handle it again. It must be longer than any request may take
+IDEMPOTENCY_KEY_LOCK_TIMEOUT = int(os.environ.get('IDEMPOTENCY_KEY_LOCK_TIMEOUT', 60))
+
+# How old (in seconds) the delivered orders are moved to the archive, see orders/archive.py
+ORDER_ARCHIVE_AGE = int(os.environ.get('ORDER_ARCHIVE_AGE', 180 * 24 * 60 * 60))
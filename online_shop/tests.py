@@ -0,0 +1,340 @@
+'''
+Query audit of the API: every endpoint from online_shop/urls.py has a budget of the database queries
+it may run, and the queries must not read whole tables unless it is expected (e.g. the list of categories).
+
+When a new endpoint is added, it must be added to QUERY_BUDGETS as well, otherwise
+test_every_endpoint_is_audited fails.
+'''
+import re
+from unittest import skipUnless
+from uuid import uuid4
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+from orders.models import Order, OrderItem
+from orders.recommendations import record_order
+from payments.models import Payment
+from products.models import Category, Product, ProductVariant, Review
+from products.autocomplete import get_autocomplete_index
+from products.search import get_search_index
+from users.models import CartItem, WishlistItem
+from . import urls
+
+# URL pattern: (maximum number of queries, tables which may be read with a full scan).
+# A budget must be the measured number of queries, BUDGET_HEADROOM more at most, so any new query is noticed
+QUERY_BUDGETS = {
+    'products/search': (1, set()),
+    # Suggestions are found in memory only
+    'products/autocomplete': (0, set()),
+    'products/export': (3, set()),
+    'products/cache-stats': (1, set()),
+    'categories': (1, {'products_category'}),
+    'categories/<str:category_name>': (3, set()),
+    'categories/<str:category_name>/top-rated': (2, set()),
+    'categories/<str:category_name>/<int:product_id>': (1, set()),
+    'categories/<str:category_name>/<int:product_id>/reviews': (2, set()),
+    'categories/<str:category_name>/<int:product_id>/reviews/create': (5, set()),
+    'categories/<str:category_name>/<int:product_id>/also-bought': (1, set()),
+    'categories/<str:category_name>/<int:product_id>/variants': (1, set()),
+    'register': (4, set()),
+    'token': (2, set()),
+    'users/<int:user_id>': (2, set()),
+    'users/<int:user_id>/wishlist': (2, set()),
+    'users/<int:user_id>/wishlist/<int:wishlist_item_id>': (3, set()),
+    'users/<int:user_id>/cart': (2, set()),
+    'users/<int:user_id>/cart/<int:cart_item_id>': (3, set()),
+    'users/<int:user_id>/reviews': (3, set()),
+    'users/<int:user_id>/reviews/<int:review_id>': (6, set()),
+    'users/<int:user_id>/orders': (4, set()),
+    # The token, the locked cart with the products, the variants, the order, its items, the stock and the categories
+    # to invalidate, the reservation, emptying the cart, two pairs of savepoint queries and rendering the order
+    'users/<int:user_id>/cart/checkout': (15, set()),
+    # The same as the checkout, but the products are read by their IDs and there is no cart to empty.
+    # Orders are rendered with a fixed number of queries (see get_order_prefetches in orders/serializers.py)
+    'order': (15, set()),
+    'order/<int:order_id>': (5, set()),
+    'order/transitions': (6, set()),
+    'order/<int:order_id>/pay': (5, set()),
+    'payment/<str:payment_service_id>': (6, set()),
+    # The payment, confirming the reservation (or taking the stock again with the categories to invalidate), saving
+    # the payment, moving the order to "Paid", recording the products bought together, four pairs of savepoint
+    # queries and rendering the order
+    'webhooks': (22, set()),
+}
+
+# How many queries more than it runs an endpoint may be allowed by its budget
+BUDGET_HEADROOM = 1
+
+# Endpoints which are requested as an admin, the others are requested as a customer
+ADMIN_ENDPOINTS = {'products/export', 'products/cache-stats', 'order/transitions'}
+
+# Applications whose endpoints are not audited
+SKIPPED_PREFIXES = ['admin/']
+
+
+def get_url_patterns(patterns, prefix=''):
+    '''
+    Returns the routes of all the URL patterns, including the ones from include().
+    '''
+    routes = []
+
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+
+        if any(route.startswith(skipped) for skipped in SKIPPED_PREFIXES):
+            continue
+
+        if isinstance(pattern, URLResolver):
+            routes.extend(get_url_patterns(pattern.url_patterns, route))
+        elif isinstance(pattern, URLPattern):
+            routes.append(route)
+
+    return routes
+
+
+def get_full_scans(sql: str) -> set:
+    '''
+    Returns the tables which the query reads completely according to its SQLite query plan.
+    '''
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+        plan = [row[-1] for row in cursor.fetchall()]
+
+    scans = set()
+
+    for detail in plan:
+        # "SCAN products_product USING INDEX ..." reads the index, it is not a full scan of the table
+        match = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+
+        if match and ' USING ' not in detail:
+            scans.add(match.group(1))
+
+    # Subqueries (e.g. of COUNT(*) over a LIMIT) are scanned too, but they are not tables
+    return scans.intersection(connection.introspection.table_names())
+
+
+class QueryAuditTest(APITestCase):
+    def setUp(self) -> None:
+        cache.clear()
+
+        self.category = Category.objects.create(name='pants')
+        self.products = [
+            Product.objects.create(
+                name=f'jeans {index}',
+                price=10 + index,
+                description='blue jeans',
+                img='https://example.com/jeans.png',
+                amount_remaining=30,
+                size='M',
+                color='blue',
+                category=self.category,
+            ) for index in range(5)
+        ]
+        self.product = self.products[0]
+        self.variant = ProductVariant.objects.create(
+            product=self.products[-1], size='L', color='black', amount_remaining=30
+        )
+
+        self.user = User.objects.create_user('customer', 'customer@example.com', 'password')
+        self.token = Token.objects.create(user=self.user)
+        self.admin_token = Token.objects.create(
+            user=User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        )
+
+        self.review = Review.objects.create(
+            author=self.user, product=self.product, liked=True, review_text='Nice'
+        )
+        self.cart_item = CartItem.objects.create(owner=self.user, product=self.product, amount=1)
+        self.wishlist_item = WishlistItem.objects.create(owner=self.user, product=self.product)
+
+        self.order = self.create_order('C')
+        self.paid_order = self.create_order('P')
+        record_order(self.paid_order)
+
+        self.payment = Payment.objects.create(
+            order=self.order,
+            payment_service_id=uuid4(),
+            secret_key=uuid4(),
+        )
+
+        # The search and autocomplete indexes are built once per process, it is not a part of the requests
+        get_search_index()
+        get_autocomplete_index()
+
+    def create_order(self, status):
+        order = Order.objects.create(
+            customer=self.user,
+            final_cost=21,
+            status=status,
+            address_to_send='Russia, Krasnodar',
+            email='customer@example.com',
+            first_name='Carl',
+            last_name='Johnson',
+            mobile_number='+12223334455',
+        )
+
+        for product in self.products[:2]:
+            OrderItem.objects.create(order=order, product=product, amount=1)
+
+        return order
+
+    def get_requests(self):
+        '''
+        Returns a typical request (method, URL, data) for every URL pattern.
+        '''
+        product_url = f'/categories/pants/{self.product.id}'
+        user_url = f'/users/{self.user.id}'
+        order = {
+            'items': [{
+                'product': {
+                    'id': product.id
+                },
+                # The last product has a variant, so it is bought by variant
+                'variant': {
+                    'id': self.variant.id
+                } if product.id == self.variant.product_id else None,
+                'amount': 1
+            } for product in self.products],
+            'address_to_send': 'Russia, Krasnodar',
+            'mobile_number': '+12223334455',
+            'first_name': 'Carl',
+            'last_name': 'Johnson',
+            'email': 'customer@example.com',
+        }
+
+        return {
+            'products/search': ('get', '/products/search?q=jeans&lte=12', None),
+            'products/autocomplete': ('get', '/products/autocomplete?q=je', None),
+            'products/export': ('get', '/products/export', None),
+            'products/cache-stats': ('get', '/products/cache-stats', None),
+            'categories': ('get', '/categories', None),
+            'categories/<str:category_name>': ('get', '/categories/pants?ordering=price', None),
+            'categories/<str:category_name>/top-rated': ('get', '/categories/pants/top-rated', None),
+            'categories/<str:category_name>/<int:product_id>': ('get', product_url, None),
+            'categories/<str:category_name>/<int:product_id>/reviews': ('get', f'{product_url}/reviews', None),
+            'categories/<str:category_name>/<int:product_id>/reviews/create':
+                ('post', f'{product_url}/reviews/create', {
+                    'liked': False,
+                    'review_text': 'Too long'
+                }),
+            'categories/<str:category_name>/<int:product_id>/also-bought': ('get', f'{product_url}/also-bought', None),
+            'categories/<str:category_name>/<int:product_id>/variants':
+                ('get', f'/categories/pants/{self.variant.product_id}/variants', None),
+            'register':
+                ('post', '/register', {
+                    'username': 'newcomer',
+                    'password': 'password',
+                    'email': 'newcomer@example.com'
+                }),
+            'token': ('post', '/token', {
+                'username': 'customer',
+                'password': 'password'
+            }),
+            'users/<int:user_id>': ('get', user_url, None),
+            'users/<int:user_id>/wishlist': ('get', f'{user_url}/wishlist', None),
+            'users/<int:user_id>/wishlist/<int:wishlist_item_id>':
+                ('delete', f'{user_url}/wishlist/{self.wishlist_item.id}', None),
+            'users/<int:user_id>/cart': ('get', f'{user_url}/cart', None),
+            'users/<int:user_id>/cart/<int:cart_item_id>': ('delete', f'{user_url}/cart/{self.cart_item.id}', None),
+            'users/<int:user_id>/reviews': ('get', f'{user_url}/reviews?with_total=true', None),
+            'users/<int:user_id>/reviews/<int:review_id>': ('delete', f'{user_url}/reviews/{self.review.id}', None),
+            'users/<int:user_id>/orders': ('get', f'{user_url}/orders?status=C,P', None),
+            'users/<int:user_id>/cart/checkout':
+                ('post', f'{user_url}/cart/checkout', {
+                    key: value
+                    for key, value in order.items() if key != 'items'
+                }),
+            'order': ('post', '/order', order),
+            'order/<int:order_id>': ('get', f'/order/{self.order.id}', None),
+            'order/transitions': ('post', '/order/transitions', {
+                'orders': [self.paid_order.id],
+                'status': 'O'
+            }),
+            'order/<int:order_id>/pay': ('get', f'/order/{self.order.id}/pay', None),
+            'payment/<str:payment_service_id>': ('get', f'/payment/{self.payment.payment_service_id}', None),
+            'webhooks':
+                (
+                    'post', '/webhooks', {
+                        'id': str(self.payment.payment_service_id),
+                        'status': 'successed',
+                        'metadata': {
+                            'secret_key': str(self.payment.secret_key)
+                        },
+                    }
+                ),
+        }
+
+    def run_request(self, pattern):
+        '''
+        Runs the request of the pattern and returns the captured queries. Everything the request changes
+        is rolled back, so the requests do not depend on each other.
+        '''
+        method, url, data = self.get_requests()[pattern]
+        token = self.admin_token if pattern in ADMIN_ENDPOINTS else self.token
+
+        with transaction.atomic():
+            with CaptureQueriesContext(connection) as context:
+                response = getattr(self.client, method)(
+                    url,
+                    data,
+                    format='json',
+                    HTTP_ACCEPT='application/json',
+                    HTTP_AUTHORIZATION=f'Token {token.key}',
+                )
+
+                if getattr(response, 'streaming', False):
+                    b''.join(response.streaming_content)
+
+            transaction.set_rollback(True)
+
+        self.assertLess(response.status_code, 400, f'{method.upper()} {url}: {response.status_code}')
+
+        return [query['sql'] for query in context.captured_queries]
+
+    def test_every_endpoint_is_audited(self):
+        '''
+        Ensure that every endpoint of the API has a query budget and a request to check it
+        '''
+        routes = get_url_patterns(urls.urlpatterns)
+
+        self.assertEqual(sorted(routes), sorted(QUERY_BUDGETS))
+        self.assertEqual(sorted(routes), sorted(self.get_requests()))
+
+    def test_query_budgets(self):
+        '''
+        Ensure that no endpoint runs more queries than its budget allows, and that no budget is much higher
+        than the real number of queries, so it would not hide new ones
+        '''
+        for pattern, (budget, _) in QUERY_BUDGETS.items():
+            with self.subTest(pattern=pattern):
+                queries = self.run_request(pattern)
+
+                self.assertLessEqual(
+                    len(queries), budget, f'{pattern} ran these queries:\n' + '\n'.join(queries)
+                )
+                self.assertLessEqual(
+                    budget, len(queries) + BUDGET_HEADROOM,
+                    f'{pattern} runs only {len(queries)} queries, its budget must be lowered'
+                )
+
+    @skipUnless(
+        connection.vendor == 'sqlite',
+        'The query plans are checked with SQLite: its planner does not depend on the table statistics, '
+        'while MySQL prefers full scans of the tiny test tables.'
+    )
+    def test_no_full_scans(self):
+        '''
+        Ensure that the queries of the endpoints use indexes instead of reading the whole tables
+        '''
+        for pattern, (_, allowed_scans) in QUERY_BUDGETS.items():
+            with self.subTest(pattern=pattern):
+                for sql in self.run_request(pattern):
+                    if not sql.lstrip().upper().startswith('SELECT'):
+                        continue
+
+                    full_scans = get_full_scans(sql) - allowed_scans
+                    self.assertFalse(full_scans, f'{pattern} reads whole {", ".join(full_scans)}:\n{sql}')
@@ -1,13 +1,57 @@
-from django.contrib import admin
-from .models import Order, OrderItem
+from django.contrib import admin, messages
+from .models import Order, OrderItem, OrderStatusChange
+from .transitions import STAFF_STATUSES, STATUS_NAMES, transition_orders
 
 
 class OrderItemAdmin(admin.TabularInline):
     model = OrderItem
 
 
+class OrderStatusChangeAdmin(admin.TabularInline):
+    model = OrderStatusChange
+    readonly_fields = ('from_status', 'to_status', 'changed_by', 'changed')
+    can_delete = False
+    extra = 0
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+
+def make_transition_action(to_status: str):
+    '''
+    Returns an admin action which moves the selected orders to the status with one set-based update.
+    '''
+    def action(modeladmin, request, queryset):
+        changed = len(
+            transition_orders(
+                queryset.values_list('id', flat=True), to_status, changed_by=request.user
+            )
+        )
+        skipped = queryset.count() - changed
+
+        modeladmin.message_user(
+            request,
+            f'{changed} orders are moved to "{STATUS_NAMES[to_status]}", {skipped} are skipped.',
+            messages.SUCCESS if not skipped else messages.WARNING,
+        )
+
+    action.__name__ = f'move_to_{to_status}'
+    action.short_description = f'Move selected orders to "{STATUS_NAMES[to_status]}"'
+
+    return action
+
+
 class OrderAdmin(admin.ModelAdmin):
-    inlines = [OrderItemAdmin]
+    list_display = ('__str__', 'status', 'created')
+    list_filter = ('status', )
+    # Statuses are changed only with the actions, so every change is validated and recorded
+    readonly_fields = ('status', )
+    inlines = [OrderItemAdmin, OrderStatusChangeAdmin]
+    actions = [make_transition_action(status) for status in STAFF_STATUSES]
+
+    def has_delete_permission(self, request, obj=None):
+        # Orders are only moved to the archive, which needs their IDs to stay unused (see orders/archive.py)
+        return False
 
 class OrderTabularAdmin(admin.TabularInline):
     model = Order
@@ -0,0 +1,116 @@
+'''
+Archive of the delivered orders.
+
+Orders and their items are never deleted, so the tables and their indexes would grow without bound.
+The orders delivered more than ORDER_ARCHIVE_AGE seconds ago are moved to ArchivedOrder by
+"manage.py archive_orders": every order becomes one row with the order rendered by OrderSerializer,
+its status history and its payments, and the order is deleted from the hot tables together with them.
+
+Orders are moved chunk by chunk, every chunk in its own short transaction with a fixed number of queries.
+The archived orders are still shown by /order/<order_id>, see OrderDetail.
+
+An archived order keeps its ID, so the IDs must never be reused by the Order table. Some databases
+(SQLite, MySQL 5.7 after a restart) give a new row the ID next to the highest existing one, so the order
+with the highest ID is never archived, and the orders must never be deleted in any other way than by
+the archive: deleting the newest orders would let the new ones take the IDs of the archived orders.
+'''
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, prefetch_related_objects
+from django.utils import timezone
+from .models import ArchivedOrder, Order, OrderStatusChange
+from .serializers import OrderSerializer, get_order_prefetches
+
+# Only the delivered orders are archived, the others may still change
+ARCHIVED_STATUSES = ['D']
+
+
+def get_archive_candidates(delivered_before):
+    '''
+    Returns the orders which were delivered before the given time, according to their status history
+    ("created" of an order is updated on every save, so it tells nothing about the delivery). The orders
+    delivered before the status history was added got their delivery record from migration 0011.
+
+    The newest order is never archived, so its ID stays the highest one (see the module docstring).
+    '''
+    newest_id = Order.objects.order_by('-id').values_list('id', flat=True).first()
+    delivery = OrderStatusChange.objects.filter(
+        order=OuterRef('pk'), to_status__in=ARCHIVED_STATUSES, changed__lt=delivered_before
+    )
+
+    return Order.objects.filter(Exists(delivery), status__in=ARCHIVED_STATUSES).exclude(id=newest_id)
+
+
+@transaction.atomic
+def archive_chunk(delivered_before, batch_size: int) -> int:
+    '''
+    Moves one chunk of the orders to the archive. Returns the number of the moved orders.
+    '''
+    # The orders are locked, so they can not be changed between copying and deleting them
+    orders = list(
+        get_archive_candidates(delivered_before).select_for_update().order_by('id')[:batch_size]
+    )
+
+    if not orders:
+        return 0
+
+    prefetch_related_objects(orders, *get_order_prefetches(), 'status_history', 'payment_set')
+
+    ArchivedOrder.objects.bulk_create(
+        [
+            ArchivedOrder(
+                id=order.id,
+                customer_id=order.customer_id,
+                created=order.created,
+                data=OrderSerializer(order).data,
+                status_history=[
+                    {
+                        'from_status': change.from_status,
+                        'to_status': change.to_status,
+                        'changed_by': change.changed_by_id,
+                        'changed': change.changed,
+                    } for change in order.status_history.all()
+                ],
+                payments=[
+                    {
+                        'id': payment.id,
+                        'payment_service_id': payment.payment_service_id,
+                        'payment_page_url': payment.payment_page_url,
+                        'secret_key': payment.secret_key,
+                        'paid': payment.paid,
+                    } for payment in order.payment_set.all()
+                ],
+            ) for order in orders
+        ]
+    )
+
+    # The items, the status history and the payments of the orders are deleted by cascade,
+    # all of them are copied to the archive above
+    Order.objects.filter(id__in=[order.id for order in orders]).delete()
+
+    return len(orders)
+
+
+def archive_orders(batch_size: int = 100) -> int:
+    '''
+    Moves the orders delivered more than ORDER_ARCHIVE_AGE seconds ago to the archive.
+    Returns the number of the moved orders.
+    '''
+    delivered_before = timezone.now() - timedelta(seconds=settings.ORDER_ARCHIVE_AGE)
+    archived = 0
+
+    while True:
+        moved = archive_chunk(delivered_before, batch_size)
+
+        if not moved:
+            return archived
+
+        archived += moved
+
+
+def get_archived_order_data(order_id: int):
+    '''
+    Returns the order from the archive as OrderSerializer rendered it, or None if there is no such order.
+    '''
+    return ArchivedOrder.objects.filter(id=order_id).values_list('data', flat=True).first()
@@ -0,0 +1,51 @@
+'''
+Checkout of the carts: an order is made of the items of the cart of a customer on the server side,
+so the client does not have to read its cart and send every item back to POST /order.
+
+Everything is done in one transaction with a fixed number of queries whatever the size of the cart:
+- the cart items are read together with their products, and both are locked with one SELECT ... FOR UPDATE;
+- the variants of their products are read with one more query;
+- the order items are inserted with one query and the stock is reserved (see orders/reservations.py);
+- the ordered cart items are deleted with one query.
+
+Two concurrent checkouts of one cart are serialized by the locks: the second one finds the cart empty.
+'''
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from users.models import CartItem
+from .serializers import get_item_variant, get_variants, place_order
+
+
+@transaction.atomic
+def checkout_cart(data, customer):
+    '''
+    Creates an order of the items of the cart of the customer and empties the cart.
+    The delivery details are taken from the data, like in POST /order.
+    '''
+    # The rows are locked in the order of the products, so the checkouts of the carts with the same
+    # products wait for each other instead of deadlocking. The variants are not joined here: a nullable
+    # relation can not be locked with an outer join on every database
+    cart_items = list(
+        CartItem.objects.select_for_update().filter(owner=customer
+                                                   ).select_related('product').order_by('product_id', 'id')
+    )
+
+    if not cart_items:
+        raise ValidationError('The cart is empty.')
+
+    variants = get_variants(item.product for item in cart_items)
+
+    order = place_order(
+        data, customer, [
+            {
+                'product': item.product,
+                'variant': get_item_variant(item.product, item.variant_id, variants),
+                'amount': item.amount
+            } for item in cart_items
+        ]
+    )
+
+    # Only the ordered items are deleted: the ones added after the cart was read stay in the cart
+    CartItem.objects.filter(id__in=[item.id for item in cart_items]).delete()
+
+    return order
@@ -0,0 +1,169 @@
+'''
+Idempotency keys of the unsafe endpoints.
+
+A client which is not sure that its request was handled (e.g. the connection was lost before the response came)
+can repeat it with the same "Idempotency-Key" header. The first request with a key is handled as usual
+and its successful response is stored; the repeated requests get the stored response back and nothing is
+executed again. So a retried POST /order never creates a second order.
+
+Keys are stored for IDEMPOTENCY_KEY_TTL seconds, "manage.py purge_idempotency_keys" deletes the older ones.
+An expired key is never replayed and may be used again even before it is deleted. A key whose request got
+no response in IDEMPOTENCY_KEY_LOCK_TIMEOUT seconds is considered abandoned (e.g. the worker died while
+handling it) and is claimed by the next retry, so the client is not locked out until the key expires.
+'''
+import json
+from datetime import timedelta
+from functools import wraps
+from hashlib import sha256
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 128
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'A request with this idempotency key is still being processed.'
+    default_code = 'conflict'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'This idempotency key was already used for another request.'
+    default_code = 'unprocessable_entity'
+
+
+def get_request_hash(request) -> str:
+    '''
+    Returns the hash of the method, the path and the JSON body of the request. The body is dumped
+    with sorted keys, so the same data sent with another order of the keys gives the same hash.
+    '''
+    body = json.dumps(request.data, sort_keys=True, default=str)
+
+    return sha256(f'{request.method} {request.path}\n{body}'.encode('utf-8')).hexdigest()
+
+
+def idempotent(scope: str):
+    '''
+    Makes a handler of a view (post, create and so on) idempotent for the requests with the Idempotency-Key header.
+    Keys of the authenticated users are separate, so two customers can not get the responses of each other.
+    The requests without the header are handled as usual.
+    '''
+    def decorator(handler):
+        @wraps(handler)
+        def wrapper(view, request, *args, **kwargs):
+            key = request.headers.get(HEADER)
+
+            if key is None:
+                return handler(view, request, *args, **kwargs)
+
+            if not key or len(key) > MAX_KEY_LENGTH:
+                raise ValidationError(
+                    f'Header "{HEADER}" must contain from 1 to {MAX_KEY_LENGTH} characters.'
+                )
+
+            user_id = request.user.id if request.user.is_authenticated else '-'
+            key = f'{scope}:{user_id}:{key}'
+            request_hash = get_request_hash(request)
+
+            # The key is claimed before the request is handled, so a concurrent duplicate is refused
+            record = claim(key, request_hash)
+
+            if record is None:
+                return replay(key, request_hash)
+
+            try:
+                response = handler(view, request, *args, **kwargs)
+            except Exception:
+                # Failed requests are not stored, the client may fix the request and retry with the same key
+                record.delete()
+                raise
+
+            if not status.is_success(response.status_code):
+                record.delete()
+                return response
+
+            record.response_status = response.status_code
+            record.response_data = response.data
+            record.save(update_fields=['response_status', 'response_data'])
+
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def claim(key: str, request_hash: str):
+    '''
+    Claims the key for the request. Returns the record of the key, or None if it is held by another request.
+    An expired or abandoned key is claimed again with one conditional UPDATE, so only one of
+    the concurrent retries gets it.
+    '''
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(key=key, request_hash=request_hash)
+    except IntegrityError:
+        pass
+
+    now = timezone.now()
+    claimed = IdempotencyKey.objects.filter(
+        Q(created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)) | Q(
+            response_status__isnull=True,
+            created__lt=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_LOCK_TIMEOUT)
+        ),
+        key=key,
+    ).update(request_hash=request_hash, response_status=None, response_data=None, created=now)
+
+    return IdempotencyKey.objects.filter(key=key).first() if claimed else None
+
+
+def replay(key: str, request_hash: str):
+    '''
+    Returns the stored response of the request with the given key.
+    '''
+    created_after = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    record = IdempotencyKey.objects.filter(key=key, created__gte=created_after).first()
+
+    # The first request failed and its key was deleted right after the conflict (or the key expired just now)
+    if record is None:
+        raise IdempotencyKeyInUse()
+
+    if record.request_hash != request_hash:
+        raise IdempotencyKeyReused()
+
+    if record.response_status is None:
+        raise IdempotencyKeyInUse()
+
+    return Response(
+        record.response_data,
+        status=record.response_status,
+        headers={'Idempotent-Replayed': 'true'},
+    )
+
+
+def purge_idempotency_keys(batch_size: int = 1000) -> int:
+    '''
+    Deletes the keys older than IDEMPOTENCY_KEY_TTL seconds batch by batch. Returns the number of deleted keys.
+    '''
+    created_before = timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    deleted = 0
+
+    while True:
+        ids = list(
+            IdempotencyKey.objects.filter(created__lt=created_before).values_list(
+                'id', flat=True
+            )[:batch_size]
+        )
+
+        if not ids:
+            return deleted
+
+        deleted += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
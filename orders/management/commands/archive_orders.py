@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from orders.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves the delivered orders older than ORDER_ARCHIVE_AGE seconds with their items to the archive. '
+        'Run it periodically, e.g. every night with cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='How many orders are moved in one transaction.'
+        )
+
+    def handle(self, *args, **options):
+        archived = archive_orders(options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {archived} orders are archived.'))
@@ -0,0 +1,31 @@
+import time
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from orders.checkout import checkout_cart
+from users.models import CartItem
+from .benchmark_orders import DELIVERY_DETAILS, Command as BenchmarkOrdersCommand
+
+
+class Command(BenchmarkOrdersCommand):
+    help = (
+        'Measures the latency of the checkout of a cart (orders/checkout.py) depending on the number of items '
+        'in the cart. Synthetic products, carts and orders are created inside a transaction which is rolled back '
+        'at the end, so the database is left untouched.'
+    )
+
+    def measure(self, customer, product_ids):
+        '''
+        Fills the cart of the customer with the products (one piece of each) and checks it out.
+        Only the checkout is measured.
+        '''
+        CartItem.objects.bulk_create(
+            CartItem(owner=customer, product_id=product_id, amount=1)
+            for product_id in product_ids
+        )
+
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            checkout_cart(DELIVERY_DETAILS, customer)
+            seconds = time.perf_counter() - started
+
+        return seconds, len(context.captured_queries)
@@ -0,0 +1,97 @@
+import time
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from orders.serializers import OrderSerializer
+from products.models import Category, Product
+
+DELIVERY_DETAILS = {
+    'address_to_send': 'Russia, Krasnodar',
+    'mobile_number': '+12223334455',
+    'first_name': 'Carl',
+    'last_name': 'Johnson',
+    'email': 'benchmark@example.com',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the latency of the order creation (OrderSerializer.create) depending on the number of items. '
+        'Synthetic products and orders are created inside a transaction which is rolled back at the end, '
+        'so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[1, 10, 50, 200],
+            help='Numbers of items in the orders.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='How many orders of every size are created.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.run(options['sizes'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def run(self, sizes, repeat):
+        category = Category.objects.create(name='benchmark')
+        customer = User.objects.create_user('benchmark', 'benchmark@example.com', 'password')
+        products = Product.objects.bulk_create(
+            Product(
+                name=f'product {index}',
+                description='benchmark',
+                price=10,
+                amount_remaining=1000,
+                img='https://example.com/img.png',
+                category=category,
+            ) for index in range(max(sizes))
+        )
+
+        # Primary keys are not returned by bulk_create() on every database
+        product_ids = list(
+            Product.objects.filter(category=category).order_by('id').values_list('id', flat=True)
+        )[:len(products)]
+
+        self.stdout.write(f'{"items":<10}{"queries":>10}{"best, ms":>12}{"mean, ms":>12}')
+
+        for size in sizes:
+            times = []
+
+            for _ in range(repeat):
+                seconds, queries = self.measure(customer, product_ids[:size])
+                times.append(seconds)
+
+            self.stdout.write(
+                f'{size:<10}{queries:>10}{min(times) * 1000:>12.2f}'
+                f'{sum(times) / len(times) * 1000:>12.2f}'
+            )
+
+    def measure(self, customer, product_ids):
+        '''
+        Creates an order of the products (one piece of each). Returns how long it took in seconds
+        and how many queries it ran.
+        '''
+        data = {
+            **DELIVERY_DETAILS, 'items': [{
+                'product': {
+                    'id': product_id
+                },
+                'amount': 1
+            } for product_id in product_ids]
+        }
+
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            OrderSerializer.create(data, customer)
+            seconds = time.perf_counter() - started
+
+        return seconds, len(context.captured_queries)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from orders.idempotency import purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = (
+        'Deletes the stored requests with the Idempotency-Key header older than IDEMPOTENCY_KEY_TTL seconds. '
+        'Run it periodically, e.g. every hour with cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='How many keys are deleted with one query.'
+        )
+
+    def handle(self, *args, **options):
+        deleted = purge_idempotency_keys(options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {deleted} expired keys are deleted.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from orders.recommendations import rebuild_co_purchases
+
+
+class Command(BaseCommand):
+    help = 'Recounts the "customers also bought" recommendations from all the paid orders.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='How many orders are read and how many pairs are saved with one query.'
+        )
+
+    def handle(self, *args, **options):
+        pairs = rebuild_co_purchases(options['batch_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Done, {pairs} pairs of products are stored.')
+        )
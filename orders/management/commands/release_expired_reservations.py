@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from orders.reservations import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = (
+        'Returns the stock reserved for the orders which were not paid in time (see ORDER_RESERVATION_TIMEOUT). '
+        'Run it periodically, e.g. every minute with cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='How many expired reservations are read with one query.'
+        )
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(options['batch_size'])
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Done, the stock of {released} orders is released.')
+        )
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_order_item_variant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='reservation', serialize=False, to='orders.order')),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+    ]
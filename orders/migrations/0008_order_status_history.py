@@ -0,0 +1,27 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:57
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('orders', '0007_order_customer_created_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStatusChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('from_status', models.CharField(choices=[('C', 'Created'), ('P', 'Paid'), ('O', 'On the way'), ('D', 'Delivered')], max_length=2)),
+                ('to_status', models.CharField(choices=[('C', 'Created'), ('P', 'Paid'), ('O', 'On the way'), ('D', 'Delivered')], max_length=2)),
+                ('changed', models.DateTimeField(auto_now_add=True)),
+                ('changed_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='orders.order')),
+            ],
+        ),
+    ]
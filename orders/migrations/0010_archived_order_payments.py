@@ -0,0 +1,19 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:15
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_archived_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='payments',
+            field=models.JSONField(default=list, encoder=django.core.serializers.json.DjangoJSONEncoder),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 3.2.6 on 2026-10-18 20:05
+
+from django.db import migrations
+from django.db.models import Exists, OuterRef, Subquery
+
+# The same as orders.archive.ARCHIVED_STATUSES, copied to keep the migration independent of the current code
+ARCHIVED_STATUSES = ['D']
+BATCH_SIZE = 1000
+
+
+def fill_delivery_history(apps, schema_editor):
+    '''
+    Orders delivered before the status history was added have no record of their delivery, so they
+    would never be archived. They get one dated by "created" of the order: it is updated on every save,
+    so it is the time of the last change of the order, which is the delivery for a delivered order.
+    '''
+    Order = apps.get_model('orders', 'Order')
+    OrderStatusChange = apps.get_model('orders', 'OrderStatusChange')
+
+    delivery = OrderStatusChange.objects.filter(
+        order=OuterRef('pk'), to_status__in=ARCHIVED_STATUSES
+    )
+    orders = Order.objects.filter(status__in=ARCHIVED_STATUSES).exclude(Exists(delivery))
+
+    while True:
+        rows = list(orders.order_by('id').values_list('id', 'status')[:BATCH_SIZE])
+
+        if not rows:
+            return
+
+        OrderStatusChange.objects.bulk_create(
+            [
+                OrderStatusChange(order_id=order_id, from_status='O', to_status=to_status)
+                for order_id, to_status in rows
+            ]
+        )
+        # "changed" is set to the current time on insert, so it is moved back in a separate query
+        OrderStatusChange.objects.filter(
+            order_id__in=[order_id for order_id, _ in rows], to_status__in=ARCHIVED_STATUSES
+        ).update(
+            changed=Subquery(Order.objects.filter(id=OuterRef('order_id')).values('created')[:1])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0010_archived_order_payments'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_delivery_history, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0011_backfill_delivery_history'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='archivedorder',
+            name='id',
+            field=models.PositiveBigIntegerField(primary_key=True, serialize=False),
+        ),
+    ]
@@ -1,6 +1,7 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
 from django.contrib.auth.models import User
-from products.models import Product
+from products.models import Product, ProductVariant
 
 STATUS_CHOICES = [
         ('C', 'Created'),
@@ -26,6 +27,14 @@ class Order(models.Model):
     last_name = models.CharField(max_length=32)
     mobile_number = models.CharField(max_length=16)
 
+    class Meta:
+        indexes = [
+            # The order history of a customer is read with an index range scan in both directions
+            models.Index(
+                fields=['customer', 'created', 'id'], name='order_customer_created_idx'
+            ),
+        ]
+
     def __str__(self) -> str:
         return f'{self.customer} {self.final_cost}$'
 
@@ -35,7 +44,117 @@ class OrderItem(models.Model):
         Order, on_delete=models.CASCADE, related_name="items"
     )
     product = models.ForeignKey(Product, on_delete=models.RESTRICT)
+    variant = models.ForeignKey(
+        ProductVariant, on_delete=models.RESTRICT, blank=True, null=True
+    )
     amount = models.PositiveSmallIntegerField()
 
     def __str__(self) -> str:
         return f'{self.product.color} {self.product.name}, {self.amount} pieces'
+
+
+class OrderStatusChange(models.Model):
+    '''
+    A record of the status history of an order. Statuses are changed only through orders/transitions.py,
+    which records every change.
+    '''
+    order = models.ForeignKey(
+        Order, on_delete=models.CASCADE, related_name='status_history'
+    )
+    from_status = models.CharField(max_length=2, choices=STATUS_CHOICES)
+    to_status = models.CharField(max_length=2, choices=STATUS_CHOICES)
+    # The staff member who changed the status, empty for the changes made by the shop itself (e.g. payments)
+    changed_by = models.ForeignKey(
+        User, on_delete=models.SET_NULL, blank=True, null=True, related_name='+'
+    )
+    changed = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self) -> str:
+        return f'Order {self.order_id}: {self.from_status} -> {self.to_status}'
+
+
+class ArchivedOrder(models.Model):
+    '''
+    A delivered order moved out of the Order table, see orders/archive.py. The order is stored the way
+    OrderSerializer renders it, so it is shown without any joins and it stays the same even if its
+    products are changed or deleted later.
+    '''
+    # The ID the order had in the Order table, it must never be given to another order (see orders/archive.py)
+    id = models.PositiveBigIntegerField(primary_key=True)
+    customer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    created = models.DateTimeField()
+    archived = models.DateTimeField(auto_now_add=True)
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+    # Rows of OrderStatusChange: { "from_status", "to_status", "changed_by", "changed" }
+    status_history = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+    # Rows of payments.Payment: { "id", "payment_service_id", "payment_page_url", "secret_key", "paid" }
+    payments = models.JSONField(default=list, encoder=DjangoJSONEncoder)
+
+    def __str__(self) -> str:
+        return f'Archived order {self.id}'
+
+
+class StockReservation(models.Model):
+    '''
+    The stock of the items of an order which is not paid yet. The stock itself is already taken
+    from the products, the reservation only remembers to return it if the order is not paid in time
+    (see orders/reservations.py).
+    '''
+    order = models.OneToOneField(
+        Order,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='reservation'
+    )
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self) -> str:
+        return f'Order {self.order_id} until {self.expires_at}'
+
+
+class IdempotencyKey(models.Model):
+    '''
+    A request made with the Idempotency-Key header and its response, see orders/idempotency.py.
+    The response is empty while the request is being processed.
+    '''
+    # "<scope>:<user ID>:<value of the header>", the user ID is "-" for the anonymous requests.
+    # It is one column, since NULL user IDs would not be unique in a constraint.
+    key = models.CharField(max_length=255, unique=True)
+    request_hash = models.CharField(max_length=64)
+    response_status = models.PositiveSmallIntegerField(null=True)
+    response_data = models.JSONField(null=True, encoder=DjangoJSONEncoder)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self) -> str:
+        return self.key
+
+
+class CoPurchase(models.Model):
+    '''
+    Number of the paid orders in which both products were bought. It is a sparse product-to-product
+    matrix stored row by row: every pair of products is stored in both directions, so the products
+    bought together with a product are read with one index range scan (see orders/recommendations.py).
+    '''
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='co_purchases'
+    )
+    other_product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='+'
+    )
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'other_product'], name='unique_co_purchase'
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['product', '-count', 'other_product'],
+                name='co_purchase_top_idx'
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f'{self.product_id} & {self.other_product_id}: {self.count}'
@@ -1,13 +1,27 @@
 from rest_framework.permissions import BasePermission
-from .models import Order
+from .models import ArchivedOrder, Order
 
 
 class IsOrderOwnerOrAdmin(BasePermission):
     def has_permission(self, request, view):
         try:
             order_id = view.kwargs['order_id']
-            order = Order.objects.get(id=order_id)
-            return bool(order.customer.id == request.user.id
+            # Only the ID of the customer is needed, so neither the order nor the customer is loaded.
+            # The old orders are looked for in the archive (see orders/archive.py)
+            customer_id = Order.objects.filter(id=order_id).values_list(
+                'customer_id', flat=True
+            ).first() or ArchivedOrder.objects.filter(id=order_id).values_list(
+                'customer_id', flat=True
+            ).get()
+            return bool(customer_id == request.user.id
                        ) or bool(request.user.is_staff)
         except Exception as e:
             return False
+
+
+class IsCustomerOrAdmin(BasePermission):
+    '''
+    Allows the customer with ID <user_id> and the admins to access the orders of the customer.
+    '''
+    def has_permission(self, request, view):
+        return request.user.id == view.kwargs['user_id'] or bool(request.user.is_staff)
@@ -0,0 +1,136 @@
+'''
+"Customers also bought" recommendations.
+
+They are built from the co-occurrence of the products in the paid orders: CoPurchase stores, for every
+pair of products, the number of the paid orders that contain both of them. The counts are updated
+incrementally when an order is paid (record_order) and can be rebuilt from the whole order history
+with "manage.py rebuild_co_purchases".
+
+The rows of a product are read through the index (product, -count), so getting its top neighbours
+costs one index range scan of the requested length, no matter how many orders there are.
+'''
+from collections import Counter
+from itertools import groupby, islice, permutations
+from django.db import transaction
+from django.db.models import F
+from products.models import Product
+from .models import ArchivedOrder, CoPurchase, Order, OrderItem
+
+# Statuses of the orders which were paid, see orders/models.py
+PAID_STATUSES = ['P', 'O', 'D']
+
+
+@transaction.atomic
+def record_order(order):
+    '''
+    Adds the products of a paid order to the co-occurrence counts. It costs two queries regardless
+    of the number of the products: the missing pairs are created and then all the pairs are incremented.
+    '''
+    product_ids = set(order.items.values_list('product_id', flat=True))
+
+    if len(product_ids) < 2:
+        return
+
+    CoPurchase.objects.bulk_create(
+        [
+            CoPurchase(product_id=product_id, other_product_id=other_product_id)
+            for product_id, other_product_id in permutations(product_ids, 2)
+        ],
+        ignore_conflicts=True,
+    )
+    CoPurchase.objects.filter(
+        product_id__in=product_ids, other_product_id__in=product_ids
+    ).exclude(product_id=F('other_product_id')).update(count=F('count') + 1)
+
+
+def get_also_bought(product_id: int, limit: int):
+    '''
+    Returns the products most often bought together with the given one, the most frequent go first.
+    '''
+    return [
+        co_purchase.other_product
+        for co_purchase in CoPurchase.objects.filter(product_id=product_id).
+        select_related('other_product__category').order_by(
+            '-count', 'other_product'
+        )[:limit]
+    ]
+
+
+def count_co_purchases(chunk_size: int = 1000) -> Counter:
+    '''
+    Counts the pairs of products in all the paid orders, including the archived ones. Orders are read by chunks
+    with keyset queries (like the catalog export, see products/export.py), so only the counts and one chunk
+    are held in memory.
+    '''
+    counts = Counter()
+    last_order_id = 0
+
+    while True:
+        order_ids = list(
+            Order.objects.filter(status__in=PAID_STATUSES, id__gt=last_order_id).
+            order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+
+        if not order_ids:
+            break
+
+        items = OrderItem.objects.filter(order_id__in=order_ids).order_by(
+            'order_id'
+        ).values_list('order_id', 'product_id')
+
+        for _, order_items in groupby(items, key=lambda item: item[0]):
+            product_ids = {product_id for _, product_id in order_items}
+            counts.update(permutations(product_ids, 2))
+
+        last_order_id = order_ids[-1]
+
+    # The archived orders are delivered, so they were paid too (see orders/archive.py)
+    last_order_id = 0
+
+    while True:
+        archived_orders = list(
+            ArchivedOrder.objects.filter(id__gt=last_order_id).order_by('id').values_list(
+                'id', 'data'
+            )[:chunk_size]
+        )
+
+        if not archived_orders:
+            return counts
+
+        orders_product_ids = [
+            {item['product']['id']
+             for item in data['items']} for _, data in archived_orders
+        ]
+        # The archive keeps the products as they were ordered, some of them may have been deleted since
+        existing_ids = set(
+            Product.objects.filter(id__in=set().union(*orders_product_ids)
+                                  ).values_list('id', flat=True)
+        )
+
+        for product_ids in orders_product_ids:
+            counts.update(permutations(product_ids & existing_ids, 2))
+
+        last_order_id = archived_orders[-1][0]
+
+
+@transaction.atomic
+def rebuild_co_purchases(batch_size: int = 1000) -> int:
+    '''
+    Recounts all the co-occurrences from scratch. Returns the number of the stored pairs.
+    '''
+    counts = count_co_purchases(batch_size)
+    pairs = iter(counts.items())
+
+    CoPurchase.objects.all().delete()
+
+    while True:
+        batch = [
+            CoPurchase(
+                product_id=product_id, other_product_id=other_product_id, count=count
+            ) for (product_id, other_product_id), count in islice(pairs, batch_size)
+        ]
+
+        if not batch:
+            return len(counts)
+
+        CoPurchase.objects.bulk_create(batch)
@@ -0,0 +1,185 @@
+'''
+Stock reservations of the orders.
+
+The stock of the products is taken when an order is created, not when it is paid, so two customers can never
+buy the last piece at the same time. The stock is decremented with a conditional UPDATE: a row is changed
+only if it still has enough stock at the moment of the update, and the database serializes the concurrent
+updates of one row. There is no read-modify-write in Python, so neither overselling nor lost updates happen.
+
+While an order is not paid, it has a StockReservation with an expiry time:
+- when the order is paid, the reservation is confirmed (simply deleted, the stock is already taken);
+- when it expires, "manage.py release_expired_reservations" returns the stock and deletes it.
+If an order is paid after its reservation was released, the stock is taken again if it is still available.
+'''
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, When
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from products.cache import bump_versions
+from products.models import Product, ProductVariant
+from .models import OrderItem, StockReservation
+
+
+def shift_stock(model, amounts: dict, take: bool) -> int:
+    '''
+    Takes (or returns) the given amounts { ID: amount } of the stock of the products or the variants
+    with one UPDATE query. When the stock is taken, the rows which do not have enough of it are not changed.
+    Returns the number of the changed rows.
+    '''
+    if not amounts:
+        return 0
+
+    sign = -1 if take else 1
+    condition = Q()
+
+    for object_id, amount in amounts.items():
+        condition |= Q(id=object_id, amount_remaining__gte=amount) if take else Q(id=object_id)
+
+    return model.objects.filter(condition).update(
+        amount_remaining=Case(
+            *[
+                When(id=object_id, then=F('amount_remaining') + sign * amount)
+                for object_id, amount in amounts.items()
+            ],
+            output_field=model._meta.get_field('amount_remaining'),
+        )
+    )
+
+
+def count_amounts(items):
+    '''
+    Sums the amounts of the items (OrderItem instances) per product and per variant.
+    The stock of a product with variants is the total stock of its variants, so it changes too.
+    '''
+    product_amounts = Counter()
+    variant_amounts = Counter()
+
+    for item in items:
+        product_amounts[item.product_id] += item.amount
+
+        if item.variant_id is not None:
+            variant_amounts[item.variant_id] += item.amount
+
+    return product_amounts, variant_amounts
+
+
+@transaction.atomic
+def take_stock(items):
+    '''
+    Takes the stock of the items with two queries at most, whatever the number of the items.
+    Raises ValidationError (and nothing is taken) if any of them is not available in the requested amount.
+    '''
+    product_amounts, variant_amounts = count_amounts(items)
+
+    if shift_stock(ProductVariant, variant_amounts, take=True) < len(variant_amounts):
+        raise_not_enough(
+            ProductVariant.objects.filter(id__in=variant_amounts).values_list(
+                'id', 'product_id', 'amount_remaining'
+            ), variant_amounts
+        )
+
+    if shift_stock(Product, product_amounts, take=True) < len(product_amounts):
+        raise_not_enough(
+            Product.objects.filter(id__in=product_amounts).values_list(
+                'id', 'id', 'amount_remaining'
+            ), product_amounts
+        )
+
+    bump_stock_versions(product_amounts)
+
+
+@transaction.atomic
+def return_stock(items):
+    product_amounts, variant_amounts = count_amounts(items)
+
+    shift_stock(ProductVariant, variant_amounts, take=False)
+    shift_stock(Product, product_amounts, take=False)
+    bump_stock_versions(product_amounts)
+
+
+def raise_not_enough(rows, amounts):
+    '''
+    Finds the item that has not got enough stock. It is done only when taking the stock failed,
+    the transaction is rolled back by the raised exception then. Rows are (ID, product ID, stock) tuples.
+    '''
+    stock = {object_id: (product_id, amount_remaining) for object_id, product_id, amount_remaining in rows}
+    product_id = None
+
+    for object_id, amount in amounts.items():
+        product_id, amount_remaining = stock.get(object_id, (None, 0))
+
+        if amount_remaining < amount:
+            break
+
+    raise ValidationError(
+        f'The quantity of product with ID {product_id} is not enough to add this amount to the order.'
+    )
+
+
+def bump_stock_versions(product_ids):
+    '''
+    The stock is a part of the products in the catalog responses, but queryset.update() sends no signals,
+    so the cached responses are invalidated here.
+    '''
+    category_ids = Product.objects.filter(id__in=list(product_ids)).values_list(
+        'category_id', flat=True
+    ).distinct()
+
+    bump_versions(
+        *[f'product:{product_id}' for product_id in product_ids],
+        *[f'category:{category_id}' for category_id in category_ids],
+    )
+
+
+def reserve_stock(order, items):
+    '''
+    Takes the stock of the items of a new order and reserves it for ORDER_RESERVATION_TIMEOUT seconds.
+    '''
+    take_stock(items)
+    StockReservation.objects.create(
+        order=order,
+        expires_at=timezone.now() + timedelta(seconds=settings.ORDER_RESERVATION_TIMEOUT),
+    )
+
+
+def confirm_reservation(order) -> bool:
+    '''
+    Turns the reservation of a paid order into a purchase. Returns False if there was no reservation
+    (it has expired and the stock was returned), the stock must be taken again then.
+    '''
+    deleted, _ = StockReservation.objects.filter(order=order).delete()
+
+    return bool(deleted)
+
+
+def release_expired_reservations(batch_size: int = 100) -> int:
+    '''
+    Returns the stock of the orders whose reservations have expired. Every order is released in its own
+    transaction, and a reservation is released only by the one who managed to delete it, so it is safe to
+    run concurrently with the payments and with another release. Returns the number of the released orders.
+    '''
+    now = timezone.now()
+    released = 0
+
+    while True:
+        order_ids = list(
+            StockReservation.objects.filter(expires_at__lte=now).order_by(
+                'expires_at'
+            ).values_list('order_id', flat=True)[:batch_size]
+        )
+
+        if not order_ids:
+            return released
+
+        for order_id in order_ids:
+            with transaction.atomic():
+                deleted, _ = StockReservation.objects.filter(
+                    order_id=order_id, expires_at__lte=now
+                ).delete()
+
+                if deleted:
+                    return_stock(OrderItem.objects.filter(order_id=order_id))
+                    released += 1
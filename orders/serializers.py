@@ -1,13 +1,147 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Count, Prefetch
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
-from products.models import Product
-from products.serializers import ProductSerializer
+from products.models import Product, ProductVariant
+from products.serializers import ProductSerializer, ProductVariantSerializer
 from users.serializers import UserSerializer
 from . import models
+from .reservations import reserve_stock
+
+
+def get_by_ids(model, ids) -> dict:
+    '''
+    Loads the objects with the given IDs with one query and returns them as { str(ID): object },
+    so the IDs passed as strings are found too.
+    '''
+    return {
+        str(object_id): obj
+        for object_id, obj in model.objects.in_bulk(list(dict.fromkeys(ids))).items()
+    }
+
+
+def get_order_prefetches(lookup: str = '') -> list:
+    '''
+    The prefetch plan of everything OrderSerializer renders: the customers with the annotated numbers
+    of their reviews and the items with their products, categories and variants. It costs two queries
+    whatever the number of the orders and their items. Pass the lookup of the order (e.g. "order__")
+    to prefetch the orders of other models.
+
+    Use it with queryset.prefetch_related() or, for the loaded orders, with prefetch_related_objects().
+    '''
+    return [
+        Prefetch(
+            f'{lookup}customer',
+            queryset=User.objects.annotate(commentaries_count=Count('commentaries')),
+        ),
+        get_order_items_prefetch(lookup),
+    ]
+
+
+def get_order_items_prefetch(lookup: str = '') -> Prefetch:
+    return Prefetch(
+        f'{lookup}items',
+        queryset=models.OrderItem.objects.select_related('product__category', 'variant'),
+    )
+
+
+def get_variants(products):
+    '''
+    Loads all the variants of the products with one query. All of them are loaded, not only the chosen ones,
+    to find out which products have variants at all. Returns a tuple ({ str(ID): variant }, IDs of the products
+    with variants).
+    '''
+    variants = {
+        str(variant_id): variant
+        for variant_id, variant in ProductVariant.objects.
+        filter(product__in=[product.id for product in products]).in_bulk().items()
+    }
+
+    return variants, {variant.product_id for variant in variants.values()}
+
+
+def get_item_variant(product, variant_id, variants):
+    '''
+    Returns the chosen variant of an ordered product from the variants loaded with get_variants().
+    Products with variants are bought by variant only: their stock is the total stock of the variants
+    and it is recalculated from them, so the stock taken from the product itself would come back.
+    '''
+    variants, product_ids_with_variants = variants
+
+    if variant_id is None:
+        if product.id in product_ids_with_variants:
+            raise ValidationError(
+                f'Product with ID {product.id} has variants, one of them must be chosen.'
+            )
+
+        return None
+
+    variant = variants.get(str(variant_id))
+
+    if variant is None or variant.product_id != product.id:
+        raise ValidationError(f'Product with ID {product.id} has no variant with ID {variant_id}.')
+
+    return variant
+
+
+def place_order(data, customer, items: list):
+    '''
+    Creates an order of the customer from the items { "product": Product, "variant": ProductVariant | None,
+    "amount": int } whose products and variants are already loaded, and reserves their stock.
+    The delivery details are taken from the data. Must be called inside a transaction.
+    '''
+    final_cost = 0.0
+
+    for item in items:
+        # Here we must check that an user cannot buy more products than is available in the database.
+        if ((item['variant'] or item['product']).amount_remaining < item['amount']):
+            raise ValidationError(
+                f'The quantity of product with ID {item["product"].id} is not enough to add this amount to the order.'
+            )
+
+        final_cost += round(float(item['product'].price) * item['amount'], 2)
+
+    order = models.Order(
+        customer=customer,
+        final_cost=final_cost,
+        address_to_send=data['address_to_send'],
+        email=data['email'],
+        first_name=data['first_name'],
+        last_name=data['last_name'],
+        mobile_number=data['mobile_number'],
+    )
+
+    order.save()
+    '''
+    And now we need to iterate items one more time to add them to order.
+    We could not make it before, because we did not create any order yet, but we was in
+    need of first iteration because of we were summarizing final cost of whole order (and order
+    cannot be created without final_cost field)
+    
+    TODO: Rewrite final cost field as getter in Order model to avoid it. (#e3eae90a)
+    '''
+    order_items = models.OrderItem.objects.bulk_create(
+        [
+            models.OrderItem(
+                product=item['product'],
+                variant=item['variant'],
+                amount=item['amount'],
+                order=order
+            ) for item in items
+        ]
+    )
+
+    # The check above only gives a quick answer, the stock is really taken here: concurrent orders
+    # could take it after the products were loaded (see orders/reservations.py)
+    reserve_stock(order, order_items)
+
+    return order
 
 
 class OrderItemSerializer(serializers.Serializer):
     product = ProductSerializer()
+    variant = ProductVariantSerializer(allow_null=True)
     amount = serializers.IntegerField(max_value=32767, min_value=0)
 
 
@@ -16,6 +150,7 @@ class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True)
     status = serializers.CharField(source='get_status_display')
 
+    @transaction.atomic
     def create(data, customer):
         '''
         It may seem like we shouldn't make another iteration on the given array for getting products from
@@ -27,65 +162,48 @@ class OrderSerializer(serializers.ModelSerializer):
         (or even IDs that never been existing), so we need to check every item from list for existing.
         And we actually want to summarize the costs of the items to get the final cost of an order, so we can 
         use this iteration to kill two birds with one stone.
+
+        The products (and the variants) of all the items are loaded with one query, the items are inserted
+        with one more, so the number of queries does not depend on the number of items. Everything is done
+        in one transaction: an order is never left without some of its items.
         '''
 
         raw_items = data['items']
         items = []
-        final_cost = 0.0
-
-        for item in raw_items:
-            '''
-            Making the database requests in a loop is the bad tone and it's bad for perfomance, but 
-            this behaviour is needed because we need to ensure that every product that user wants to buy exists and we
-            can achieve it by checking products manually, request by request.
-
-            The alternative of this is using an one SQL request which may look like:
-            SELECT . from products WHERE id IN [1, 2, ...raw items IDs]
-            But this approach does not throw any error if the user passed the product that does not
-            exist as it simply filters given IDs and skips those ones that are not in the database.
-            '''
-            product = Product.objects.get(id=item['product']['id'])
-
-            # Here we must check that an user cannot buy more products than is available in the database.
-            if (product.amount_remaining < item['amount']):
-                raise ValidationError(
-                    f'The quantity of product with ID {product.id} is not enough to add this amount to the order.'
-                )
-
-            final_cost += round(float(product.price) * item['amount'], 2)
-            items.append({'product': product, 'amount': item['amount']})
 
         if not len(raw_items):
             raise ValidationError(
                 'Field \'items\' must contain at least one product.'
             )
 
-        order = models.Order(
-            customer=customer,
-            final_cost=final_cost,
-            address_to_send=data['address_to_send'],
-            email=data['email'],
-            first_name=data['first_name'],
-            last_name=data['last_name'],
-            mobile_number=data['mobile_number'],
-        )
-
-        order.save()
-        '''
-        And now we need to iterate items one more time to add them to order.
-        We could not make it before, because we did not create any order yet, but we was in
-        need of first iteration because of we were summarizing final cost of whole order (and order
-        cannot be created without final_cost field)
-        
-        TODO: Rewrite final cost field as getter in Order model to avoid it. (#e3eae90a)
-        '''
-        for item in items:
-            order_item = models.OrderItem(
-                product=item['product'], amount=item['amount'], order=order
+        product_ids = [item['product']['id'] for item in raw_items]
+        products = get_by_ids(Product, product_ids)
+        missing_ids = [
+            str(product_id) for product_id in dict.fromkeys(product_ids)
+            if str(product_id) not in products
+        ]
+
+        # All the missing products are reported at once, not only the first one
+        if missing_ids:
+            raise Product.DoesNotExist(
+                f'Products with IDs {", ".join(missing_ids)} were not found.'
+            )
+
+        variants = get_variants(products.values())
+
+        for item in raw_items:
+            product = products[str(item['product']['id'])]
+            variant_id = item['variant']['id'] if item.get('variant') is not None else None
+
+            items.append(
+                {
+                    'product': product,
+                    'variant': get_item_variant(product, variant_id, variants),
+                    'amount': item['amount']
+                }
             )
-            order_item.save()
 
-        return order
+        return place_order(data, customer, items)
 
     class Meta:
         model = models.Order
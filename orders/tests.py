@@ -12,10 +12,28 @@
 # login:password is still alive and works, but obstinate APITestCase.client.login() method does not
 # trust in this. This is why I add that ugly string to every request a test do.
 
+import random
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from uuid import uuid4
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TransactionTestCase
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import ValidationError
 from rest_framework.test import APITestCase
-from products.models import Category, Product
+from payments.models import Payment
+from products.models import Category, Product, ProductVariant
+from users.models import CartItem
 from . import models, serializers
+from .recommendations import rebuild_co_purchases, record_order
+from .reservations import confirm_reservation, take_stock
+from .archive import archive_chunk
+from .transitions import transition_order, transition_orders
 
 test_data = {
     'valid order':
@@ -434,6 +452,547 @@ class OrderCreatingTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data[0].code, 'invalid')
 
+    def test_create_order_with_variant(self):
+        '''
+        Ensure that we can order a variant of a product and its own stock is checked
+        '''
+        variant = ProductVariant.objects.create(
+            product=self.p1, size='M', color='black', amount_remaining=2
+        )
+        other_variant = ProductVariant.objects.create(
+            product=self.p2, size='M', color='black', amount_remaining=2
+        )
+
+        for item_variant, amount, expected_status in [
+            (other_variant, 1, status.HTTP_400_BAD_REQUEST),
+            (variant, 3, status.HTTP_400_BAD_REQUEST),
+            (variant, 2, status.HTTP_201_CREATED),
+        ]:
+            response = self.client.post(
+                '/order', {
+                    **test_data['valid order'], 'items':
+                        [{
+                            'product': {
+                                'id': self.p1.id,
+                            },
+                            'variant': {
+                                'id': item_variant.id,
+                            },
+                            'amount': amount
+                        }]
+                },
+                format='json',
+                HTTP_AUTHORIZATION=self.token_1
+            )
+
+            self.assertEqual(response.status_code, expected_status)
+
+        self.assertEqual(response.data['items'][0]['variant']['id'], variant.id)
+        self.assertEqual(models.OrderItem.objects.get().variant, variant)
+
+
+class OrderBatchCreatingTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category(**test_data['category'])
+        self.c1.save()
+
+        self.products = [
+            Product.objects.create(**test_data['product 1'], category=self.c1) for _ in range(20)
+        ]
+        self.customer = User.objects.create_user(**test_data['user data 1'])
+
+    def get_order_data(self, product_ids):
+        return {
+            **test_data['valid order'], 'items':
+                [{
+                    'product': {
+                        'id': product_id
+                    },
+                    'amount': 1
+                } for product_id in product_ids]
+        }
+
+    def test_queries_do_not_depend_on_items_count(self):
+        '''
+        Ensure that an order is created with the same number of queries however many items it has
+        '''
+        # The products and their variants, the order, the items, taking the stock of all of them, the categories
+        # of the products to invalidate the cache, the reservation and two pairs of savepoint queries
+        for products in [self.products[:1], self.products]:
+            with self.assertNumQueries(11):
+                order = serializers.OrderSerializer.create(
+                    self.get_order_data([product.id for product in products]), self.customer
+                )
+
+            self.assertEqual(order.items.count(), len(products))
+            self.assertAlmostEqual(order.final_cost, test_data['product 1']['price'] * len(products))
+
+    def test_missing_products_are_listed(self):
+        '''
+        Ensure that all the missing products are reported and nothing is saved
+        '''
+        with self.assertRaisesMessage(Product.DoesNotExist, 'Products with IDs 999998, 999999 were not found.'):
+            serializers.OrderSerializer.create(
+                self.get_order_data([self.products[0].id, 999998, 999999]), self.customer
+            )
+
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_benchmark_command(self):
+        '''
+        Ensure that the order benchmark runs and does not leave anything in the database
+        '''
+        stdout = StringIO()
+        call_command('benchmark_orders', sizes=[1, 5], repeat=1, stdout=stdout)
+
+        self.assertIn('queries', stdout.getvalue())
+        self.assertFalse(models.Order.objects.exists())
+        self.assertEqual(Product.objects.count(), len(self.products))
+
+
+class CartCheckoutTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category.objects.create(**test_data['category'])
+        self.p1 = Product.objects.create(**test_data['product 1'], category=self.c1)
+        self.p2 = Product.objects.create(**test_data['product 2'], category=self.c1)
+        self.variant = ProductVariant.objects.create(
+            product=self.p2, size='M', color='black', amount_remaining=5
+        )
+
+        self.tokens = []
+
+        for user_data in [test_data['user data 1'], test_data['user data 2']]:
+            self.client.post('/register', user_data, format='json')
+            self.tokens.append(
+                'Token ' + self.client.post('/token', user_data, format='json').data['token']
+            )
+
+        self.customer = User.objects.get(username=test_data['user data 1']['username'])
+
+    def fill_cart(self, p1_amount=3, variant_amount=2):
+        CartItem.objects.bulk_create(
+            [
+                CartItem(owner=self.customer, product=self.p1, amount=p1_amount),
+                CartItem(
+                    owner=self.customer, product=self.p2, variant=self.variant, amount=variant_amount
+                ),
+            ]
+        )
+
+    def checkout(self, data=None, token=None):
+        return self.client.post(
+            f'/users/{self.customer.id}/cart/checkout',
+            data or test_data['valid order'],
+            format='json',
+            HTTP_AUTHORIZATION=token or self.tokens[0],
+        )
+
+    def test_checkout(self):
+        '''
+        Ensure that an order is made of the cart items, their stock is reserved and the cart is emptied
+        '''
+        self.fill_cart()
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            sorted(
+                (item['product']['id'], item['variant'] and item['variant']['id'], item['amount'])
+                for item in response.data['items']
+            ),
+            [(self.p1.id, None, 3), (self.p2.id, self.variant.id, 2)],
+        )
+        self.assertAlmostEqual(
+            response.data['final_cost'],
+            test_data['product 1']['price'] * 3 + test_data['product 2']['price'] * 2,
+        )
+        self.assertFalse(CartItem.objects.exists())
+        self.assertTrue(models.StockReservation.objects.filter(order_id=response.data['id']).exists())
+
+        self.p1.refresh_from_db()
+        self.variant.refresh_from_db()
+        self.assertEqual(self.p1.amount_remaining, test_data['product 1']['amount_remaining'] - 3)
+        self.assertEqual(self.variant.amount_remaining, 3)
+
+    def test_checkout_without_variant(self):
+        '''
+        Ensure that a cart item of a product with variants can not be checked out without a variant
+        '''
+        CartItem.objects.create(owner=self.customer, product=self.p2, amount=2)
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(models.Order.objects.exists())
+        self.assertEqual(CartItem.objects.count(), 1)
+
+    def test_checkout_of_empty_cart(self):
+        '''
+        Ensure that an empty cart can not be checked out
+        '''
+        response = self.checkout()
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_failed_checkout_keeps_cart(self):
+        '''
+        Ensure that nothing is ordered and the cart is kept if the checkout fails
+        '''
+        self.fill_cart(variant_amount=6)
+
+        for data in [None, test_data['order with no email']]:
+            with self.subTest(data=data):
+                response = self.checkout(data)
+
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertFalse(models.Order.objects.exists())
+                self.assertEqual(CartItem.objects.count(), 2)
+
+        self.variant.refresh_from_db()
+        self.assertEqual(self.variant.amount_remaining, 5)
+
+    def test_checkout_of_other_cart(self):
+        '''
+        Ensure that a user can not check out the cart of another user
+        '''
+        self.fill_cart()
+        response = self.checkout(token=self.tokens[1])
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(CartItem.objects.count(), 2)
+
+    def test_queries_do_not_depend_on_cart_size(self):
+        '''
+        Ensure that a cart is checked out with the same number of queries however many items it has
+        '''
+        products = [
+            Product.objects.create(**test_data['product 1'], category=self.c1) for _ in range(20)
+        ]
+
+        # The token, the cart with the products, their variants, the order, its items, taking the stock (with the categories
+        # of the products to invalidate the cache), the reservation, emptying the cart, two pairs of savepoint
+        # queries, the number of the reviews of the customer and the items of the response
+        for cart_products in [products[:1], products]:
+            CartItem.objects.bulk_create(
+                CartItem(owner=self.customer, product=product, amount=1) for product in cart_products
+            )
+
+            with self.assertNumQueries(15):
+                response = self.checkout()
+
+            self.assertEqual(len(response.data['items']), len(cart_products))
+
+    def test_benchmark_command(self):
+        '''
+        Ensure that the checkout benchmark runs and does not leave anything in the database
+        '''
+        stdout = StringIO()
+        call_command('benchmark_checkout', sizes=[1, 5], repeat=1, stdout=stdout)
+
+        self.assertIn('queries', stdout.getvalue())
+        self.assertFalse(models.Order.objects.exists())
+        self.assertFalse(CartItem.objects.exists())
+
+
+class StockReservationTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category(**test_data['category'])
+        self.c1.save()
+
+        self.p1 = Product.objects.create(**test_data['product 1'], category=self.c1)
+        self.p2 = Product.objects.create(**test_data['product 2'], category=self.c1)
+        self.variant = ProductVariant.objects.create(
+            product=self.p2, size='M', color='black', amount_remaining=5
+        )
+        self.customer = User.objects.create_user(**test_data['user data 1'])
+
+    def create_order(self, p1_amount, variant_amount):
+        return serializers.OrderSerializer.create(
+            {
+                **test_data['valid order'], 'items':
+                    [
+                        {
+                            'product': {
+                                'id': self.p1.id
+                            },
+                            'amount': p1_amount
+                        },
+                        {
+                            'product': {
+                                'id': self.p2.id
+                            },
+                            'variant': {
+                                'id': self.variant.id
+                            },
+                            'amount': variant_amount
+                        },
+                    ]
+            }, self.customer
+        )
+
+    def assertStock(self, p1_amount, variant_amount):
+        self.p1.refresh_from_db()
+        self.p2.refresh_from_db()
+        self.variant.refresh_from_db()
+
+        self.assertEqual(self.p1.amount_remaining, p1_amount)
+        self.assertEqual(self.variant.amount_remaining, variant_amount)
+        # The stock of a product with variants is the total stock of its variants
+        self.assertEqual(self.p2.amount_remaining, variant_amount)
+
+    def test_product_with_variants_is_ordered_by_variant(self):
+        '''
+        Ensure that a product with variants can not be ordered without a variant, so its stock can not come back
+        when it is recalculated from the variants
+        '''
+        with self.assertRaisesMessage(ValidationError, 'one of them must be chosen'):
+            serializers.OrderSerializer.create(
+                {
+                    **test_data['valid order'], 'items': [{
+                        'product': {
+                            'id': self.p2.id
+                        },
+                        'amount': 2
+                    }]
+                }, self.customer
+            )
+
+        self.assertFalse(models.Order.objects.exists())
+        self.assertStock(30, 5)
+
+    def test_stock_is_reserved(self):
+        '''
+        Ensure that the stock is taken when an order is created and the reservation is confirmed on payment
+        '''
+        order = self.create_order(10, 2)
+
+        self.assertStock(20, 3)
+        self.assertGreater(order.reservation.expires_at, timezone.now())
+        self.assertTrue(confirm_reservation(order))
+        self.assertFalse(models.StockReservation.objects.exists())
+        self.assertStock(20, 3)
+
+    def test_not_enough_stock(self):
+        '''
+        Ensure that nothing is taken if any item of an order is not available
+        '''
+        take_stock(models.OrderItem(product=self.p2, variant=self.variant, amount=4) for _ in range(1))
+
+        with self.assertRaises(ValidationError):
+            self.create_order(1, 2)
+
+        self.assertStock(30, 1)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_expired_reservations_are_released(self):
+        '''
+        Ensure that the stock of an expired reservation is returned once and taken again if the order is paid later
+        '''
+        order = self.create_order(10, 2)
+        models.StockReservation.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        for _ in range(2):
+            call_command('release_expired_reservations', stdout=StringIO())
+            self.assertStock(30, 5)
+
+        self.assertFalse(confirm_reservation(order))
+        take_stock(order.items.all())
+        self.assertStock(20, 3)
+
+
+class IdempotencyTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category(**test_data['category'])
+        self.c1.save()
+
+        self.p1 = Product.objects.create(**test_data['product 1'], category=self.c1)
+
+        self.tokens = []
+
+        for user_data in [test_data['user data 1'], test_data['user data 2']]:
+            self.client.post('/register', user_data, format='json')
+            self.tokens.append(
+                'Token ' + self.client.post('/token', user_data, format='json').data['token']
+            )
+
+    def create_order(self, key, amount=2, token=None, data=None):
+        return self.client.post(
+            '/order',
+            data or {
+                **test_data['valid order'], 'items': [{
+                    'product': {
+                        'id': self.p1.id
+                    },
+                    'amount': amount
+                }]
+            },
+            format='json',
+            HTTP_AUTHORIZATION=token or self.tokens[0],
+            HTTP_IDEMPOTENCY_KEY=key,
+        )
+
+    def test_repeated_order_is_created_once(self):
+        '''
+        Ensure that a repeated request with the same idempotency key gets the same response and creates nothing
+        '''
+        response = self.create_order('first order')
+        repeated_response = self.create_order('first order')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(repeated_response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(repeated_response.data, response.data)
+        self.assertEqual(repeated_response['Idempotent-Replayed'], 'true')
+        self.assertEqual(models.Order.objects.count(), 1)
+
+        self.p1.refresh_from_db()
+        self.assertEqual(self.p1.amount_remaining, test_data['product 1']['amount_remaining'] - 2)
+
+    def test_key_reused_for_other_request(self):
+        '''
+        Ensure that an idempotency key can not be used for a request with other data
+        '''
+        self.create_order('first order')
+        response = self.create_order('first order', amount=3)
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_keys_of_users_are_separate(self):
+        '''
+        Ensure that the same idempotency key of two users does not give one of them the order of another
+        '''
+        self.create_order('order')
+        response = self.create_order('order', token=self.tokens[1])
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(models.Order.objects.count(), 2)
+
+    def test_failed_request_is_not_stored(self):
+        '''
+        Ensure that a request can be fixed and retried with the same idempotency key if it failed
+        '''
+        response = self.create_order('order', data=test_data['order with no items'])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.create_order('order')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_abandoned_key_is_claimed_again(self):
+        '''
+        Ensure that a key whose request never got a response is not held after the lock timeout
+        '''
+        self.create_order('order')
+        # The worker died before it stored the response, and the transaction of the order was rolled back
+        models.IdempotencyKey.objects.update(response_status=None, response_data=None)
+        models.Order.objects.all().delete()
+
+        self.assertEqual(self.create_order('order').status_code, status.HTTP_409_CONFLICT)
+
+        models.IdempotencyKey.objects.update(created=timezone.now() - timedelta(minutes=2))
+        response = self.create_order('order')
+        repeated_response = self.create_order('order')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(repeated_response.data, response.data)
+        self.assertEqual(repeated_response['Idempotent-Replayed'], 'true')
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_expired_key_is_not_replayed(self):
+        '''
+        Ensure that a key older than IDEMPOTENCY_KEY_TTL is not replayed even if it was not purged yet
+        '''
+        self.create_order('order')
+        models.IdempotencyKey.objects.update(created=timezone.now() - timedelta(days=2))
+
+        response = self.create_order('order')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(models.Order.objects.count(), 2)
+        self.assertEqual(models.IdempotencyKey.objects.get().response_data['id'], response.data['id'])
+
+    def test_purge_keys(self):
+        '''
+        Ensure that the expired idempotency keys are deleted
+        '''
+        self.create_order('old order')
+        models.IdempotencyKey.objects.update(created=timezone.now() - timedelta(days=2))
+        self.create_order('new order')
+
+        call_command('purge_idempotency_keys', stdout=StringIO())
+
+        self.assertEqual(
+            list(models.IdempotencyKey.objects.values_list('key', flat=True)),
+            [f'order:{models.Order.objects.last().customer_id}:new order'],
+        )
+
+
+class StockContentionTest(TransactionTestCase):
+    def setUp(self) -> None:
+        self.c1 = Category.objects.create(**test_data['category'])
+        self.product = Product.objects.create(
+            **{
+                **test_data['product 1'], 'amount_remaining': 5
+            }, category=self.c1
+        )
+        self.customers = [
+            User.objects.create_user(f'customer {index}', f'customer{index}@example.com', 'password')
+            for index in range(20)
+        ]
+
+    def test_no_oversell(self):
+        '''
+        Ensure that concurrent orders never take more stock than there is
+        '''
+        barrier = threading.Barrier(len(self.customers))
+        results = []
+
+        def buy(customer):
+            barrier.wait()
+
+            try:
+                while True:
+                    try:
+                        serializers.OrderSerializer.create(
+                            {
+                                **test_data['valid order'], 'items':
+                                    [{
+                                        'product': {
+                                            'id': self.product.id
+                                        },
+                                        'amount': 2
+                                    }]
+                            }, customer
+                        )
+                        results.append(True)
+                        return
+                    except ValidationError:
+                        results.append(False)
+                        return
+                    except OperationalError:
+                        # SQLite locks the whole database instead of the rows, the order is retried then
+                        # (the transaction is rolled back, so nothing is left from the failed attempt)
+                        time.sleep(random.random() / 100)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=buy, args=[customer]) for customer in self.customers]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+
+        # 5 pieces are enough for two orders of 2 pieces, every customer got either an order or an error
+        self.assertEqual(len(results), len(self.customers))
+        self.assertEqual(results.count(True), 2)
+        self.assertEqual(models.Order.objects.count(), 2)
+        self.assertEqual(self.product.amount_remaining, 1)
+
 
 class OrderDetailTest(APITestCase):
     def setUp(self) -> None:
@@ -587,3 +1146,568 @@ class OrderDetailTest(APITestCase):
         expected_result = serializers.OrderSerializer(order_model)
 
         self.assertEqual(response.data, expected_result.data)
+
+
+class OrderListTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category.objects.create(**test_data['category'])
+        self.p1 = Product.objects.create(**test_data['product 1'], category=self.c1)
+        self.p2 = Product.objects.create(**test_data['product 2'], category=self.c1)
+
+        self.customer = User.objects.create_user(**test_data['user data 1'])
+        self.other_customer = User.objects.create_user(**test_data['user data 2'])
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+        self.tokens = {}
+
+        for user_data in [test_data['user data 1'], test_data['user data 2']]:
+            self.tokens[user_data['username']] = 'Token ' + self.client.post(
+                '/token', user_data, format='json'
+            ).data['token']
+
+        now = timezone.now()
+
+        # Orders from the oldest to the newest, one a day
+        self.orders = [
+            self.create_order(self.customer, status, now - timedelta(days=5 - index))
+            for index, status in enumerate(['D', 'D', 'P', 'C', 'P'])
+        ]
+        self.create_order(self.other_customer, 'C', now)
+
+    def create_order(self, customer, status, created):
+        order = models.Order.objects.create(
+            **test_data['valid order'], customer=customer, final_cost=11.28, status=status
+        )
+        models.OrderItem.objects.bulk_create(
+            [
+                models.OrderItem(order=order, product=self.p1, amount=1),
+                models.OrderItem(order=order, product=self.p2, amount=1),
+            ]
+        )
+
+        # "created" is set automatically on every save, so the date is changed with an update
+        models.Order.objects.filter(id=order.id).update(created=created)
+
+        return order
+
+    def get_orders(self, query='', token=None):
+        return self.client.get(
+            f'/users/{self.customer.id}/orders{query}',
+            HTTP_AUTHORIZATION=token or self.tokens['test1'],
+        )
+
+    def test_get_orders(self):
+        '''
+        Ensure that a customer gets their orders, the newest go first
+        '''
+        response = self.get_orders()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [order['id'] for order in response.data],
+            [order.id for order in reversed(self.orders)],
+        )
+        self.assertEqual(len(response.data[0]['items']), 2)
+        self.assertEqual(response.data[0]['customer']['id'], self.customer.id)
+
+    def test_pagination(self):
+        '''
+        Ensure that the orders can be read page by page with the cursors in both directions
+        '''
+        order_ids = []
+        url = f'/users/{self.customer.id}/orders?page_size=2&ordering=created'
+
+        while url is not None:
+            response = self.client.get(url, HTTP_AUTHORIZATION=self.tokens['test1'])
+            order_ids.extend(order['id'] for order in response.data)
+            link = response.get('Link', '')
+
+            # The link to the next page goes first
+            url = link.split(';')[0].strip('<>') if 'rel="next"' in link else None
+
+        self.assertEqual(order_ids, [order.id for order in self.orders])
+
+    def test_filters(self):
+        '''
+        Ensure that the orders can be filtered by their statuses and by the dates of their creation
+        '''
+        self.assertEqual(
+            [order['id'] for order in self.get_orders('?status=P,C').data],
+            [self.orders[4].id, self.orders[3].id, self.orders[2].id],
+        )
+
+        created_after = (timezone.now() - timedelta(days=3, hours=1)).isoformat().replace('+', '%2B')
+        created_before = (timezone.now() - timedelta(days=1, hours=1)).isoformat().replace('+', '%2B')
+
+        self.assertEqual(
+            [
+                order['id'] for order in
+                self.get_orders(f'?created_after={created_after}&created_before={created_before}').data
+            ],
+            [self.orders[3].id, self.orders[2].id],
+        )
+
+    def test_invalid_filters(self):
+        '''
+        Ensure that the invalid statuses and dates are refused
+        '''
+        for query in ['?status=X', '?status=P,', '?created_after=yesterday', '?created_before=2021-13-01']:
+            with self.subTest(query=query):
+                self.assertEqual(self.get_orders(query).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_orders_of_other_customer(self):
+        '''
+        Ensure that only the customer and the admins can get the orders of the customer
+        '''
+        self.assertEqual(
+            self.get_orders(token=self.tokens['test2']).status_code, status.HTTP_403_FORBIDDEN
+        )
+        self.assertEqual(
+            self.client.get(f'/users/{self.customer.id}/orders').status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(f'/users/{self.customer.id}/orders')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), len(self.orders))
+
+    def test_queries_do_not_depend_on_page_size(self):
+        '''
+        Ensure that a page of orders takes the same number of queries however many orders and items it has
+        '''
+        # The token, the customer, the orders and their items with the products, the categories and the variants
+        for page_size in [1, len(self.orders)]:
+            with self.assertNumQueries(4):
+                response = self.get_orders(f'?page_size={page_size}')
+
+            self.assertEqual(len(response.data), page_size)
+
+
+class OrderQueriesTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category.objects.create(**test_data['category'])
+        self.products = [
+            Product.objects.create(**test_data['product 1'], category=self.c1) for _ in range(20)
+        ]
+
+        self.client.post('/register', test_data['user data 1'], format='json')
+        self.token = 'Token ' + self.client.post(
+            '/token', test_data['user data 1'], format='json'
+        ).data['token']
+
+    def get_order_data(self, products):
+        return {
+            **test_data['valid order'], 'items':
+                [{
+                    'product': {
+                        'id': product.id
+                    },
+                    'amount': 1
+                } for product in products]
+        }
+
+    def test_order_detail_queries(self):
+        '''
+        Ensure that an order is shown with the same number of queries however many items it has
+        '''
+        # The token, the customer of the order for the permission, the order, its customer and its items
+        for products in [self.products[:1], self.products]:
+            order = serializers.OrderSerializer.create(
+                self.get_order_data(products), User.objects.get()
+            )
+
+            with self.assertNumQueries(5):
+                response = self.client.get(f'/order/{order.id}', HTTP_AUTHORIZATION=self.token)
+
+            self.assertEqual(len(response.data['items']), len(products))
+
+    def test_order_creating_queries(self):
+        '''
+        Ensure that an order is created and shown with the same number of queries however many items it has
+        '''
+        # The token, the creation itself (see OrderBatchCreatingTest), the number of the reviews
+        # of the customer and the items
+        for products in [self.products[:1], self.products]:
+            with self.assertNumQueries(14):
+                response = self.client.post(
+                    '/order',
+                    self.get_order_data(products),
+                    format='json',
+                    HTTP_AUTHORIZATION=self.token,
+                )
+
+            self.assertEqual(len(response.data['items']), len(products))
+
+
+class OrderTransitionsTest(APITestCase):
+    def setUp(self) -> None:
+        self.customer = User.objects.create_user(**test_data['user data 1'])
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+        # Two orders of every status
+        self.orders = {
+            status: [
+                models.Order.objects.create(
+                    **test_data['valid order'], customer=self.customer, final_cost=10, status=status
+                ) for _ in range(2)
+            ] for status in ['C', 'P', 'O', 'D']
+        }
+
+    def get_ids(self, *statuses):
+        return [order.id for status in statuses for order in self.orders[status]]
+
+    def assertStatuses(self, ids, status):
+        self.assertEqual(
+            list(models.Order.objects.filter(id__in=ids).values_list('status', flat=True)),
+            [status] * len(ids),
+        )
+
+    def test_transition_orders(self):
+        '''
+        Ensure that only the orders which can be moved to a status are moved and their changes are recorded
+        '''
+        moved_ids = transition_orders(self.get_ids('C', 'P', 'O', 'D'), 'O', changed_by=self.admin)
+
+        self.assertEqual(sorted(moved_ids), self.get_ids('P'))
+        self.assertStatuses(self.get_ids('P', 'O'), 'O')
+        self.assertStatuses(self.get_ids('C'), 'C')
+        self.assertStatuses(self.get_ids('D'), 'D')
+        self.assertEqual(
+            list(
+                models.OrderStatusChange.objects.order_by('order_id').values_list(
+                    'order_id', 'from_status', 'to_status', 'changed_by'
+                )
+            ),
+            [(order_id, 'P', 'O', self.admin.id) for order_id in self.get_ids('P')],
+        )
+
+    def test_transition_order(self):
+        '''
+        Ensure that an order can not skip a status or go back
+        '''
+        order = self.orders['C'][0]
+
+        for to_status in ['O', 'D', 'C']:
+            with self.subTest(to_status=to_status):
+                with self.assertRaises(ValidationError):
+                    transition_order(order, to_status)
+
+        with self.assertRaises(ValidationError):
+            transition_order(order, 'X')
+
+        transition_order(order, 'P')
+
+        self.assertEqual(order.status, 'P')
+        self.assertStatuses([order.id], 'P')
+        self.assertEqual(order.status_history.get().changed_by, None)
+
+    def test_queries_do_not_depend_on_orders_count(self):
+        '''
+        Ensure that any number of orders is moved with the same number of queries
+        '''
+        orders = models.Order.objects.bulk_create(
+            models.Order(**test_data['valid order'], customer=self.customer, final_cost=10, status='P')
+            for _ in range(50)
+        )
+        order_ids = list(models.Order.objects.filter(status='P').values_list('id', flat=True))
+
+        # Reading, updating and recording the orders and a pair of savepoint queries
+        for ids in [order_ids[:1], order_ids[1:]]:
+            with self.assertNumQueries(5):
+                self.assertEqual(len(transition_orders(ids, 'O')), len(ids))
+
+        self.assertEqual(models.OrderStatusChange.objects.count(), len(orders) + 2)
+
+    def test_transitions_endpoint(self):
+        '''
+        Ensure that the admins can move many orders at once and the other users can not
+        '''
+        data = {'orders': self.get_ids('O', 'C'), 'status': 'D'}
+
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(
+            self.client.post('/order/transitions', data, format='json').status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+        self.client.force_authenticate(self.admin)
+        response = self.client.post('/order/transitions', data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(response.data['changed']), self.get_ids('O'))
+        self.assertEqual(response.data['skipped'], self.get_ids('C'))
+        self.assertStatuses(self.get_ids('O'), 'D')
+
+    def test_invalid_transitions_request(self):
+        '''
+        Ensure that the orders can not be moved to an unknown status or paid by the staff
+        '''
+        self.client.force_authenticate(self.admin)
+
+        for data in [
+            {'orders': self.get_ids('C'), 'status': 'P'},
+            {'orders': self.get_ids('P'), 'status': 'X'},
+            {'orders': ['first'], 'status': 'O'},
+            {'status': 'O'},
+        ]:
+            with self.subTest(data=data):
+                response = self.client.post('/order/transitions', data, format='json')
+
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.assertFalse(models.OrderStatusChange.objects.exists())
+
+    def test_admin_action(self):
+        '''
+        Ensure that the admin action moves the selected orders
+        '''
+        self.client.force_login(self.admin)
+        response = self.client.post(
+            '/admin/orders/order/', {
+                'action': 'move_to_O',
+                '_selected_action': self.get_ids('P', 'D'),
+            }
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertStatuses(self.get_ids('P'), 'O')
+        self.assertStatuses(self.get_ids('D'), 'D')
+        self.assertEqual(models.OrderStatusChange.objects.count(), 2)
+
+
+class OrderArchiveTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category.objects.create(**test_data['category'])
+        self.p1 = Product.objects.create(**test_data['product 1'], category=self.c1)
+        self.p2 = Product.objects.create(**test_data['product 2'], category=self.c1)
+
+        self.tokens = []
+
+        for user_data in [test_data['user data 1'], test_data['user data 2']]:
+            self.client.post('/register', user_data, format='json')
+            self.tokens.append(
+                'Token ' + self.client.post('/token', user_data, format='json').data['token']
+            )
+
+        self.customer = User.objects.get(username=test_data['user data 1']['username'])
+        old = timezone.now() - timedelta(days=365)
+
+        self.old_delivered = [self.create_order(['P', 'O', 'D'], old) for _ in range(3)]
+        self.old_paid = self.create_order(['P'], old)
+        # An old order which was delivered only now
+        self.new_delivered = self.create_order(['P', 'O', 'D'], timezone.now())
+        models.Order.objects.filter(id=self.new_delivered.id).update(created=old)
+
+    def create_order(self, statuses, changed):
+        order = serializers.OrderSerializer.create(
+            {
+                **test_data['valid order'], 'items':
+                    [{
+                        'product': {
+                            'id': product.id
+                        },
+                        'amount': 1
+                    } for product in [self.p1, self.p2]]
+            }, self.customer
+        )
+
+        for to_status in statuses:
+            transition_order(order, to_status)
+
+        order.status_history.update(changed=changed)
+
+        return order
+
+    def get_order(self, order_id, token=None):
+        return self.client.get(f'/order/{order_id}', HTTP_AUTHORIZATION=token or self.tokens[0])
+
+    def test_archive_orders(self):
+        '''
+        Ensure that only the orders delivered long ago are moved to the archive with their items and status history
+        '''
+        old_ids = [order.id for order in self.old_delivered]
+        responses = [self.get_order(order_id).data for order_id in old_ids]
+        payment = Payment.objects.create(
+            order=self.old_delivered[0], payment_service_id=uuid4(), secret_key=uuid4(), paid=True
+        )
+
+        stdout = StringIO()
+        call_command('archive_orders', batch_size=2, stdout=stdout)
+
+        self.assertIn('3 orders are archived', stdout.getvalue())
+        self.assertEqual(
+            sorted(models.Order.objects.values_list('id', flat=True)),
+            [self.old_paid.id, self.new_delivered.id],
+        )
+        self.assertFalse(models.OrderItem.objects.filter(order_id__in=old_ids).exists())
+        self.assertFalse(models.OrderStatusChange.objects.filter(order_id__in=old_ids).exists())
+
+        archived_orders = list(models.ArchivedOrder.objects.order_by('id'))
+
+        self.assertEqual([order.id for order in archived_orders], old_ids)
+        self.assertEqual([order.data for order in archived_orders], responses)
+        self.assertEqual(
+            [change['to_status'] for change in archived_orders[0].status_history], ['P', 'O', 'D']
+        )
+        self.assertEqual(
+            archived_orders[0].payments, [
+                {
+                    'id': payment.id,
+                    'payment_service_id': str(payment.payment_service_id),
+                    'payment_page_url': None,
+                    'secret_key': str(payment.secret_key),
+                    'paid': True,
+                }
+            ]
+        )
+        self.assertEqual(archived_orders[1].payments, [])
+        self.assertFalse(Payment.objects.exists())
+
+    def test_archived_order_detail(self):
+        '''
+        Ensure that an archived order is shown the same way as before and only to its customer
+        '''
+        order_id = self.old_delivered[0].id
+        response = self.get_order(order_id)
+
+        call_command('archive_orders', stdout=StringIO())
+        archived_response = self.get_order(order_id)
+
+        self.assertEqual(archived_response.status_code, status.HTTP_200_OK)
+        self.assertEqual(archived_response.data, response.data)
+        self.assertEqual(
+            self.get_order(order_id, token=self.tokens[1]).status_code, status.HTTP_403_FORBIDDEN
+        )
+
+    def test_newest_order_is_not_archived(self):
+        '''
+        Ensure that the order with the highest ID stays in the hot table, so its ID is never given to a new order
+        '''
+        self.new_delivered.status_history.update(changed=timezone.now() - timedelta(days=365))
+        call_command('archive_orders', stdout=StringIO())
+
+        self.assertTrue(models.Order.objects.filter(id=self.new_delivered.id).exists())
+        self.assertEqual(models.ArchivedOrder.objects.count(), len(self.old_delivered))
+
+    def test_archive_chunk_queries(self):
+        '''
+        Ensure that a chunk of the orders is archived with the same number of queries however many orders it has
+        '''
+        # The newest order, the orders, their customers, items, status history and payments, inserting them
+        # into the archive, collecting the orders to delete, deleting them with their items, status history,
+        # reservations and payments, and a pair of savepoint queries
+        for batch_size in [1, 2]:
+            with self.assertNumQueries(15):
+                self.assertEqual(archive_chunk(timezone.now() - timedelta(days=1), batch_size), batch_size)
+
+    def test_rebuild_recommendations_with_archive(self):
+        '''
+        Ensure that the archived orders are still counted when the recommendations are rebuilt
+        '''
+        call_command('archive_orders', stdout=StringIO())
+
+        # Every order has both products, the new delivered one and the paid one are in the hot table
+        self.assertEqual(rebuild_co_purchases(), 2)
+        self.assertEqual(
+            set(models.CoPurchase.objects.values_list('count', flat=True)), {len(self.old_delivered) + 2}
+        )
+
+    def test_rebuild_recommendations_with_deleted_products(self):
+        '''
+        Ensure that the products deleted after their orders were archived are skipped when the recommendations
+        are rebuilt
+        '''
+        call_command('archive_orders', stdout=StringIO())
+
+        # The products of the hot orders can not be deleted, so one of the archived ones refers to a deleted one
+        archived_order = models.ArchivedOrder.objects.first()
+        archived_order.data['items'][1]['product']['id'] = 999999
+        archived_order.save()
+
+        self.assertEqual(rebuild_co_purchases(), 2)
+        self.assertEqual(
+            set(models.CoPurchase.objects.values_list('count', flat=True)), {len(self.old_delivered) + 1}
+        )
+
+
+class AlsoBoughtTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category(**test_data['category'])
+        self.c1.save()
+
+        self.p1 = Product(**test_data['product 1'], category=self.c1)
+        self.p2 = Product(**test_data['product 2'], category=self.c1)
+        self.p3 = Product(**test_data['product 2'], category=self.c1)
+
+        self.p1.save()
+        self.p2.save()
+        self.p3.save()
+
+        self.user = User.objects.create_user(**test_data['user data 1'])
+
+    def create_order(self, products, status='P'):
+        order = models.Order.objects.create(
+            **test_data['valid order'],
+            customer=self.user,
+            final_cost=10,
+            status=status
+        )
+
+        for product in products:
+            models.OrderItem.objects.create(order=order, product=product, amount=1)
+
+        return order
+
+    def get_also_bought(self, product):
+        response = self.client.get(
+            f'/categories/top%20clothes/{product.id}/also-bought',
+            HTTP_ACCEPT='application/json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        return [product['id'] for product in response.data]
+
+    def test_recommendations_of_paid_orders(self):
+        '''
+        Ensure that the products bought together more often go first
+        '''
+        record_order(self.create_order([self.p1, self.p2, self.p3]))
+        record_order(self.create_order([self.p1, self.p3]))
+        record_order(self.create_order([self.p2]))
+
+        self.assertEqual(self.get_also_bought(self.p1), [self.p3.id, self.p2.id])
+        self.assertEqual(self.get_also_bought(self.p2), [self.p1.id, self.p3.id])
+
+    def test_recommendations_in_one_query(self):
+        '''
+        Ensure that the recommendations are read with one query
+        '''
+        record_order(self.create_order([self.p1, self.p2, self.p3]))
+
+        with self.assertNumQueries(1):
+            self.get_also_bought(self.p1)
+
+    def test_recommendations_of_not_existing_product(self):
+        '''
+        Ensure that we get an error if the product does not exist
+        '''
+        response = self.client.get('/categories/top%20clothes/99999/also-bought')
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_rebuild_recommendations(self):
+        '''
+        Ensure that the rebuild command counts only the paid orders
+        '''
+        self.create_order([self.p1, self.p2])
+        self.create_order([self.p1, self.p2], status='D')
+        self.create_order([self.p1, self.p3], status='C')
+
+        call_command('rebuild_co_purchases', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(
+            models.CoPurchase.objects.get(product=self.p1, other_product=self.p2).count, 2
+        )
+        self.assertEqual(self.get_also_bought(self.p1), [self.p2.id])
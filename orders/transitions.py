@@ -0,0 +1,96 @@
+'''
+Status transitions of the orders.
+
+An order goes through its statuses in one direction only:
+Created -> Paid -> On the way -> Delivered
+
+Statuses are never changed with Order.save(), they are changed here, and every change is recorded
+in the status history (OrderStatusChange). Any number of orders are moved with a fixed number of queries:
+the orders which can be moved are locked and read with one query, moved with one
+UPDATE ... WHERE status IN (<allowed sources>) and their changes are recorded with one batched INSERT.
+So the staff can move thousands of orders at once (see the admin actions and POST /order/transitions).
+'''
+from django.db import transaction
+from rest_framework.exceptions import ValidationError
+from .models import STATUS_CHOICES, Order, OrderStatusChange
+
+# Status: statuses an order with this status can be moved to
+TRANSITIONS = {
+    'C': ['P'],
+    'P': ['O'],
+    'O': ['D'],
+    'D': [],
+}
+
+# Statuses the staff moves the orders to, an order becomes paid only when the payment service confirms it
+STAFF_STATUSES = ['O', 'D']
+
+STATUS_NAMES = dict(STATUS_CHOICES)
+
+
+def get_sources(to_status: str) -> list:
+    '''
+    Returns the statuses from which an order can be moved to the given one.
+    '''
+    if to_status not in TRANSITIONS:
+        raise ValidationError(
+            f'Unknown order status "{to_status}", the statuses are: {", ".join(TRANSITIONS)}.'
+        )
+
+    return [status for status, targets in TRANSITIONS.items() if to_status in targets]
+
+
+@transaction.atomic
+def transition_orders(order_ids, to_status: str, changed_by=None, batch_size: int = 500) -> list:
+    '''
+    Moves the orders with the given IDs to the given status. The orders which can not be moved
+    (e.g. an already delivered order can not be moved to "On the way") are left as they are.
+    Returns the IDs of the moved orders.
+    '''
+    sources = get_sources(to_status)
+    order_ids = list(dict.fromkeys(order_ids))
+    moved_ids = []
+
+    for start in range(0, len(order_ids), batch_size):
+        batch = order_ids[start:start + batch_size]
+
+        # The rows are locked, so they can not be moved by another transaction between the queries,
+        # and the UPDATE changes exactly the rows that were read
+        rows = list(
+            Order.objects.select_for_update().filter(id__in=batch, status__in=sources
+                                                    ).values_list('id', 'status')
+        )
+
+        if not rows:
+            continue
+
+        ids = [order_id for order_id, _ in rows]
+
+        Order.objects.filter(id__in=ids, status__in=sources).update(status=to_status)
+        OrderStatusChange.objects.bulk_create(
+            [
+                OrderStatusChange(
+                    order_id=order_id,
+                    from_status=from_status,
+                    to_status=to_status,
+                    changed_by=changed_by,
+                ) for order_id, from_status in rows
+            ]
+        )
+        moved_ids.extend(ids)
+
+    return moved_ids
+
+
+def transition_order(order, to_status: str, changed_by=None):
+    '''
+    Moves one order to the given status and updates the instance.
+    Raises ValidationError if the order can not be moved to this status.
+    '''
+    if not transition_orders([order.id], to_status, changed_by):
+        raise ValidationError(
+            f'Order with ID {order.id} can not be moved from status "{order.get_status_display()}" '
+            f'to "{STATUS_NAMES.get(to_status, to_status)}".'
+        )
+
+    order.status = to_status
@@ -5,4 +5,11 @@ from . import views
 urlpatterns = [
     path('order', views.OrderCreator.as_view()),
     path('order/<int:order_id>', views.OrderDetail.as_view()),
+    path('order/transitions', views.OrderTransitions.as_view()),
+    path('users/<int:user_id>/orders', views.OrderList.as_view()),
+    path('users/<int:user_id>/cart/checkout', views.CartCheckout.as_view()),
+    path(
+        'categories/<str:category_name>/<int:product_id>/also-bought',
+        views.AlsoBought.as_view()
+    ),
 ]
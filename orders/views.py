@@ -1,14 +1,28 @@
+from datetime import datetime, time
+from django.contrib.auth.models import User
+from django.db.models import Count, prefetch_related_objects
+from django.utils import timezone
+from django.http import Http404
+from django.utils.dateparse import parse_date, parse_datetime
 from rest_framework import status, generics
 from rest_framework.exceptions import NotFound, ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
-from rest_framework.renderers import JSONRenderer
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
 from rest_framework.parsers import JSONParser
 from rest_framework.authentication import TokenAuthentication, BasicAuthentication
-from .permissions import IsOrderOwnerOrAdmin
-from .models import Order
-from .serializers import OrderSerializer
+from .archive import get_archived_order_data
+from .checkout import checkout_cart
+from .idempotency import idempotent
+from .permissions import IsCustomerOrAdmin, IsOrderOwnerOrAdmin
+from .models import STATUS_CHOICES, Order
+from .recommendations import get_also_bought
+from .serializers import OrderSerializer, get_order_items_prefetch, get_order_prefetches
+from .transitions import STAFF_STATUSES, transition_orders
 from products.models import Product
+from products.pagination import OrderKeysetPagination
+from users.permissions import IsOwner
+from products.serializers import ProductSerializer
 
 
 class OrderCreator(generics.CreateAPIView):
@@ -25,6 +39,8 @@ class OrderCreator(generics.CreateAPIView):
         "email": <str>,
     }
 
+    Requests with the Idempotency-Key header are handled once, see orders/idempotency.py.
+
     ---
 
     This class does not implement handlers for any GET methods because there's only two ways
@@ -43,9 +59,11 @@ class OrderCreator(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     authentication_classes = [TokenAuthentication, BasicAuthentication]
 
+    @idempotent('order')
     def create(self, request):
         try:
             order = OrderSerializer.create(request.data, request.user)
+            prefetch_related_objects([order], *get_order_prefetches())
             order_serialized = OrderSerializer(order)
 
             return Response(
@@ -59,15 +77,237 @@ class OrderCreator(generics.CreateAPIView):
             raise ValidationError('Field \'items\' must be array of products')
 
 
+class CartCheckout(generics.CreateAPIView):
+    '''
+    It creates an order of the items of the cart of the user with ID <user_id> and empties the cart
+    (see orders/checkout.py). The request body contains only the delivery details:
+
+    {
+        "address_to_send": <str>,
+        "mobile_number": <str>,
+        "first_name": <str>,
+        "last_name": <str>,
+        "email": <str>,
+    }
+
+    Example of using: /users/2/cart/checkout (the request must have a POST method)
+    Requests with the Idempotency-Key header are handled once, see orders/idempotency.py.
+    '''
+    serializer_class = OrderSerializer
+    parser_classes = [JSONParser]
+    renderer_classes = [JSONRenderer]
+    permission_classes = [IsAuthenticated, IsOwner]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+
+    @idempotent('checkout')
+    def create(self, request, user_id):
+        try:
+            order = checkout_cart(request.data, request.user)
+            prefetch_related_objects([order], *get_order_prefetches())
+
+            return Response(
+                data=OrderSerializer(order).data, status=status.HTTP_201_CREATED
+            )
+        except KeyError as e:
+            raise ValidationError(f'Field {e} was not provided.')
+
+
 class OrderDetail(generics.RetrieveAPIView):
     '''
     This class is responsible for /order/<order_id> endpoint. It responses with order details on GET requests.
     To get these details you must be logged in as customer of this order or as an admin.
+    An order is rendered with the same number of queries however many items it has.
+    The old delivered orders are taken from the archive (see orders/archive.py).
     '''
-    queryset = Order.objects.all()
+    queryset = Order.objects.prefetch_related(*get_order_prefetches())
     serializer_class = OrderSerializer
     parser_classes = [JSONParser]
     renderer_classes = [JSONRenderer]
     lookup_url_kwarg = 'order_id'
     permission_classes = [IsAuthenticated, IsOrderOwnerOrAdmin]
     authentication_classes = [TokenAuthentication, BasicAuthentication]
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            return super().retrieve(request, *args, **kwargs)
+        except Http404:
+            data = get_archived_order_data(kwargs['order_id'])
+
+            if data is None:
+                raise
+
+            return Response(data)
+
+
+class OrderList(generics.ListAPIView):
+    '''
+    It responses with the orders of the customer with ID <user_id>, the newest orders go first.
+    Only the customer and the admins can get them.
+    Example of using: /users/2/orders?status=P,O&created_after=2021-09-01
+
+    Optional query parameters:
+    - "status": comma-separated codes of the statuses (C, P, O, D);
+    - "created_after" and "created_before": dates (or dates and times) in ISO 8601 format;
+    - "ordering": "-created" (by default) or "created".
+
+    Orders are paginated with cursors, links to the neighbouring pages are placed in the "Link" header.
+    A page takes the same number of queries whatever its size: the orders, their items (with the products,
+    the categories and the variants) and the customer are loaded with one query each.
+    '''
+    serializer_class = OrderSerializer
+    renderer_classes = [JSONRenderer]
+    pagination_class = OrderKeysetPagination
+    permission_classes = [IsAuthenticated, IsCustomerOrAdmin]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+
+    def get_customer(self):
+        user_id = self.kwargs['user_id']
+
+        # All the orders of the page share one customer, so the number of their reviews is counted once
+        customer = User.objects.annotate(commentaries_count=Count('commentaries')
+                                        ).filter(id=user_id).first()
+
+        if customer is None:
+            raise NotFound(f'User with ID { user_id } was not found.')
+
+        return customer
+
+    def get_queryset(self):
+        queryset = Order.objects.filter(customer_id=self.kwargs['user_id']
+                                       ).prefetch_related(get_order_items_prefetch())
+        statuses = self.request.query_params.get('status')
+        created_after = self.get_datetime_param('created_after')
+        created_before = self.get_datetime_param('created_before')
+
+        if statuses is not None:
+            statuses = statuses.split(',')
+            known_statuses = [code for code, _ in STATUS_CHOICES]
+
+            if not set(statuses).issubset(known_statuses):
+                raise ValidationError(
+                    f'Parameter "status" must contain only these codes: {", ".join(known_statuses)}.'
+                )
+
+            queryset = queryset.filter(status__in=statuses)
+
+        if created_after is not None:
+            queryset = queryset.filter(created__gte=created_after)
+
+        if created_before is not None:
+            queryset = queryset.filter(created__lt=created_before)
+
+        return queryset
+
+    def get_datetime_param(self, name: str):
+        '''
+        Parses a date or a date and time from the query parameter. A date means its midnight.
+        '''
+        value = self.request.query_params.get(name)
+
+        if value is None:
+            return None
+
+        try:
+            parsed = parse_datetime(value) or parse_date(value)
+        except ValueError:
+            parsed = None
+
+        if parsed is None:
+            raise ValidationError(
+                f'Parameter "{name}" must be a date or a date and time in ISO 8601 format.'
+            )
+
+        if not isinstance(parsed, datetime):
+            parsed = datetime.combine(parsed, time.min)
+
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+
+        return parsed
+
+    def list(self, request, *args, **kwargs):
+        customer = self.get_customer()
+        orders = self.paginate_queryset(self.get_queryset())
+
+        for order in orders:
+            order.customer = customer
+
+        serializer = self.get_serializer(orders, many=True)
+
+        return self.paginator.get_paginated_response(serializer.data)
+
+
+class OrderTransitions(generics.GenericAPIView):
+    '''
+    It moves many orders to another status at once (see orders/transitions.py), only the admins can do it.
+    To move orders, send POST request to /order/transitions with following schema in request body:
+
+    {
+        "orders": <int[]: order IDs>,
+        "status": <str: status code, "O" or "D">,
+    }
+
+    The orders which can not be moved to the status are skipped, the response lists the changed
+    and the skipped IDs.
+    '''
+    MAX_ORDERS = 10000
+
+    parser_classes = [JSONParser]
+    renderer_classes = [JSONRenderer]
+    permission_classes = [IsAdminUser]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+
+    def post(self, request):
+        try:
+            order_ids = [int(order_id) for order_id in request.data['orders']]
+            to_status = request.data['status']
+        except KeyError as e:
+            raise ValidationError(f'Field {e} was not provided.')
+        except (TypeError, ValueError):
+            raise ValidationError('Field \'orders\' must be array of order IDs.')
+
+        if to_status not in STAFF_STATUSES:
+            raise ValidationError(
+                f'Orders can be moved only to these statuses: {", ".join(STAFF_STATUSES)}.'
+            )
+
+        if len(order_ids) > self.MAX_ORDERS:
+            raise ValidationError(f'No more than {self.MAX_ORDERS} orders can be moved at once.')
+
+        changed_ids = transition_orders(order_ids, to_status, changed_by=request.user)
+        changed = set(changed_ids)
+
+        return Response(
+            {
+                'status': to_status,
+                'changed': changed_ids,
+                'skipped': [order_id for order_id in dict.fromkeys(order_ids) if order_id not in changed],
+            }
+        )
+
+
+class AlsoBought(generics.ListAPIView):
+    '''
+    It responses with the products which are most often bought together with the product with ID equals
+    <product_id> (see orders/recommendations.py). The optional parameter "limit" sets the number of products.
+    Example of using: /categories/top%20clothes/5/also-bought?limit=5
+    '''
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 50
+
+    serializer_class = ProductSerializer
+    renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+
+    def list(self, request, category_name, product_id):
+        try:
+            limit = min(int(request.query_params['limit']), self.MAX_LIMIT)
+        except (KeyError, ValueError):
+            limit = self.DEFAULT_LIMIT
+
+        products = get_also_bought(product_id, max(limit, 1))
+
+        # There is nothing to recommend, but the product itself must exist
+        if not products and not Product.objects.filter(id=product_id).exists():
+            raise NotFound(f'Product with ID { product_id } was not found')
+
+        return Response(self.get_serializer(products, many=True).data)
@@ -1,7 +1,10 @@
+from django.db.models import prefetch_related_objects
 from orders.models import Order
+from orders.reservations import take_stock
+from orders.serializers import get_order_prefetches
 from .models import Payment
 from .serializers import PaymentSerializer
-from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.exceptions import APIException
 
 
 def call_payment_service_api(order_id):
@@ -10,7 +13,9 @@ def call_payment_service_api(order_id):
     '''
 
     try:
-        payment = Payment.objects.get(order__id=order_id)
+        payment = Payment.objects.select_related('order').prefetch_related(
+            *get_order_prefetches('order__')
+        ).get(order__id=order_id)
 
         if payment.paid:
             raise APIException('Payment is already made.')
@@ -32,21 +37,17 @@ def call_payment_service_api(order_id):
         if order.status != 'C':  # C is a status choice for status "Created". See orders/models.pys
             raise APIException('This order is already paid.')
 
-        payment = PaymentSerializer.create(order_id)
+        payment = PaymentSerializer.create(order)
         payment.save()
+        prefetch_related_objects([order], *get_order_prefetches())
         payment_serialized = PaymentSerializer(payment)
         return payment_serialized
 
 
 def decrease_products_amount(order_items):
-    for order_item in list(order_items):
-        # Here we must check that an user cannot buy more products than is available in the database.
-        if (order_item.product.amount_remaining < order_item.amount):
-            raise ValidationError(
-                f'The quantity of product with ID {order_item.product.id} is not enough to add this amount to the order.'
-            )
-
-        # Decreases amount of the products
-        order_item.product.amount_remaining = order_item.product.amount_remaining - order_item.amount
-
-        order_item.product.save()
+    '''
+    Takes the stock of the products of an order whose reservation has expired (see orders/reservations.py).
+    The stock is decremented with conditional updates, so it cannot go below zero under concurrent payments.
+    Raises ValidationError if some product is not available anymore.
+    '''
+    take_stock(order_items)
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0002_payment_paid'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_service_id',
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+    ]
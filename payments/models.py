@@ -18,7 +18,7 @@ class Payment(models.Model):
     simply may not exist.
     '''
 
-    payment_service_id = models.UUIDField(blank=True, null=True)
+    payment_service_id = models.UUIDField(blank=True, null=True, db_index=True)
     '''
     Here an ID of the order from the payment service side is stored.
     '''
@@ -1,5 +1,4 @@
 from rest_framework import serializers
-from orders.models import Order
 from orders.serializers import OrderSerializer
 from .models import Payment
 from uuid import uuid4
@@ -8,8 +7,7 @@ from uuid import uuid4
 class PaymentSerializer(serializers.ModelSerializer):
     order = OrderSerializer()
 
-    def create(order_id):
-        order = Order.objects.get(id=order_id)
+    def create(order):
         payment_service_id = uuid4()
         secret_key = uuid4()
         url = f'/payment/{payment_service_id}'
@@ -12,10 +12,12 @@
 # login:password is still alive and works, but obstinate APITestCase.client.login() method does not
 # trust in this. This is why I add that ugly string to every request a test do.
 
+from django.contrib.auth.models import User
 from rest_framework import status
 from rest_framework.test import APITestCase
 from products.models import Category, Product
-from orders.models import Order
+from orders.models import CoPurchase, Order, StockReservation
+from orders.serializers import OrderSerializer
 from . import models, serializers
 
 test_data = {
@@ -399,6 +401,9 @@ class PaymentCheckTest(APITestCase):
 
         # Checks if order status was changed
         self.assertEquals(order.status, 'P')
+        self.assertEquals(
+            list(order.status_history.values_list('from_status', 'to_status')), [('C', 'P')]
+        )
 
         # Checks that counts of products decreased after payment
         self.assertEquals(
@@ -415,6 +420,15 @@ class PaymentCheckTest(APITestCase):
         # Checks if the payment changed its status
         self.assertTrue(models.Payment.objects.get().paid)
 
+        # Checks that the products of the order are recommended for each other
+        self.assertEquals(
+            list(
+                CoPurchase.objects.order_by('product_id').values_list(
+                    'product_id', 'other_product_id', 'count'
+                )
+            ), [(self.p1.id, self.p2.id, 1), (self.p2.id, self.p1.id, 1)]
+        )
+
     def test_not_successful_pay(self):
         '''
         Ensure that nothing happens if payment was not successed
@@ -447,14 +461,16 @@ class PaymentCheckTest(APITestCase):
         # Checks if order status was not changed
         self.assertEquals(order.status, 'C')
 
-        # Checks that counts of products decreased after payment
+        # Checks that counts of products stay reserved for the order
         self.assertEquals(
             order_items[0].product.amount_remaining,
-            test_data['product 1']['amount_remaining']
+            test_data['product 1']['amount_remaining'] -
+            test_data['valid order']['items'][0]['amount']
         )
         self.assertEquals(
             order_items[1].product.amount_remaining,
-            test_data['product 2']['amount_remaining']
+            test_data['product 2']['amount_remaining'] -
+            test_data['valid order']['items'][1]['amount']
         )
 
         # Checks if the payment was not deleted.
@@ -495,14 +511,16 @@ class PaymentCheckTest(APITestCase):
         # Checks if order status was not changed
         self.assertEquals(order.status, 'C')
 
-        # Checks that counts of products decreased after payment
+        # Checks that counts of products stay reserved for the order
         self.assertEquals(
             order_items[0].product.amount_remaining,
-            test_data['product 1']['amount_remaining']
+            test_data['product 1']['amount_remaining'] -
+            test_data['valid order']['items'][0]['amount']
         )
         self.assertEquals(
             order_items[1].product.amount_remaining,
-            test_data['product 2']['amount_remaining']
+            test_data['product 2']['amount_remaining'] -
+            test_data['valid order']['items'][1]['amount']
         )
 
         # Checks if the payment was not deleted.
@@ -545,14 +563,16 @@ class PaymentCheckTest(APITestCase):
         # Checks if order status was not changed
         self.assertEquals(order.status, 'C')
 
-        # Checks that counts of products decreased after payment
+        # Checks that counts of products stay reserved for the order
         self.assertEquals(
             order_items[0].product.amount_remaining,
-            test_data['product 1']['amount_remaining']
+            test_data['product 1']['amount_remaining'] -
+            test_data['valid order']['items'][0]['amount']
         )
         self.assertEquals(
             order_items[1].product.amount_remaining,
-            test_data['product 2']['amount_remaining']
+            test_data['product 2']['amount_remaining'] -
+            test_data['valid order']['items'][1]['amount']
         )
 
         # Checks if the payment was not deleted.
@@ -593,14 +613,16 @@ class PaymentCheckTest(APITestCase):
         # Checks if order status was not changed
         self.assertEquals(order.status, 'C')
 
-        # Checks that counts of products decreased after payment
+        # Checks that counts of products stay reserved for the order
         self.assertEquals(
             order_items[0].product.amount_remaining,
-            test_data['product 1']['amount_remaining']
+            test_data['product 1']['amount_remaining'] -
+            test_data['valid order']['items'][0]['amount']
         )
         self.assertEquals(
             order_items[1].product.amount_remaining,
-            test_data['product 2']['amount_remaining']
+            test_data['product 2']['amount_remaining'] -
+            test_data['valid order']['items'][1]['amount']
         )
 
         # Checks if the payment was not deleted.
@@ -641,14 +663,16 @@ class PaymentCheckTest(APITestCase):
         # Checks if order status was not changed
         self.assertEquals(order.status, 'C')
 
-        # Checks that counts of products decreased after payment
+        # Checks that counts of products stay reserved for the order
         self.assertEquals(
             order_items[0].product.amount_remaining,
-            test_data['product 1']['amount_remaining']
+            test_data['product 1']['amount_remaining'] -
+            test_data['valid order']['items'][0]['amount']
         )
         self.assertEquals(
             order_items[1].product.amount_remaining,
-            test_data['product 2']['amount_remaining']
+            test_data['product 2']['amount_remaining'] -
+            test_data['valid order']['items'][1]['amount']
         )
 
         # Checks if the payment was not deleted.
@@ -688,14 +712,16 @@ class PaymentCheckTest(APITestCase):
         # Checks if order status was not changed
         self.assertEquals(order.status, 'C')
 
-        # Checks that counts of products decreased after payment
+        # Checks that counts of products stay reserved for the order
         self.assertEquals(
             order_items[0].product.amount_remaining,
-            test_data['product 1']['amount_remaining']
+            test_data['product 1']['amount_remaining'] -
+            test_data['valid order']['items'][0]['amount']
         )
         self.assertEquals(
             order_items[1].product.amount_remaining,
-            test_data['product 2']['amount_remaining']
+            test_data['product 2']['amount_remaining'] -
+            test_data['valid order']['items'][1]['amount']
         )
 
         # Checks if the payment was not deleted.
@@ -760,3 +786,121 @@ class PaymentCheckTest(APITestCase):
         self.assertEqual(
             str(response2.data['detail']), 'Payment is already made.'
         )
+
+    def test_repeated_notification(self):
+        '''
+        Ensure that a notification repeated with the same idempotency key gets the first response back
+        '''
+        payment = self.client.get(
+            f'/order/{self.order["id"]}/pay', format='json', HTTP_AUTHORIZATION=self.token_1
+        ).data
+        notification = {
+            **test_data['successful notification'],
+            'metadata': {
+                'secret_key': payment['secret_key'],
+            },
+            'id': payment['payment_service_id'],
+        }
+
+        response1 = self.client.post(
+            '/webhooks', notification, format='json', HTTP_IDEMPOTENCY_KEY=payment['payment_service_id']
+        )
+        response2 = self.client.post(
+            '/webhooks', notification, format='json', HTTP_IDEMPOTENCY_KEY=payment['payment_service_id']
+        )
+
+        self.assertEqual(response1.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response2.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response2.data, response1.data)
+        self.assertEqual(response2['Idempotent-Replayed'], 'true')
+
+    def test_failed_notification_changes_nothing(self):
+        '''
+        Ensure that a notification which fails halfway leaves the payment and the reservation as they were
+        '''
+        payment = self.client.get(
+            f'/order/{self.order["id"]}/pay', format='json', HTTP_AUTHORIZATION=self.token_1
+        ).data
+
+        # The order can not be moved to "Paid" anymore, so the notification fails after the reservation
+        # is confirmed and the payment is saved
+        Order.objects.filter(id=self.order['id']).update(status='O')
+
+        response = self.client.post(
+            '/webhooks', {
+                **test_data['successful notification'],
+                'metadata': {
+                    'secret_key': payment['secret_key'],
+                },
+                'id': payment['payment_service_id'],
+            },
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(models.Payment.objects.get().paid)
+        self.assertTrue(StockReservation.objects.filter(order_id=self.order['id']).exists())
+        self.assertFalse(CoPurchase.objects.exists())
+
+
+class PaymentQueriesTest(APITestCase):
+    def setUp(self) -> None:
+        self.c1 = Category.objects.create(**test_data['category'])
+        # The pairs of products bought together are inserted with several queries on SQLite
+        # if there are too many of them, so the orders are kept small enough
+        self.products = [
+            Product.objects.create(**test_data['product 1'], category=self.c1) for _ in range(10)
+        ]
+
+        self.client.post('/register', test_data['user data 1'], format='json')
+        self.token = 'Token ' + self.client.post(
+            '/token', test_data['user data 1'], format='json'
+        ).data['token']
+
+        self.orders = [
+            OrderSerializer.create(
+                {
+                    **test_data['valid order'], 'items':
+                        [{
+                            'product': {
+                                'id': product.id
+                            },
+                            'amount': 1
+                        } for product in products]
+                }, User.objects.get()
+            ) for products in [self.products[:2], self.products]
+        ]
+
+    def test_payment_queries(self):
+        '''
+        Ensure that an order is paid with the same number of queries however many items it has
+        '''
+        for order in self.orders:
+            # The token, the customer of the order for the permission, the payment, the order,
+            # the new payment, the customer and the items
+            with self.assertNumQueries(7):
+                self.client.get(f'/order/{order.id}/pay', HTTP_AUTHORIZATION=self.token)
+
+            # The same, but the order is loaded together with the existing payment
+            with self.assertNumQueries(5):
+                payment = self.client.get(
+                    f'/order/{order.id}/pay', HTTP_AUTHORIZATION=self.token
+                ).data
+
+            # The savepoint of the whole notification, the locked payment with the order, confirming the
+            # reservation, saving the payment, moving the order to "Paid" and recording the products bought
+            # together (both with savepoints), the customer and the items
+            with self.assertNumQueries(17):
+                response = self.client.post(
+                    '/webhooks', {
+                        **test_data['successful notification'],
+                        'metadata': {
+                            'secret_key': payment['secret_key'],
+                        },
+                        'id': payment['payment_service_id'],
+                    },
+                    format='json'
+                )
+
+            self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+            self.assertEqual(len(response.data['items']), order.items.count())
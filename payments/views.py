@@ -1,3 +1,5 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import status, generics
 from rest_framework.exceptions import NotFound, ValidationError, APIException
 from django.core.exceptions import ValidationError as DjangoValidationError
@@ -6,9 +8,13 @@ from rest_framework.response import Response
 from rest_framework.renderers import JSONRenderer
 from rest_framework.views import APIView
 from .permissions import IsPaymentOwnerOrAdmin
+from orders.idempotency import idempotent
 from orders.permissions import IsOrderOwnerOrAdmin
 from .models import Order, Payment
-from orders.serializers import OrderSerializer
+from orders.recommendations import record_order
+from orders.reservations import confirm_reservation
+from orders.serializers import OrderSerializer, get_order_prefetches
+from orders.transitions import transition_order
 from .helpers import call_payment_service_api, decrease_products_amount
 from rest_framework.authentication import TokenAuthentication, BasicAuthentication
 
@@ -67,6 +73,11 @@ class FakePaymentService(generics.RetrieveAPIView):
 class PaymentCheck(APIView):
     renderer_classes = [JSONRenderer]
 
+    # Payment services repeat their notifications until they get a response, a repeated one is not handled twice
+    # The payment, the stock, the status and the recommendations are changed together or not at all,
+    # so a failed notification leaves nothing half-done and can be repeated
+    @idempotent('webhooks')
+    @transaction.atomic
     def post(self, request):
         try:
             payment_id = request.data['id']
@@ -76,7 +87,9 @@ class PaymentCheck(APIView):
             if payment_status != 'successed':
                 raise ValidationError('Payment was not successful.')
 
-            payment = Payment.objects.get(payment_service_id=payment_id)
+            # The payment is locked, so two concurrent notifications can not both see it unpaid
+            payment = Payment.objects.select_for_update().select_related('order'
+                                                                         ).get(payment_service_id=payment_id)
 
             if payment.paid:
                 raise APIException('Payment is already made.')
@@ -88,17 +101,21 @@ class PaymentCheck(APIView):
             order = payment.order
             order_items = order.items.all()
 
-            # Reduces the total number of products when user paid for order
-            decrease_products_amount(order_items)
+            # The stock was reserved when the order was created. If the reservation has expired, the stock
+            # was returned, so it is taken again now (if it is still available)
+            if not confirm_reservation(order):
+                decrease_products_amount(order_items)
 
             # Change status of the payment on the pseudo-payment service side
             payment.paid = True
             payment.save()
 
-            # Changes status of the order
-            order.status = 'P'  # 'P' - is a choise for status "Paid"
+            # Changes status of the order, 'P' - is a choise for status "Paid" (see orders/transitions.py)
+            transition_order(order, 'P')
 
-            order.save()
+            # The order is paid, so its products are now "bought together"
+            record_order(order)
+            prefetch_related_objects([order], *get_order_prefetches())
             order_serialized = OrderSerializer(order)
 
             return Response(
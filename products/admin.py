@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Category, Product, Review
+from .models import Category, Product, ProductVariant, Review
 
 
 class ProductAdmin(admin.TabularInline):
@@ -10,11 +10,16 @@ class CategoryAdmin(admin.ModelAdmin):
     inlines = [ProductAdmin]
 
 
+class ProductVariantAdmin(admin.TabularInline):
+    model = ProductVariant
+
+
 class ProductAdmin(admin.ModelAdmin):
     list_display = (
         'name', 'amount_remaining', 'color', 'size', 'reviews_count',
         'likes_count', 'dislikes_count'
     )
+    inlines = [ProductVariantAdmin]
 
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ('__str__', 'author', 'product', 'liked',)
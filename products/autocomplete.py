@@ -0,0 +1,279 @@
+'''
+In-process autocomplete of the search box.
+
+Suggestions are the names of the products and the categories. They are kept in a sorted array with
+one entry per word of a name, so the suggestions for a prefix are a contiguous slice of it found with
+bisect, whatever the size of the catalog. The suggestions are ranked by popularity: the number of
+reviews of the products with this name or in this category.
+
+Like the search index (see products/search.py), the autocomplete index lives in the memory of every
+worker process, is built lazily and then updated incrementally by the signal handlers in products/signals.py.
+It is rebuilt from scratch at most PRODUCT_SEARCH_INDEX_TTL seconds after the last build to pick up
+changes made by other processes, the old index keeps serving the requests meanwhile (see IndexHolder).
+'''
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from django.conf import settings
+from .search import IndexHolder, tokenize
+
+PRODUCT = 'product'
+CATEGORY = 'category'
+
+# Short prefixes cover a large part of the array, their suggestions are cached until the index changes
+CACHED_PREFIX_LENGTH = 2
+
+
+def normalize(text) -> str:
+    '''
+    Lowercases the text and drops the punctuation, so "T-Shirt" and "t shirt" are the same suggestion.
+    '''
+    return ' '.join(tokenize(text))
+
+
+class AutocompleteIndex:
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # (type, normalized name) -> {"text", "type", "popularity", "references"}
+            self.suggestions = {}
+            # Sorted list of (words of a name from one of its words to the end, type, normalized name)
+            self.entries = []
+            # product ID -> (normalized name, category ID, popularity)
+            self.products = {}
+            # category ID -> normalized name
+            self.categories = {}
+            # prefix -> top suggestions, only for the prefixes not longer than CACHED_PREFIX_LENGTH
+            self.cache = {}
+            self.built_at = None
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, categories, products):
+        '''
+        Fills the index from scratch. Categories are (id, name) tuples, products are
+        (id, name, category ID, popularity) tuples.
+        '''
+        with self.lock:
+            self.clear()
+
+            for row in categories:
+                self.add_category(*row)
+
+            for row in products:
+                self.add_product(*row)
+
+            # While the index is being built, the entries are appended unsorted and sorted once here
+            self.entries.sort()
+            self.built_at = time.monotonic()
+
+    def add_category(self, category_id, name):
+        with self.lock:
+            if category_id in self.categories:
+                self.remove_category(category_id)
+
+            key = normalize(name)
+            self.categories[category_id] = key
+            self.add_reference(CATEGORY, key, name, self.get_category_popularity(category_id))
+
+    def remove_category(self, category_id):
+        with self.lock:
+            key = self.categories.pop(category_id, None)
+
+            if key is not None:
+                self.remove_reference(CATEGORY, key, self.get_category_popularity(category_id))
+
+    def get_category_popularity(self, category_id):
+        # Categories are added and renamed rarely, so their popularity is not stored separately
+        return sum(
+            popularity for _, product_category_id, popularity in self.products.values()
+            if product_category_id == category_id
+        )
+
+    def add_product(self, product_id, name, category_id, popularity):
+        with self.lock:
+            if product_id in self.products:
+                self.remove_product(product_id)
+
+            key = normalize(name)
+            self.products[product_id] = (key, category_id, popularity)
+            self.add_reference(PRODUCT, key, name, popularity)
+            self.add_category_popularity(category_id, popularity)
+
+    def remove_product(self, product_id):
+        with self.lock:
+            product = self.products.pop(product_id, None)
+
+            if product is not None:
+                key, category_id, popularity = product
+                self.remove_reference(PRODUCT, key, popularity)
+                self.add_category_popularity(category_id, -popularity)
+
+    def add_popularity(self, product_id, delta):
+        '''
+        Changes the popularity of a product, e.g. when a review of it is written or deleted.
+        '''
+        with self.lock:
+            if product_id not in self.products:
+                return
+
+            key, category_id, popularity = self.products[product_id]
+            self.products[product_id] = (key, category_id, popularity + delta)
+            self.add_suggestion_popularity(PRODUCT, key, delta)
+            self.add_category_popularity(category_id, delta)
+            self.cache.clear()
+
+    def add_category_popularity(self, category_id, delta):
+        self.add_suggestion_popularity(CATEGORY, self.categories.get(category_id), delta)
+
+    def add_suggestion_popularity(self, suggestion_type, key, delta):
+        # Names without any words are not suggested
+        if (suggestion_type, key) in self.suggestions:
+            self.suggestions[suggestion_type, key]['popularity'] += delta
+
+    def add_reference(self, suggestion_type, key, text, popularity):
+        '''
+        Adds a product or a category to the suggestion with its name. Several products may have
+        the same name, the suggestion is shown once and its popularity is the total of theirs.
+        '''
+        self.cache.clear()
+
+        if not key:
+            return
+
+        suggestion = self.suggestions.get((suggestion_type, key))
+
+        if suggestion is None:
+            suggestion = self.suggestions[suggestion_type, key] = {
+                'text': text,
+                'type': suggestion_type,
+                'popularity': 0,
+                'references': 0,
+            }
+            words = key.split(' ')
+
+            for index in range(len(words)):
+                entry = (' '.join(words[index:]), suggestion_type, key)
+
+                if self.is_built:
+                    insort(self.entries, entry)
+                else:
+                    self.entries.append(entry)
+
+        suggestion['popularity'] += popularity
+        suggestion['references'] += 1
+
+    def remove_reference(self, suggestion_type, key, popularity):
+        self.cache.clear()
+
+        if not key:
+            return
+
+        suggestion = self.suggestions[suggestion_type, key]
+        suggestion['popularity'] -= popularity
+        suggestion['references'] -= 1
+
+        if suggestion['references']:
+            return
+
+        del self.suggestions[suggestion_type, key]
+        words = key.split(' ')
+
+        for index in range(len(words)):
+            entry = (' '.join(words[index:]), suggestion_type, key)
+            position = bisect_left(self.entries, entry)
+
+            if position < len(self.entries) and self.entries[position] == entry:
+                del self.entries[position]
+
+    def suggest(self, query: str, limit: int) -> list:
+        '''
+        Returns at most "limit" suggestions which have a word starting with the query,
+        the most popular go first.
+        '''
+        prefix = normalize(query)
+
+        if not prefix:
+            return []
+
+        with self.lock:
+            if prefix in self.cache:
+                return self.cache[prefix][:limit]
+
+            suggestions = {}
+            index = bisect_left(self.entries, (prefix, ))
+
+            while index < len(self.entries) and self.entries[index][0].startswith(prefix):
+                _, suggestion_type, key = self.entries[index]
+                suggestions[suggestion_type, key] = self.suggestions[suggestion_type, key]
+                index += 1
+
+            cached = len(prefix) <= CACHED_PREFIX_LENGTH
+            top = heapq.nsmallest(
+                settings.AUTOCOMPLETE_SUGGESTIONS_LIMIT if cached else limit,
+                suggestions.values(),
+                key=lambda suggestion:
+                (-suggestion['popularity'], -suggestion['references'], suggestion['text']),
+            )
+            top = [
+                {
+                    'text': suggestion['text'],
+                    'type': suggestion['type']
+                } for suggestion in top
+            ]
+
+            if cached:
+                self.cache[prefix] = top
+
+        return top[:limit]
+
+
+def fill_autocomplete_index(index):
+    from .models import Category, Product
+
+    index.build(
+        Category.objects.values_list('id', 'name').iterator(),
+        Product.objects.values_list('id', 'name', 'category_id', 'reviews_count').iterator(chunk_size=2000),
+    )
+
+
+current_autocomplete_index = IndexHolder(AutocompleteIndex, fill_autocomplete_index)
+
+
+def get_autocomplete_index() -> AutocompleteIndex:
+    '''
+    Returns the autocomplete index of the process, (re)building it if it is empty or too old.
+    '''
+    return current_autocomplete_index.get()
+
+
+def index_product(product):
+    product_id, name, category_id, popularity = (
+        product.id, product.name, product.category_id, product.reviews_count
+    )
+    current_autocomplete_index.apply(
+        lambda index: index.add_product(product_id, name, category_id, popularity)
+    )
+
+
+def unindex_product(product_id):
+    current_autocomplete_index.apply(lambda index: index.remove_product(product_id))
+
+
+def index_category(category):
+    category_id, name = category.id, category.name
+    current_autocomplete_index.apply(lambda index: index.add_category(category_id, name))
+
+
+def unindex_category(category_id):
+    current_autocomplete_index.apply(lambda index: index.remove_category(category_id))
+
+
+def add_product_popularity(product_id, delta):
+    current_autocomplete_index.apply(lambda index: index.add_popularity(product_id, delta))
@@ -0,0 +1,171 @@
+'''
+Read-through cache of the catalog endpoints.
+
+Every cached response is stored under a key that contains the versions of the objects it was built from,
+e.g. the details of a category depend on the version of this category. When an object is changed,
+the signal handlers in products/signals.py bump its version once the change is committed, so the next
+request builds a new key and the old entry is never read again (it simply expires). This way nothing has
+to be deleted from the cache and only the responses that really depend on the changed object are rebuilt.
+
+Versions are timestamps in milliseconds, which also makes them usable as Last-Modified values.
+'''
+import time
+from datetime import datetime, timezone
+from hashlib import md5
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+VERSION_KEY = 'catalog:version:{}'
+RESPONSE_KEY = 'catalog:response:{}:{}:{}'
+STATS_KEY = 'catalog:stats:{}'
+
+
+def get_cache():
+    return caches[settings.CATALOG_CACHE_ALIAS]
+
+
+def get_versions(*names) -> list:
+    '''
+    Returns the current versions of the given objects (e.g. "categories", "category:5", "product:12").
+    An object which has no version yet (or whose version was evicted) gets a new one.
+    '''
+    cache = get_cache()
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: now() for key in keys if key not in versions}
+
+    if missing:
+        # Another process could set the version in the meantime, add() does not overwrite it
+        for key, version in missing.items():
+            cache.add(key, version, timeout=None)
+
+        versions.update(cache.get_many(list(missing)))
+
+    return [versions.get(key, missing.get(key)) for key in keys]
+
+
+def bump_versions(*names):
+    '''
+    Marks the given objects as changed, so all the cached responses built from them become outdated.
+
+    The versions are bumped when the current transaction is committed (at once outside of a transaction).
+    Otherwise a request could read the old rows after the bump and cache them under the new versions,
+    and a change which is rolled back would outdate the cache for nothing.
+    '''
+    transaction.on_commit(lambda: set_new_versions(names))
+
+
+def set_new_versions(names):
+    cache = get_cache()
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    timestamp = now()
+
+    # A new version must differ from the old one even if the object was changed twice in a millisecond
+    cache.set_many(
+        {key: max(timestamp, versions.get(key, 0) + 1)
+         for key in keys},
+        timeout=None
+    )
+
+
+def get_cached_data(request, view_name: str, version_names, build_data):
+    '''
+    Returns the response data of a view from the cache or, if there is nothing there yet,
+    builds it with build_data() and stores it.
+
+    The full URL of the request is a part of the key, because the data may depend on the query
+    parameters (and contain links built from the URL).
+    '''
+    cache = get_cache()
+    versions = '-'.join(str(version) for version in get_versions(*version_names))
+    url_hash = md5(request.build_absolute_uri().encode('utf-8')).hexdigest()
+    key = RESPONSE_KEY.format(view_name, versions, url_hash)
+
+    data = cache.get(key)
+
+    if data is not None:
+        record_stat('hits')
+        return data
+
+    record_stat('misses')
+    data = build_data()
+    cache.set(key, data, timeout=settings.CATALOG_CACHE_TIMEOUT)
+
+    return data
+
+
+def conditional(get_version_names):
+    '''
+    Class decorator for the catalog views which adds ETag and Last-Modified headers to the responses
+    and answers with 304 Not Modified when the client already has the current version of the data.
+    Both headers are derived from the versions of the objects, so the check does not hit the database
+    (unless get_version_names does) and the view itself is not run at all.
+
+    get_version_names(request, **url_kwargs) must return the names of the versions the response
+    depends on or None if the requested object does not exist.
+    '''
+    def get_request_versions(request, **kwargs):
+        # ETag and Last-Modified are computed separately, the versions are fetched only once
+        if not hasattr(request, 'catalog_versions'):
+            names = get_version_names(request, **kwargs)
+            # The view may reuse the names instead of looking them up again
+            request.catalog_version_names = names
+            request.catalog_versions = get_versions(*names) if names else None
+
+        return request.catalog_versions
+
+    def get_etag(request, *args, **kwargs):
+        versions = get_request_versions(request, **kwargs)
+
+        if versions is None:
+            return None
+
+        # Different pages of the same object are different resources for the clients
+        fingerprint = f'{request.get_full_path()}:{versions}'
+        return md5(fingerprint.encode('utf-8')).hexdigest()
+
+    def get_last_modified(request, *args, **kwargs):
+        versions = get_request_versions(request, **kwargs)
+
+        if versions is None:
+            return None
+
+        return datetime.fromtimestamp(max(versions) / 1000, tz=timezone.utc)
+
+    return method_decorator(
+        condition(etag_func=get_etag, last_modified_func=get_last_modified),
+        name='get'
+    )
+
+
+def record_stat(name: str):
+    cache = get_cache()
+    key = STATS_KEY.format(name)
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        # The counter does not exist yet
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def get_stats() -> dict:
+    stats = get_cache().get_many([STATS_KEY.format('hits'), STATS_KEY.format('misses')])
+    hits = stats.get(STATS_KEY.format('hits'), 0)
+    misses = stats.get(STATS_KEY.format('misses'), 0)
+    requests = hits + misses
+
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / requests, 4) if requests else None,
+    }
+
+
+def now() -> int:
+    return int(time.time() * 1000)
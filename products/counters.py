@@ -0,0 +1,159 @@
+import math
+from django.db.models import Count, F, FloatField, Q, Value
+from django.db.models.functions import Cast, Coalesce, NullIf, Sqrt
+from .models import COUNTER_FIELDS, Product, Review
+
+# z-score of the confidence level of the ratings, 1.96 is for 95%
+WILSON_Z = 1.96
+
+
+def wilson_score(likes: int, dislikes: int) -> float:
+    '''
+    Returns the lower bound of the Wilson score interval of the share of likes. Unlike the plain share,
+    it grows with the number of reviews: one like out of one review is rated lower than 95 out of 100.
+    '''
+    total = likes + dislikes
+
+    if not total:
+        return 0.0
+
+    return (
+        likes + WILSON_Z**2 / 2 - WILSON_Z * math.sqrt(likes * dislikes / total + WILSON_Z**2 / 4)
+    ) / (total + WILSON_Z**2)
+
+
+def wilson_expression(likes, dislikes):
+    '''
+    The same as wilson_score(), but calculated by the database from the given expressions,
+    so the rating can be updated together with the counters in one UPDATE query.
+    '''
+    likes = Cast(likes, FloatField())
+    dislikes = Cast(dislikes, FloatField())
+    total = likes + dislikes
+    z = Value(WILSON_Z, output_field=FloatField())
+
+    # There is nothing to divide by when a product has no reviews, NULL turns into the rating 0 then
+    score = (
+        likes + z * z / 2 - z * Sqrt(likes * dislikes / NullIf(total, 0) + z * z / 4)
+    ) / (total + z * z)
+
+    return Coalesce(score, Value(0.0, output_field=FloatField()))
+
+
+def update_review_counters(review, delta: int):
+    '''
+    Atomically shifts the review counters of the review's product by delta (1 when the review
+    was created, -1 when it was deleted). The update is done with F() expressions, so concurrent
+    requests never overwrite each other's changes.
+    '''
+    liked_field = 'likes_count' if review.liked else 'dislikes_count'
+    likes = F('likes_count') + (delta if review.liked else 0)
+    dislikes = F('dislikes_count') + (0 if review.liked else delta)
+
+    # The rating is calculated from the new counters explicitly, and it is assigned first: MySQL evaluates
+    # the assignments of an UPDATE from left to right and the later ones see the already updated columns,
+    # while the other databases always read the old values. Being first, it reads the old counters everywhere
+    Product.objects.filter(id=review.product_id).update(
+        rating=wilson_expression(likes, dislikes),
+        reviews_count=F('reviews_count') + delta,
+        likes_count=likes,
+        dislikes_count=dislikes,
+    )
+
+    # Mirrors the change on the product instance attached to the review (if it is loaded),
+    # so the review can be serialized right after it was saved without reloading the product.
+    if Review.product.is_cached(review):
+        product = review.product
+        product.reviews_count += delta
+        setattr(product, liked_field, getattr(product, liked_field) + delta)
+        product.rating = wilson_score(product.likes_count, product.dislikes_count)
+
+
+def count_reviews(product_ids) -> dict:
+    '''
+    Counts reviews of the given products with a single aggregated query.
+    Returns a dictionary like { product_id: (reviews_count, likes_count, dislikes_count) }.
+    Products without reviews are not present in the result.
+    '''
+    rows = Review.objects.filter(product__id__in=product_ids).values(
+        'product'
+    ).annotate(
+        total=Count('id'),
+        likes=Count('id', filter=Q(liked=True)),
+    ).order_by()
+
+    return {
+        row['product']: (row['total'], row['likes'], row['total'] - row['likes'])
+        for row in rows
+    }
+
+
+def recount_reviews(product_ids):
+    '''
+    Recalculates the review counters of the given products from the Review table.
+    '''
+    counts = count_reviews(product_ids)
+    products = []
+
+    for product_id in product_ids:
+        reviews, likes, dislikes = counts.get(product_id, (0, 0, 0))
+        products.append(
+            Product(
+                id=product_id,
+                reviews_count=reviews,
+                likes_count=likes,
+                dislikes_count=dislikes,
+                rating=wilson_score(likes, dislikes),
+            )
+        )
+
+    Product.objects.bulk_update(products, COUNTER_FIELDS)
+
+
+def iter_product_id_chunks(chunk_size: int):
+    '''
+    Yields lists of product IDs, chunk_size IDs at most. It walks the table by primary key,
+    so each chunk is fetched with a cheap indexed range query.
+    '''
+    last_id = 0
+
+    while True:
+        chunk = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').values_list(
+                'id', flat=True
+            )[:chunk_size]
+        )
+
+        if not chunk:
+            return
+
+        yield chunk
+        last_id = chunk[-1]
+
+
+def find_inconsistent_counters(product_ids) -> list:
+    '''
+    Compares the stored counters of the given products with the actual number of reviews.
+    Returns a list of (product_id, stored counters, actual counters) tuples for every product
+    whose counters are out of date.
+    '''
+    counts = count_reviews(product_ids)
+    stored = Product.objects.filter(id__in=product_ids).values_list(
+        'id', *COUNTER_FIELDS
+    )
+    inconsistent = []
+
+    for product_id, *stored_counters in stored:
+        reviews, likes, dislikes = counts.get(product_id, (0, 0, 0))
+        actual_counters = (reviews, likes, dislikes, wilson_score(likes, dislikes))
+        *stored_numbers, stored_rating = stored_counters
+
+        # The rating may be calculated by the database, so it is compared with a tolerance
+        if tuple(stored_numbers) != actual_counters[:-1] or not math.isclose(
+            stored_rating, actual_counters[-1], abs_tol=1e-9
+        ):
+            inconsistent.append(
+                (product_id, tuple(stored_counters), actual_counters)
+            )
+
+    return inconsistent
@@ -0,0 +1,82 @@
+'''
+Streaming export of the whole catalog, see ProductExport view and "manage.py export_products".
+'''
+import csv
+import json
+from .models import Product
+
+EXPORT_FIELDS = [
+    'id', 'name', 'category', 'price', 'old_price', 'amount_remaining', 'in_stock', 'description', 'img',
+    'size', 'color', 'reviews_count', 'likes_count', 'dislikes_count', 'datetime_created'
+]
+EXPORT_FORMATS = {
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def iter_products(chunk_size: int = 2000):
+    '''
+    Yields all the products as dictionaries, ordered by ID.
+
+    Products are read by chunks with keyset queries (WHERE id > <last id> ORDER BY id LIMIT <chunk size>)
+    instead of one big query, because MySQL client buffers the whole result of a query in memory.
+    This way only one chunk is held in memory at a time, no matter how large the catalog is.
+    The category name is joined in the same query and the review counters are stored in the products,
+    so nothing else is queried.
+    '''
+    last_id = 0
+
+    while True:
+        rows = list(
+            Product.objects.filter(id__gt=last_id).order_by('id').values(
+                'id', 'name', 'category__name', 'price', 'old_price', 'amount_remaining', 'description',
+                'img', 'size', 'color', 'reviews_count', 'likes_count', 'dislikes_count', 'datetime_created'
+            )[:chunk_size]
+        )
+
+        if not rows:
+            return
+
+        for row in rows:
+            row['category'] = row.pop('category__name')
+            row['price'] = str(row['price'])
+            row['in_stock'] = row['amount_remaining'] > 0
+            row['datetime_created'] = row['datetime_created'].isoformat()
+            yield row
+
+        last_id = rows[-1]['id']
+
+
+def iter_jsonl(products):
+    for product in products:
+        yield json.dumps({field: product[field] for field in EXPORT_FIELDS}) + '\n'
+
+
+class _LineBuffer:
+    '''
+    File-like object for csv.writer which returns the written line instead of storing it.
+    '''
+    def write(self, line):
+        return line
+
+
+def iter_csv(products):
+    writer = csv.DictWriter(_LineBuffer(), fieldnames=EXPORT_FIELDS)
+
+    yield writer.writerow(dict(zip(EXPORT_FIELDS, EXPORT_FIELDS)))
+
+    for product in products:
+        yield writer.writerow(product)
+
+
+def iter_export(export_format: str, chunk_size: int = 2000):
+    '''
+    Yields the lines of the export in the given format ("jsonl" or "csv").
+    '''
+    products = iter_products(chunk_size)
+
+    if export_format == 'csv':
+        return iter_csv(products)
+
+    return iter_jsonl(products)
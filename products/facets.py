@@ -0,0 +1,86 @@
+from bisect import bisect_right
+from collections import defaultdict
+
+# Lower bounds of the price buckets, every bucket includes its lower bound and excludes the upper one
+PRICE_BUCKETS = [0, 10, 25, 50, 100, 250, 500]
+
+FACETS = ['category', 'color', 'size', 'in_stock', 'price']
+
+
+def get_price_bucket_labels() -> list:
+    labels = [
+        f'{lower}-{upper}'
+        for lower, upper in zip(PRICE_BUCKETS, PRICE_BUCKETS[1:])
+    ]
+    labels.append(f'{PRICE_BUCKETS[-1]}+')
+
+    return labels
+
+
+def get_price_bucket(price) -> str:
+    return get_price_bucket_labels()[max(bisect_right(PRICE_BUCKETS, price) - 1, 0)]
+
+
+def get_facet_values(category_id, color, size, amount_remaining, price) -> dict:
+    '''
+    Returns the values of every facet for a product. The search index keeps them next to the tokens
+    of the product (see products/search.py), so the facets of the found products are counted in memory.
+    '''
+    return {
+        'category': category_id,
+        'color': color,
+        'size': size,
+        'in_stock': amount_remaining > 0,
+        'price': get_price_bucket(float(price)),
+    }
+
+
+def count_facets(index, product_ids, facet_names) -> dict:
+    '''
+    Counts the products with the given IDs by every requested facet.
+
+    The products are counted by the values kept in the search index, so however many products were found,
+    the database is queried only once to get the names of their categories (if the facet "category" is
+    requested). The counts see changes made with queryset.update() (e.g. the stock taken by the orders)
+    when the index is rebuilt, just like the search itself.
+
+    Returns a dictionary like { "color": [{ "value": "red", "count": 2 }, ...], ... }.
+    Values of a facet are ordered by their count, price buckets are ordered by price.
+    '''
+    from .models import Category
+
+    counts = index.count_facets(product_ids, facet_names)
+
+    if 'category' in counts:
+        names = dict(
+            Category.objects.filter(id__in=list(counts['category'])
+                                   ).values_list('id', 'name')
+        )
+        category_counts = defaultdict(int)
+
+        # The category may have been deleted in another process since the index was built
+        for category_id, count in counts['category'].items():
+            if category_id in names:
+                category_counts[names[category_id]] += count
+
+        counts['category'] = category_counts
+
+    facets = {}
+
+    for name, values in counts.items():
+        if name == 'price':
+            order = get_price_bucket_labels()
+            ordered_values = sorted(values, key=order.index)
+        else:
+            ordered_values = sorted(
+                values, key=lambda value: (-values[value], str(value))
+            )
+
+        facets[name] = [
+            {
+                'value': value,
+                'count': values[value]
+            } for value in ordered_values
+        ]
+
+    return facets
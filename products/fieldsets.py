@@ -0,0 +1,86 @@
+'''
+Sparse fieldsets of the products.
+
+Query parameters "fields" and "omit" choose which fields of the products are returned, e.g.
+/categories/pants?fields=id,name,price,img or /users/1/cart?omit=category,description.
+The other fields are not only dropped from the response, they are not loaded at all: the products
+are fetched with .only() and the category is not joined unless it is requested.
+'''
+from rest_framework.exceptions import APIException
+from .serializers import ProductSerializer
+
+PRODUCT_FIELDS = list(ProductSerializer().fields)
+
+# Columns needed for the fields which are not plain columns of the products
+FIELD_COLUMNS = {
+    'category': ['category__name'],
+    'in_stock': ['amount_remaining'],
+}
+
+
+def get_product_fields(request):
+    '''
+    Returns the names of the product fields requested with "fields" or "omit" parameters
+    or None if all of them are needed.
+    '''
+    fields = request.query_params.get('fields')
+    omit = request.query_params.get('omit')
+
+    if fields is None and omit is None:
+        return None
+
+    if fields is not None and omit is not None:
+        raise APIException('Parameters "fields" and "omit" can not be used together.')
+
+    names = {name.strip() for name in (fields or omit).split(',') if name.strip()}
+    unknown_names = names.difference(PRODUCT_FIELDS)
+
+    if unknown_names:
+        raise APIException(
+            f'Unknown fields: {", ".join(sorted(unknown_names))}. '
+            f'Products have only these fields: {", ".join(PRODUCT_FIELDS)}.'
+        )
+
+    if fields is not None:
+        return [name for name in PRODUCT_FIELDS if name in names]
+
+    return [name for name in PRODUCT_FIELDS if name not in names]
+
+
+def select_product_fields(queryset, fields, prefix: str = '', extra_columns=()):
+    '''
+    Narrows the queryset to the columns needed for the given product fields (all of them if fields is None).
+    The queryset may contain the objects that refer to the products (e.g. cart items), then prefix
+    is the path to the product ("product__") and extra_columns are the columns of the objects themselves.
+    '''
+    relations = [prefix[:-2]] if prefix else []
+
+    if fields is None or 'category' in fields:
+        relations.append(f'{prefix}category')
+
+    if relations:
+        queryset = queryset.select_related(*relations)
+
+    if fields is None:
+        return queryset
+
+    # The category ID is always loaded (it costs nothing), the related managers need it
+    columns = {'id', 'category'}
+
+    for field in fields:
+        columns.update(FIELD_COLUMNS.get(field, [field]))
+
+    return queryset.only(
+        *extra_columns, *sorted(f'{prefix}{column}' for column in columns)
+    )
+
+
+class ProductFieldsMixin:
+    '''
+    Mixin for the generic views which passes the requested product fields to the serializers.
+    '''
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['product_fields'] = get_product_fields(self.request)
+
+        return context
@@ -0,0 +1,172 @@
+'''
+Bulk import of the products from the supplier feeds, see "manage.py import_products".
+'''
+import csv
+import json
+from decimal import Decimal, InvalidOperation
+from django.db import transaction
+from .cache import bump_versions
+from .models import Category, Product
+
+REQUIRED_FIELDS = ['name', 'category', 'price', 'amount_remaining', 'size', 'color']
+UPDATED_FIELDS = [
+    'img', 'name', 'price', 'old_price', 'amount_remaining', 'description', 'category', 'size', 'color'
+]
+
+
+class ImportRowError(Exception):
+    def __init__(self, row_number: int, message: str):
+        super().__init__(f'Row {row_number}: {message}')
+        self.row_number = row_number
+
+
+def read_rows(file, file_format: str):
+    '''
+    Reads the rows of the feed one by one, so the whole file is never loaded into memory.
+    '''
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+class ProductImporter:
+    '''
+    Creates or updates products in batches: every batch is looked up with one query and then saved with
+    one bulk_create() and one bulk_update() inside its own transaction.
+
+    A row updates an existing product when it contains "id" of the product or when there is a product
+    with the same name, category, size and color. Otherwise a new product is created.
+    Categories are referred by their names, the unknown ones are created.
+    '''
+    def __init__(self, batch_size: int = 1000, dry_run: bool = False):
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        # All the categories are loaded once, there are much fewer of them than products
+        self.category_ids = dict(Category.objects.values_list('name', 'id'))
+
+    def import_rows(self, rows, offset: int = 0):
+        '''
+        Imports the rows, skipping the first offset of them. Yields a tuple (number of the last imported row,
+        created, updated) after every batch.
+        '''
+        if not self.dry_run:
+            yield from self.import_batches(rows, offset)
+            return
+
+        # The dry run does everything in one transaction which is rolled back at the end,
+        # so the batches can refer to the categories created by the previous ones
+        with transaction.atomic():
+            yield from self.import_batches(rows, offset)
+            transaction.set_rollback(True)
+
+    def import_batches(self, rows, offset: int):
+        batch = []
+
+        for row_number, row in enumerate(rows, start=1):
+            if row_number <= offset:
+                continue
+
+            batch.append((row_number, row))
+
+            if len(batch) == self.batch_size:
+                yield self.import_batch(batch)
+                batch = []
+
+        if batch:
+            yield self.import_batch(batch)
+
+    def import_batch(self, batch):
+        with transaction.atomic():
+            products = [
+                self.build_product(row_number, row) for row_number, row in batch
+            ]
+            to_create, to_update = self.match_existing(products)
+
+            Product.objects.bulk_create(to_create)
+            Product.objects.bulk_update(to_update, UPDATED_FIELDS)
+
+        if not self.dry_run:
+            self.invalidate_caches(products, to_update)
+
+        return batch[-1][0], len(to_create), len(to_update)
+
+    def build_product(self, row_number, row) -> Product:
+        missing_fields = [field for field in REQUIRED_FIELDS if not row.get(field)]
+
+        if missing_fields:
+            raise ImportRowError(
+                row_number, f'fields {", ".join(missing_fields)} are not set.'
+            )
+
+        try:
+            return Product(
+                id=int(row['id']) if row.get('id') else None,
+                name=row['name'],
+                category_id=self.get_category_id(row['category']),
+                price=Decimal(str(row['price'])),
+                old_price=float(row.get('old_price') or 0),
+                amount_remaining=int(row['amount_remaining']),
+                description=row.get('description') or '',
+                img=row.get('img') or '',
+                size=row['size'],
+                color=row['color'],
+            )
+        except (ValueError, InvalidOperation) as e:
+            raise ImportRowError(row_number, f'invalid value ({e}).')
+
+    def get_category_id(self, name: str) -> int:
+        if name not in self.category_ids:
+            self.category_ids[name] = Category.objects.create(name=name).id
+
+        return self.category_ids[name]
+
+    def match_existing(self, products):
+        '''
+        Splits the products into new ones and the ones that already exist in the database,
+        looking them up with one query per batch.
+        '''
+        ids = [product.id for product in products if product.id is not None]
+        names = [product.name for product in products if product.id is None]
+
+        existing_ids = set(
+            Product.objects.filter(id__in=ids).values_list('id', flat=True)
+        )
+        existing_by_key = {
+            (category_id, name, size, color): product_id
+            for product_id, category_id, name, size, color in Product.objects.
+            filter(name__in=names).values_list(
+                'id', 'category_id', 'name', 'size', 'color'
+            )
+        }
+
+        to_create, to_update = [], []
+
+        for product in products:
+            if product.id is not None:
+                exists = product.id in existing_ids
+            else:
+                product.id = existing_by_key.get(
+                    (product.category_id, product.name, product.size, product.color)
+                )
+                exists = product.id is not None
+
+            if exists:
+                to_update.append(product)
+            else:
+                to_create.append(product)
+
+        return to_create, to_update
+
+    def invalidate_caches(self, products, updated_products):
+        '''
+        bulk_create() and bulk_update() do not send any signals, so the catalog cache is invalidated here.
+        The search indexes of the running processes see the changes after their next rebuild.
+        '''
+        bump_versions(
+            *{f'category:{product.category_id}'
+              for product in products},
+            *[f'product:{product.id}' for product in updated_products],
+        )
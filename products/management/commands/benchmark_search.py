@@ -0,0 +1,119 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.models import Category, Product
+from products.search import SearchIndex, iter_index_rows
+
+WORDS = [
+    'shirt', 't-shirt', 'pants', 'jeans', 'hoodie', 'jacket', 'coat', 'dress', 'skirt', 'socks',
+    'sneakers', 'boots', 'cap', 'scarf', 'gloves', 'sweater', 'shorts', 'blazer', 'vest', 'pajamas'
+]
+ADJECTIVES = [
+    'cotton', 'woolen', 'slim', 'oversize', 'classic', 'sport', 'summer', 'winter', 'denim', 'linen'
+]
+COLORS = ['red', 'yellow', 'black', 'white', 'blue', 'green', 'grey', 'pink']
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+QUERIES = ['sh', 'pants', 'cotton shirt', 'ean', 'winter red', 'oat']
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the in-memory search index with the LIKE queries of the database. Synthetic products '
+        'are created inside a transaction which is rolled back at the end, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[10000, 100000, 1000000],
+            help='Numbers of products to run the benchmark with.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='How many times every query is run.'
+        )
+
+    def handle(self, *args, **options):
+        random.seed(0)
+
+        for size in options['sizes']:
+            with transaction.atomic():
+                self.run(size, options['repeat'])
+                transaction.set_rollback(True)
+
+    def run(self, size, repeat):
+        category = Category.objects.create(name='benchmark')
+        batch = []
+
+        for _ in range(size):
+            batch.append(
+                Product(
+                    name=f'{random.choice(ADJECTIVES)} {random.choice(WORDS)}',
+                    description=' '.join(random.choices(ADJECTIVES + WORDS, k=8)),
+                    price=random.randint(100, 10000) / 100,
+                    amount_remaining=random.randint(0, 100),
+                    color=random.choice(COLORS),
+                    size=random.choice(SIZES),
+                    img='https://example.com/img.png',
+                    category=category,
+                )
+            )
+
+            if len(batch) == 5000:
+                Product.objects.bulk_create(batch)
+                batch = []
+
+        Product.objects.bulk_create(batch)
+
+        index = SearchIndex()
+        started = time.perf_counter()
+        index.build(iter_index_rows(Product.objects.filter(category=category)))
+        build_time = time.perf_counter() - started
+
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(
+                f'{size} products, index is built in {build_time:.2f}s'
+            )
+        )
+        self.stdout.write(
+            f'{"query":<16}{"LIKE prefix, ms":>18}{"LIKE substring, ms":>22}{"index, ms":>12}{"found":>10}'
+        )
+
+        for query in QUERIES:
+            prefix_time = self.measure(
+                lambda: list(
+                    Product.objects.filter(name__startswith=query).values_list(
+                        'id', flat=True
+                    )
+                ), repeat
+            )
+            substring_time = self.measure(
+                lambda: list(
+                    Product.objects.filter(name__icontains=query).values_list(
+                        'id', flat=True
+                    )
+                ), repeat
+            )
+            index_time = self.measure(lambda: index.search(query), repeat)
+
+            self.stdout.write(
+                f'{query:<16}{prefix_time:>18.2f}{substring_time:>22.2f}{index_time:>12.2f}{len(index.search(query)):>10}'
+            )
+
+    def measure(self, function, repeat):
+        '''
+        Returns the best time of the function in milliseconds.
+        '''
+        times = []
+
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - started)
+
+        return min(times) * 1000
@@ -0,0 +1,91 @@
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from products.models import Category, Product
+from products.row_serializers import ProductRowSerializer
+from products.serializers import ProductSerializer
+from .benchmark_search import ADJECTIVES, COLORS, SIZES, WORDS
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares ProductSerializer(many=True) with ProductRowSerializer on lists of products. Synthetic '
+        'products are created inside a transaction which is rolled back at the end, so the database is left untouched.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=int,
+            nargs='+',
+            default=[50, 200, 1000],
+            help='Numbers of products in the serialized lists.'
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=5,
+            help='How many times every list is serialized.'
+        )
+
+    def handle(self, *args, **options):
+        random.seed(0)
+
+        with transaction.atomic():
+            self.run(options['sizes'], options['repeat'])
+            transaction.set_rollback(True)
+
+    def run(self, sizes, repeat):
+        category = Category.objects.create(name='benchmark')
+        Product.objects.bulk_create(
+            Product(
+                name=f'{random.choice(ADJECTIVES)} {random.choice(WORDS)}',
+                description=' '.join(random.choices(ADJECTIVES + WORDS, k=8)),
+                price=random.randint(100, 10000) / 100,
+                amount_remaining=random.randint(0, 100),
+                color=random.choice(COLORS),
+                size=random.choice(SIZES),
+                img='https://example.com/img.png',
+                category=category,
+            ) for _ in range(max(sizes))
+        )
+        renderer = JSONRenderer()
+
+        self.stdout.write(
+            f'{"products":<10}{"serializer, ms":>16}{"rows, ms":>12}{"serializer, rows/s":>20}{"rows, rows/s":>16}'
+        )
+
+        for size in sizes:
+            queryset = Product.objects.filter(category=category
+                                             ).order_by('id')[:size]
+            serializer_time = self.measure(
+                lambda: renderer.render(
+                    ProductSerializer(
+                        queryset.select_related('category'), many=True
+                    ).data
+                ), repeat
+            )
+            rows_time = self.measure(
+                lambda: renderer.
+                render(ProductRowSerializer().serialize(queryset)), repeat
+            )
+
+            self.stdout.write(
+                f'{size:<10}{serializer_time * 1000:>16.2f}{rows_time * 1000:>12.2f}'
+                f'{size / serializer_time:>20.0f}{size / rows_time:>16.0f}'
+            )
+
+    def measure(self, function, repeat):
+        '''
+        Returns the best time of the function in seconds.
+        '''
+        times = []
+
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - started)
+
+        return min(times)
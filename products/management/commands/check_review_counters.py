@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.counters import find_inconsistent_counters, iter_product_id_chunks
+
+
+class Command(BaseCommand):
+    help = 'Checks that the denormalized review counters and ratings of products match the Review table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='How many products are checked with one query.'
+        )
+
+    def handle(self, *args, **options):
+        inconsistent_count = 0
+
+        for chunk in iter_product_id_chunks(options['chunk_size']):
+            for product_id, stored, actual in find_inconsistent_counters(chunk):
+                inconsistent_count += 1
+                self.stdout.write(
+                    f'Product {product_id}: stored (reviews, likes, dislikes, rating) = {stored}, actual = {actual}'
+                )
+
+        if inconsistent_count:
+            raise CommandError(
+                f'{inconsistent_count} products have inconsistent review counters. '
+                'Run "manage.py rebuild_review_counters" to fix them.'
+            )
+
+        self.stdout.write(self.style.SUCCESS('All review counters are consistent.'))
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from products.export import EXPORT_FORMATS, iter_export
+
+
+class Command(BaseCommand):
+    help = 'Writes the whole catalog to a JSONL or CSV file, the products are read from the database by chunks.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='Path to the file, the standard output is used by default.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=list(EXPORT_FORMATS),
+            help='Format of the file. By default it is guessed from the file extension.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='How many products are read from the database with one query.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        lines = iter_export(file_format, options['chunk_size'])
+
+        if path == '-':
+            for line in lines:
+                self.stdout.write(line, ending='')
+            return
+
+        with open(path, 'w', newline='', encoding='utf-8') as file:
+            file.writelines(lines)
@@ -0,0 +1,80 @@
+import sys
+import time
+from django.core.management.base import BaseCommand, CommandError
+from products.importer import ImportRowError, ProductImporter, read_rows
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates or updates products from a CSV or JSONL file (one JSON object per line). '
+        'Rows must contain fields name, category (name of a category), price, amount_remaining, size and color, '
+        'fields id, old_price, description and img are optional.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', help='Path to the file, pass "-" to read the standard input.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=['csv', 'jsonl'],
+            help='Format of the file. By default it is guessed from the file extension.'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='How many rows are saved in one transaction.'
+        )
+        parser.add_argument(
+            '--offset',
+            type=int,
+            default=0,
+            help='How many rows to skip, allows to resume an interrupted import.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Checks the file and reports what would be done without saving anything.'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.endswith('.csv') else 'jsonl')
+        importer = ProductImporter(options['batch_size'], options['dry_run'])
+        offset = options['offset']
+        created = updated = 0
+        started = time.monotonic()
+
+        file = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+
+        try:
+            for offset, batch_created, batch_updated in importer.import_rows(
+                read_rows(file, file_format), offset
+            ):
+                created += batch_created
+                updated += batch_updated
+                self.stdout.write(
+                    f'{offset} rows processed: {created} created, {updated} updated, '
+                    f'{self.get_speed(created + updated, started):.0f} rows/s'
+                )
+        except ImportRowError as e:
+            # The batch with the invalid row is rolled back completely
+            raise CommandError(
+                f'{e} The first {offset} rows are imported, fix the file and run the command '
+                f'with --offset {offset} to resume.'
+            )
+        finally:
+            if file is not sys.stdin:
+                file.close()
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{"Dry run is finished" if options["dry_run"] else "Done"}: {created} products created, '
+                f'{updated} updated in {time.monotonic() - started:.1f}s '
+                f'({self.get_speed(created + updated, started):.0f} rows/s).'
+            )
+        )
+
+    def get_speed(self, rows, started):
+        return rows / max(time.monotonic() - started, 1e-6)
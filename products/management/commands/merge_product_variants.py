@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.variants import find_duplicate_products, merge_products
+
+
+class Command(BaseCommand):
+    help = (
+        'Merges the products which differ only in size, color and stock (e.g. a t-shirt added once for every size) '
+        'into one product with variants.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Reports the products which would be merged without saving anything.'
+        )
+
+    def handle(self, *args, **options):
+        # The groups are read before merging, since merging deletes the products the query goes over
+        groups = list(find_duplicate_products())
+
+        with transaction.atomic():
+            for group in groups:
+                product_id = merge_products(group)
+                variants = ', '.join(
+                    f'{row["size"] or "-"}/{row["color"] or "-"}' for row in group
+                )
+                self.stdout.write(
+                    f'Product {product_id} "{group[0]["name"]}": {len(group)} variants ({variants})'
+                )
+
+            if options['dry_run']:
+                transaction.set_rollback(True)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{"Dry run is finished" if options["dry_run"] else "Done"}: '
+                f'{sum(len(group) for group in groups)} products merged into {len(groups)}.'
+            )
+        )
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.counters import iter_product_id_chunks, recount_reviews
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalculates the denormalized review counters and ratings of all products chunk by chunk. '
+        'Run it to fill the top-rated lists after the reviews were changed directly in the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='How many products are recounted in one transaction.'
+        )
+
+    def handle(self, *args, **options):
+        products_processed = 0
+
+        for chunk in iter_product_id_chunks(options['chunk_size']):
+            # Every chunk gets its own short transaction to not hold locks on the whole table
+            with transaction.atomic():
+                recount_reviews(chunk)
+
+            products_processed += len(chunk)
+            self.stdout.write(f'Recounted reviews of {products_processed} products')
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Done, review counters of {products_processed} products are rebuilt.'
+            )
+        )
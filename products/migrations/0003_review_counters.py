@@ -0,0 +1,47 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:08
+
+from django.db import migrations, models
+from django.db.models import Count, Q
+
+
+def fill_review_counters(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    Review = apps.get_model('products', 'Review')
+
+    counts = Review.objects.values('product').annotate(
+        total=Count('id'),
+        likes=Count('id', filter=Q(liked=True)),
+    ).order_by()
+
+    for row in counts:
+        Product.objects.filter(id=row['product']).update(
+            reviews_count=row['total'],
+            likes_count=row['likes'],
+            dislikes_count=row['total'] - row['likes'],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0002_auto_20211211_2134'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='dislikes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(fill_review_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:38
+
+import math
+from django.db import migrations, models
+
+# The same as products.counters.WILSON_Z, copied to keep the migration independent of the current code
+WILSON_Z = 1.96
+
+
+def fill_ratings(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    products = Product.objects.filter(reviews_count__gt=0).values_list(
+        'id', 'likes_count', 'dislikes_count'
+    )
+
+    for product_id, likes, dislikes in list(products):
+        total = likes + dislikes
+
+        if not total:
+            continue
+
+        rating = (
+            likes + WILSON_Z**2 / 2 - WILSON_Z * math.sqrt(likes * dislikes / total + WILSON_Z**2 / 4)
+        ) / (total + WILSON_Z**2)
+        Product.objects.filter(id=product_id).update(rating=rating)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_product_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', '-rating', 'id'], name='product_category_rating_idx'),
+        ),
+        migrations.RunPython(fill_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.6 on 2026-10-18 19:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_rating'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='product',
+            options={'permissions': [('export_product', 'Can export the catalog')]},
+        ),
+    ]
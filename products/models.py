@@ -1,9 +1,12 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+# Denormalized review counters of a product, see products/counters.py
+COUNTER_FIELDS = ['reviews_count', 'likes_count', 'dislikes_count', 'rating']
+
 
 class Category(models.Model):
-    name = models.CharField(max_length=32, null=True)
+    name = models.CharField(max_length=32, null=True, db_index=True)
 
     def __str__(self) -> str:
         return str(self.name)
@@ -23,28 +26,87 @@ class Product(models.Model):
         related_name='products',
     )
 
-    @property
-    def reviews_count(self):
-        return Review.objects.filter(product__id=self.id).count()
-
-    @property
-    def likes_count(self):
-        return Review.objects.filter(product__id=self.id, liked=True).count()
-
-    @property
-    def dislikes_count(self):
-        return Review.objects.filter(product__id=self.id, liked=False).count()
+    # Denormalized review counters. They are kept up to date by the signal handlers
+    # in products/signals.py, so serializing a product does not cost any extra query.
+    # Use "manage.py rebuild_review_counters" to recalculate them from scratch.
+    reviews_count = models.PositiveIntegerField(default=0, editable=False)
+    likes_count = models.PositiveIntegerField(default=0, editable=False)
+    dislikes_count = models.PositiveIntegerField(default=0, editable=False)
+    # Lower bound of the Wilson score interval of the share of likes (see products/counters.py),
+    # the products of a category are ranked by it in the top-rated list
+    rating = models.FloatField(default=0, editable=False)
 
     @property
     def in_stock(self):
         return self.amount_remaining > 0
 
-    # TODO: Create seperated models for next two fields (#a36f5667)
+    # Products sold in several sizes and colors have variants (see ProductVariant below), then these
+    # fields may be left empty and amount_remaining is the total stock of all the variants
+    size = models.CharField(max_length=16, blank=True, default='')
+    color = models.CharField(max_length=32, blank=True, default='')
+
+    class Meta:
+        indexes = [
+            # Products of a category are paginated by these orderings (see products/pagination.py)
+            models.Index(
+                fields=['category', 'datetime_created', 'id'],
+                name='product_category_created_idx'
+            ),
+            models.Index(
+                fields=['category', 'price', 'id'],
+                name='product_category_price_idx'
+            ),
+            models.Index(fields=['name'], name='product_name_idx'),
+            models.Index(
+                fields=['category', '-rating', 'id'],
+                name='product_category_rating_idx'
+            ),
+        ]
+        # Partners who pull the whole catalog (see ProductExport) get this permission instead of admin access
+        permissions = [('export_product', 'Can export the catalog')]
+
+    def __str__(self) -> str:
+        return f'{self.color} {self.name}, {self.size}'
+
+    def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
+        '''
+        The review counters are changed in the database only, so the values of an instance that was loaded
+        before a review was added are outdated. A full save of an existing product does not write them back.
+        '''
+        if update_fields is None and not force_insert and not self._state.adding:
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in COUNTER_FIELDS
+            ]
+
+        super().save(force_insert, force_update, using, update_fields)
+
+
+class ProductVariant(models.Model):
+    '''
+    A size and color combination of a product with its own stock. The name, description, image and price
+    are shared by all the variants and stored once in the product.
+    '''
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name='variants'
+    )
     size = models.CharField(max_length=16)
     color = models.CharField(max_length=32)
+    amount_remaining = models.PositiveSmallIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['product', 'size', 'color'], name='unique_product_variant'
+            ),
+        ]
+
+    @property
+    def in_stock(self):
+        return self.amount_remaining > 0
 
     def __str__(self) -> str:
-        return f'{self.color} {self.name}, {self.size}'
+        return f'{self.color} {self.size}'
 
 
 class Review(models.Model):
@@ -59,5 +121,11 @@ class Review(models.Model):
     review_text = models.TextField(max_length=1000)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            # The review counters count likes and dislikes of the products
+            models.Index(fields=['product', 'liked'], name='review_product_liked_idx'),
+        ]
+
     def __str__(self) -> str:
         return f'#{self.id}: {self.product.name}, {self.author.username}'
@@ -0,0 +1,258 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    '''
+    Keyset (also known as "cursor" or "seek") pagination.
+
+    Instead of OFFSET it remembers the ordering values of the last shown row and asks the database
+    for the rows that go after it, e.g. for the ordering (price, id):
+    WHERE price > <last price> OR (price = <last price> AND id > <last id>) ORDER BY price, id LIMIT <page size>
+
+    So every page is fetched with the same cheap query no matter how deep the client has scrolled,
+    and the pages stay stable when new rows are inserted. The last field of every ordering must be
+    unique (usually it is "id"), otherwise rows with equal values could be skipped.
+
+    Cursors are opaque for the clients: they get ready-to-use links in the "next" and "previous" fields.
+    '''
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    invalid_cursor_message = 'Invalid cursor'
+
+    # Maps values of the "ordering" query parameter to the fields the rows are ordered by
+    orderings = {'id': ('id', )}
+    default_ordering = 'id'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.ordering_name = self.get_ordering_name(request)
+        self.ordering = self.orderings[self.ordering_name]
+
+        position, reverse = self.decode_cursor(request)
+        fields = self.ordering if not reverse else self.reverse_fields(
+            self.ordering
+        )
+
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(fields, position))
+
+        # One more row is fetched to find out whether there is anything after the page
+        try:
+            rows = list(queryset.order_by(*fields)[:self.page_size + 1])
+        except (ValueError, ValidationError):
+            # The cursor was decoded, but its values do not fit the ordering fields
+            raise NotFound(self.invalid_cursor_message)
+
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+
+        if reverse:
+            rows.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+
+        self.page = rows
+        return rows
+
+    def get_paginated_response(self, data, headers=None):
+        '''
+        Dictionaries get the links to the neighbouring pages in the "next" and "previous" fields.
+        Lists keep their format (so the existing clients are not broken) and get the links
+        in the "Link" header instead, e.g. Link: <https://...?cursor=...>; rel="next"
+        '''
+        if isinstance(data, dict):
+            return Response(self.get_paginated_data(data), headers=headers)
+
+        links = [
+            f'<{url}>; rel="{rel}"' for rel, url in (
+                ('next', self.get_next_link()),
+                ('previous', self.get_previous_link()),
+            ) if url is not None
+        ]
+
+        if links:
+            headers = {**(headers or {}), 'Link': ', '.join(links)}
+
+        return Response(data, headers=headers)
+
+    def get_paginated_data(self, data: dict) -> dict:
+        return {
+            **data,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        if not self.page:
+            # The page is empty (e.g. everything after the cursor was deleted), so the previous
+            # page is simply the beginning of the list
+            return remove_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param
+            )
+
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+
+        return max(1, min(page_size, self.max_page_size))
+
+    def get_ordering_name(self, request):
+        ordering_name = request.query_params.get(
+            self.ordering_query_param, self.default_ordering
+        )
+
+        if ordering_name not in self.orderings:
+            return self.default_ordering
+
+        return ordering_name
+
+    def get_position_filter(self, fields, position):
+        '''
+        Builds the condition "the row goes after the position" for the given ordering fields.
+        '''
+        condition = Q()
+
+        for index, field in enumerate(fields):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal_to_previous_fields = {
+                previous_field.lstrip('-'): value
+                for previous_field, value in zip(fields[:index], position)
+            }
+
+            condition |= Q(
+                **equal_to_previous_fields, **{f'{name}__{lookup}': position[index]}
+            )
+
+        return condition
+
+    def reverse_fields(self, fields):
+        return tuple(
+            field[1:] if field.startswith('-') else f'-{field}'
+            for field in fields
+        )
+
+    def decode_cursor(self, request):
+        '''
+        Returns a tuple (position, reverse) where the position is a list of ordering values of a row.
+        '''
+        encoded = request.query_params.get(self.cursor_query_param)
+
+        if encoded is None:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            position = cursor['p']
+            reverse = bool(cursor['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        # A cursor made for another ordering cannot be applied to the current one
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def encode_cursor(self, row, reverse: bool):
+        position = [
+            self.encode_value(self.get_value(row, field.lstrip('-')))
+            for field in self.ordering
+        ]
+        cursor = json.dumps({'p': position, 'r': int(reverse)})
+        encoded = urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param, encoded
+        )
+
+    def get_value(self, row, name: str):
+        # Rows may be model instances or dictionaries (from .values() querysets)
+        return row[name] if isinstance(row, dict) else getattr(row, name)
+
+    def encode_value(self, value):
+        if isinstance(value, datetime):
+            return value.isoformat()
+
+        if isinstance(value, Decimal):
+            return str(value)
+
+        return value
+
+
+class ProductKeysetPagination(KeysetPagination):
+    '''
+    Pagination of the products in a category. Products can be ordered by the date of their creation
+    (by default) or by their price, in both directions.
+    '''
+    orderings = {
+        'datetime_created': ('datetime_created', 'id'),
+        '-datetime_created': ('-datetime_created', '-id'),
+        'price': ('price', 'id'),
+        '-price': ('-price', '-id'),
+    }
+    default_ordering = 'datetime_created'
+
+
+class ReviewKeysetPagination(KeysetPagination):
+    '''
+    Pagination of the reviews, they are ordered by ID (which is the order they were created in).
+    '''
+    orderings = {
+        'id': ('id', ),
+        '-id': ('-id', ),
+    }
+    default_ordering = 'id'
+
+
+class OrderKeysetPagination(KeysetPagination):
+    '''
+    Pagination of the order history of a customer, the newest orders go first by default.
+    '''
+    page_size = 20
+    max_page_size = 100
+    orderings = {
+        '-created': ('-created', '-id'),
+        'created': ('created', 'id'),
+    }
+    default_ordering = '-created'
+
+
+def count_up_to(queryset, limit: int) -> int:
+    '''
+    Counts the rows of the queryset, but stops counting at the limit:
+    SELECT COUNT(*) FROM (SELECT ... LIMIT <limit>)
+
+    So the query costs the same for a hundred and for a million rows, which makes it usable
+    for the approximate totals of the lists which have no stored counter.
+    '''
+    return queryset.order_by()[:limit].count()
@@ -0,0 +1,10 @@
+from rest_framework.permissions import BasePermission
+
+
+class CanExportProducts(BasePermission):
+    '''
+    Allows the users with the permission "products.export_product" (e.g. the accounts of the partners)
+    and the superusers to export the catalog.
+    '''
+    def has_permission(self, request, view):
+        return request.user.has_perm('products.export_product')
@@ -0,0 +1,100 @@
+'''
+Fast read-only serialization of the products for the hot list endpoints (products of a category, search).
+
+ProductSerializer(many=True) creates the model instances and then, for every product, walks through
+its fields looking up the attributes and checking them one by one. ProductRowSerializer reads plain
+dictionaries with .values() instead and converts every row with a list of conversion functions
+built once from the fields of ProductSerializer, so the output is exactly the same. Compare them with
+"manage.py benchmark_serializers".
+'''
+from rest_framework import fields as serializer_fields
+from .serializers import CategorySerializer, ProductSerializer
+
+# Fields of the products which are not their columns, mapped to the column they are computed from
+COMPUTED_FIELDS = {
+    'in_stock': ('amount_remaining', lambda amount_remaining: amount_remaining > 0),
+}
+
+# Serializer fields which return the values of these columns as they are (int() of an int, str() of a str)
+PLAIN_FIELDS = (
+    serializer_fields.IntegerField, serializer_fields.CharField, serializer_fields.FloatField,
+    serializer_fields.BooleanField
+)
+
+
+def get_column_conversion(column: str, field, compute=None):
+    '''
+    Returns a function which takes the value of the column from a row and converts it like
+    the serializer field does: None stays None, other values go through to_representation().
+    compute() is applied to the value first if the field is not a column itself.
+    '''
+    if compute is None and isinstance(field, PLAIN_FIELDS):
+        return lambda row: row[column]
+
+    to_representation = field.to_representation
+
+    if compute is not None:
+        return lambda row: to_representation(compute(row[column]))
+
+    def convert(row):
+        value = row[column]
+        return None if value is None else to_representation(value)
+
+    return convert
+
+
+def get_category_conversion():
+    conversions = [
+        (name, get_column_conversion(f'category__{name}', field))
+        for name, field in CategorySerializer().fields.items()
+    ]
+
+    def convert(row):
+        if row['category__id'] is None:
+            return None
+
+        return {name: convert_value(row) for name, convert_value in conversions}
+
+    return convert, [f'category__{name}' for name, _ in conversions]
+
+
+class ProductRowSerializer:
+    '''
+    Serializes querysets of products the same way as ProductSerializer(many=True) does.
+    Pass fields (see products/fieldsets.py) to get only some fields of the products.
+    '''
+    def __init__(self, fields=None):
+        serializer = ProductSerializer(context={'product_fields': fields})
+        # Pairs (name of the field, function that gets its value from a row) in the order of the fields
+        self.conversions = []
+        self.columns = ['id']
+
+        for name, field in serializer.fields.items():
+            if name == 'category':
+                convert, columns = get_category_conversion()
+            elif name in COMPUTED_FIELDS:
+                column, compute = COMPUTED_FIELDS[name]
+                convert = get_column_conversion(column, field, compute)
+                columns = [column]
+            else:
+                convert = get_column_conversion(name, field)
+                columns = [name]
+
+            self.conversions.append((name, convert))
+            self.columns.extend(columns)
+
+    def serialize(self, queryset, extra_columns=()):
+        '''
+        Returns the products of the queryset as a list of dictionaries. The rows can be loaded separately
+        with get_rows() (e.g. to paginate them) and then converted with to_representation().
+        '''
+        return [
+            self.to_representation(row)
+            for row in self.get_rows(queryset, extra_columns)
+        ]
+
+    def get_rows(self, queryset, extra_columns=()):
+        return queryset.values(*dict.fromkeys([*self.columns, *extra_columns]))
+
+    def to_representation(self, row: dict) -> dict:
+        return {name: convert(row) for name, convert in self.conversions}
@@ -0,0 +1,435 @@
+'''
+In-process full-text search over the products.
+
+The index lives in the memory of every worker process. It is built lazily on the first search
+and then kept up to date by the signal handlers in products/signals.py once the changes are
+committed, so a rolled back change never reaches it. Changes made in other
+processes (or with queryset.update() and bulk_create(), which do not send signals) reach the index
+when it is rebuilt, which happens at most PRODUCT_SEARCH_INDEX_TTL seconds after the last build.
+The old index keeps serving the searches while the new one is built, see IndexHolder.
+'''
+import math
+import re
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from django.conf import settings
+from .facets import get_facet_values
+
+# How much a match in a certain field of a product is worth
+FIELD_WEIGHTS = {
+    'name': 3.0,
+    'color': 2.0,
+    'size': 2.0,
+    'description': 1.0,
+}
+
+# How much a query term is worth depending on how it matched a token of a product
+EXACT_MATCH = 1.0
+PREFIX_MATCH = 0.75
+SUBSTRING_MATCH = 0.5
+
+TRIGRAM_LENGTH = 3
+TOKEN_PATTERN = re.compile(r'\w+')
+
+
+def tokenize(text) -> list:
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+def get_trigrams(token: str) -> set:
+    return {
+        token[i:i + TRIGRAM_LENGTH]
+        for i in range(len(token) - TRIGRAM_LENGTH + 1)
+    }
+
+
+class SearchIndex:
+    '''
+    Inverted index of the product tokens plus a trigram index of the vocabulary.
+
+    Every query term matches the tokens that are equal to it, start with it or (when the term
+    is at least three characters long) contain it. Candidate tokens for the substring match are found
+    by intersecting the trigram sets of the term, so the vocabulary is never scanned as a whole.
+    A product matches the query when it matches every term of it, the products are ranked by
+    the sum of TF-IDF-like scores of the terms.
+    '''
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self.lock:
+            # product ID -> tokens of the product, needed to remove the product from the postings
+            self.documents = {}
+            # product ID -> price, allows filtering by price before the database is hit
+            self.prices = {}
+            # product ID -> { facet: value }, allows counting the facets of the found products in memory
+            self.facet_values = {}
+            # token -> { product ID: weight of the token in the product }
+            self.postings = defaultdict(dict)
+            # trigram -> set of tokens that contain it
+            self.trigrams = defaultdict(set)
+            # Sorted list of all tokens, used for the prefix lookups
+            self.vocabulary = []
+            self.built_at = None
+
+    @property
+    def is_built(self) -> bool:
+        return self.built_at is not None
+
+    def build(self, rows):
+        '''
+        Fills the index from scratch. Rows are (id, name, description, color, size, price, facet values)
+        tuples, see products/facets.py for the facet values.
+        '''
+        with self.lock:
+            self.clear()
+
+            for row in rows:
+                self.add(*row)
+
+            self.built_at = time.monotonic()
+
+    def add(self, product_id, name, description, color, size, price, facet_values=None):
+        with self.lock:
+            if product_id in self.documents:
+                self.remove(product_id)
+
+            weights = defaultdict(float)
+            fields = {
+                'name': name,
+                'description': description,
+                'color': color,
+                'size': size
+            }
+
+            for field, text in fields.items():
+                for token in tokenize(text):
+                    weights[token] += FIELD_WEIGHTS[field]
+
+            for token, weight in weights.items():
+                if token not in self.postings:
+                    self.add_to_vocabulary(token)
+
+                self.postings[token][product_id] = weight
+
+            self.documents[product_id] = list(weights)
+            self.prices[product_id] = float(price)
+            self.facet_values[product_id] = facet_values or {}
+
+    def remove(self, product_id):
+        with self.lock:
+            tokens = self.documents.pop(product_id, None)
+            self.prices.pop(product_id, None)
+            self.facet_values.pop(product_id, None)
+
+            for token in tokens or []:
+                postings = self.postings[token]
+                postings.pop(product_id, None)
+
+                if not postings:
+                    del self.postings[token]
+                    self.remove_from_vocabulary(token)
+
+    def add_to_vocabulary(self, token):
+        insort(self.vocabulary, token)
+
+        for trigram in get_trigrams(token):
+            self.trigrams[trigram].add(token)
+
+    def remove_from_vocabulary(self, token):
+        index = bisect_left(self.vocabulary, token)
+
+        if index < len(self.vocabulary) and self.vocabulary[index] == token:
+            del self.vocabulary[index]
+
+        for trigram in get_trigrams(token):
+            tokens = self.trigrams[trigram]
+            tokens.discard(token)
+
+            if not tokens:
+                del self.trigrams[trigram]
+
+    def match_term(self, term: str) -> dict:
+        '''
+        Returns a dictionary { token: match quality } of the tokens that match the term.
+        '''
+        matches = {}
+
+        # Tokens that start with the term are placed one after another in the sorted vocabulary
+        index = bisect_left(self.vocabulary, term)
+
+        while index < len(self.vocabulary) and self.vocabulary[index].startswith(
+            term
+        ):
+            token = self.vocabulary[index]
+            matches[token] = EXACT_MATCH if token == term else PREFIX_MATCH
+            index += 1
+
+        if len(term) < TRIGRAM_LENGTH:
+            return matches
+
+        candidates = None
+
+        for trigram in get_trigrams(term):
+            tokens = self.trigrams.get(trigram)
+
+            if not tokens:
+                return matches
+
+            candidates = set(tokens) if candidates is None else candidates & tokens
+
+        for token in candidates:
+            # Trigrams may match in another order, so a candidate must be checked directly
+            if token not in matches and term in token:
+                matches[token] = SUBSTRING_MATCH
+
+        return matches
+
+    def search(self, query: str, lte=None, gte=None, limit=None) -> list:
+        '''
+        Returns IDs of the products that match every term of the query, the most relevant go first.
+        Products can also be filtered by their price (lte - less than or equal to, gte - greater than
+        or equal to).
+        '''
+        terms = list(dict.fromkeys(tokenize(query)))
+
+        if not terms:
+            return []
+
+        with self.lock:
+            documents_count = max(len(self.documents), 1)
+            scores = None
+
+            for term in terms:
+                term_scores = defaultdict(float)
+
+                for token, quality in self.match_term(term).items():
+                    postings = self.postings[token]
+                    idf = math.log(1 + documents_count / len(postings))
+
+                    for product_id, weight in postings.items():
+                        score = weight * idf * quality
+                        # Several tokens of a product may match the same term, the best one counts
+                        if score > term_scores[product_id]:
+                            term_scores[product_id] = score
+
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {
+                        product_id: score + term_scores[product_id]
+                        for product_id, score in scores.items()
+                        if product_id in term_scores
+                    }
+
+                if not scores:
+                    return []
+
+            if lte is not None or gte is not None:
+                scores = {
+                    product_id: score
+                    for product_id, score in scores.items()
+                    if (lte is None or self.prices[product_id] <= lte) and
+                    (gte is None or self.prices[product_id] >= gte)
+                }
+
+        ranked = sorted(scores, key=lambda product_id: (-scores[product_id], product_id))
+
+        return ranked[:limit] if limit is not None else ranked
+
+    def count_facets(self, product_ids, facet_names) -> dict:
+        '''
+        Returns { facet: { value: number of the products } } of the given products.
+        '''
+        counts = {name: defaultdict(int) for name in facet_names}
+
+        with self.lock:
+            for product_id in product_ids:
+                values = self.facet_values.get(product_id)
+
+                if values is None:
+                    continue
+
+                for name in facet_names:
+                    counts[name][values[name]] += 1
+
+        return counts
+
+
+class IndexHolder:
+    '''
+    Holds the current in-memory index of the process and rebuilds it without blocking the readers.
+    A new index is built aside while the old one keeps serving the requests, then the reference is swapped.
+    The changes made while the new index is built are recorded and applied to it before the swap,
+    so none of them is lost.
+    '''
+    def __init__(self, create_index, fill_index):
+        self.create_index = create_index
+        self.fill_index = fill_index
+        self.index = create_index()
+        # Only one thread of the process rebuilds the index at a time
+        self.rebuild_lock = threading.Lock()
+        # Guards the swap and the changes recorded during a rebuild
+        self.lock = threading.Lock()
+        self.pending_changes = None
+
+    @property
+    def is_tracking(self) -> bool:
+        '''
+        Whether the changes are applied to an index: there is nothing to change until it is built or being built.
+        '''
+        return self.index.is_built or self.pending_changes is not None
+
+    def is_fresh(self, index) -> bool:
+        return index.is_built and time.monotonic(
+        ) - index.built_at <= settings.PRODUCT_SEARCH_INDEX_TTL
+
+    def get(self):
+        '''
+        Returns the current index, (re)building it if it is empty or too old. Without a built index there is
+        nothing to serve, so the requests wait for the first build. An outdated index is rebuilt by one
+        of the requests, while the others keep using it.
+        '''
+        index = self.index
+
+        if self.is_fresh(index):
+            return index
+
+        if self.rebuild_lock.acquire(blocking=not index.is_built):
+            try:
+                # Another thread may have rebuilt the index while this one was waiting
+                if not self.is_fresh(self.index):
+                    self.rebuild()
+            finally:
+                self.rebuild_lock.release()
+
+        return self.index
+
+    def rebuild(self):
+        with self.lock:
+            self.pending_changes = []
+
+        index = self.create_index()
+
+        try:
+            self.fill_index(index)
+        except Exception:
+            with self.lock:
+                self.pending_changes = None
+            raise
+
+        with self.lock:
+            for change in self.pending_changes:
+                change(index)
+
+            self.pending_changes = None
+            self.index = index
+
+    def apply(self, change):
+        '''
+        Applies the change (a function of an index) to the current index and, if a new one is being built,
+        to the new one too.
+        '''
+        with self.lock:
+            if self.pending_changes is not None:
+                self.pending_changes.append(change)
+
+            if self.index.is_built:
+                change(self.index)
+
+    def clear(self):
+        with self.lock:
+            self.index = self.create_index()
+
+
+current_search_index = IndexHolder(
+    SearchIndex, lambda index: index.build(iter_index_rows())
+)
+
+
+def get_search_index() -> SearchIndex:
+    '''
+    Returns the search index of the process, (re)building it if it is empty or too old.
+    '''
+    return current_search_index.get()
+
+
+def iter_index_rows(queryset=None):
+    '''
+    Yields the rows for SearchIndex.build(). The sizes and colors of the variants of a product
+    are searchable as if they were the size and color of the product itself, the facets are counted
+    by the size and color of the product only.
+    '''
+    from .models import Product, ProductVariant
+
+    queryset = queryset if queryset is not None else Product.objects.all()
+    variant_terms = get_variant_terms(
+        ProductVariant.objects.filter(product__in=queryset)
+    )
+
+    rows = queryset.values_list(
+        'id', 'name', 'description', 'color', 'size', 'price', 'category_id', 'amount_remaining'
+    ).iterator(chunk_size=2000)
+
+    for product_id, name, description, color, size, price, category_id, amount_remaining in rows:
+        colors, sizes = variant_terms.get(product_id, ('', ''))
+        yield (
+            product_id,
+            name,
+            description,
+            f'{color} {colors}',
+            f'{size} {sizes}',
+            price,
+            get_facet_values(category_id, color, size, amount_remaining, price),
+        )
+
+
+def get_variant_terms(variants) -> dict:
+    '''
+    Returns { product ID: (colors, sizes) } of the given variants, every color and size is mentioned once.
+    '''
+    terms = defaultdict(lambda: ({}, {}))
+
+    for product_id, color, size in variants.values_list(
+        'product_id', 'color', 'size'
+    ).iterator(chunk_size=2000):
+        # Dictionaries keep the order the colors and sizes were added in
+        colors, sizes = terms[product_id]
+        colors[color] = None
+        sizes[size] = None
+
+    return {
+        product_id: (' '.join(colors), ' '.join(sizes))
+        for product_id, (colors, sizes) in terms.items()
+    }
+
+
+def index_product(product):
+    '''
+    Applies changes of the product to the index. There is nothing to do if the index was not built yet,
+    it will see the product when it is built.
+    '''
+    if not current_search_index.is_tracking:
+        return
+
+    colors, sizes = get_variant_terms(product.variants.all()).get(product.id, ('', ''))
+    row = (
+        product.id,
+        product.name,
+        product.description,
+        f'{product.color} {colors}',
+        f'{product.size} {sizes}',
+        product.price,
+        get_facet_values(
+            product.category_id, product.color, product.size, product.amount_remaining, product.price
+        ),
+    )
+
+    current_search_index.apply(lambda index: index.add(*row))
+
+
+def unindex_product(product_id):
+    current_search_index.apply(lambda index: index.remove(product_id))
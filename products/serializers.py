@@ -12,6 +12,10 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    '''
+    Product with all of its fields or, if the context contains "product_fields", only with the listed ones
+    (see products/fieldsets.py). It works for the nested products too, since they share the context.
+    '''
     category = CategorySerializer(read_only=True)
     reviews_count = serializers.IntegerField()
     likes_count = serializers.IntegerField()
@@ -22,6 +26,26 @@ class ProductSerializer(serializers.ModelSerializer):
         model = models.Product
         fields = "__all__"
 
+    def get_fields(self):
+        fields = super().get_fields()
+        product_fields = self.context.get('product_fields')
+
+        if product_fields is None:
+            return fields
+
+        return {
+            name: field
+            for name, field in fields.items() if name in product_fields
+        }
+
+
+class ProductVariantSerializer(serializers.ModelSerializer):
+    in_stock = serializers.BooleanField(read_only=True)
+
+    class Meta:
+        model = models.ProductVariant
+        fields = ['id', 'size', 'color', 'amount_remaining', 'in_stock']
+
 
 class ProductListSerializer(serializers.ModelSerializer):
     products = ProductSerializer(many=True)
@@ -37,6 +61,18 @@ class ReviewAuthorSerializer(serializers.Serializer):
     img = serializers.URLField(required=False)
 
 
+class CompactReviewSerializer(serializers.ModelSerializer):
+    '''
+    Review without the nested product, only its ID. Lists of reviews of one product use it
+    to not repeat the same product in every review.
+    '''
+    author = ReviewAuthorSerializer()
+
+    class Meta:
+        model = models.Review
+        fields = ['id', 'author', 'liked', 'review_text', 'product']
+
+
 class ReviewSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField()
     product = ProductSerializer()
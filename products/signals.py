@@ -0,0 +1,128 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from . import autocomplete
+from .cache import bump_versions
+from .counters import COUNTER_FIELDS, recount_reviews, update_review_counters
+from .models import Category, Product, ProductVariant, Review
+from .search import index_product, unindex_product
+from .variants import update_product_stock
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+
+    if created:
+        update_review_counters(instance, 1)
+        transaction.on_commit(lambda: autocomplete.add_product_popularity(instance.product_id, 1))
+    else:
+        # A review may have been edited in the admin (e.g. "liked" was flipped), so we do not
+        # know what exactly changed. It happens rarely, so just recount the product.
+        recount_reviews([instance.product_id])
+
+        if Review.product.is_cached(instance):
+            instance.product.refresh_from_db(fields=COUNTER_FIELDS)
+
+    bump_review_product_versions(instance)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    update_review_counters(instance, -1)
+    transaction.on_commit(lambda: autocomplete.add_product_popularity(instance.product_id, -1))
+    bump_review_product_versions(instance)
+
+
+def bump_review_product_versions(review):
+    '''
+    Review counters are a part of the product in every catalog response, so both the product
+    and its category are changed when a review is created or deleted.
+    '''
+    if Review.product.is_cached(review):
+        category_id = review.product.category_id
+    else:
+        category_id = Product.objects.filter(id=review.product_id).values_list(
+            'category_id', flat=True
+        ).first()
+
+    bump_versions(f'product:{review.product_id}', f'category:{category_id}')
+
+
+@receiver(pre_save, sender=Product)
+def product_saving(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or instance.pk is None:
+        return
+
+    if update_fields is not None and 'category' not in update_fields:
+        return
+
+    # When a product is moved to another category, the old category changes too
+    old_category_id = Product.objects.filter(id=instance.pk).values_list(
+        'category_id', flat=True
+    ).first()
+
+    if old_category_id is not None and old_category_id != instance.category_id:
+        bump_versions(f'category:{old_category_id}')
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+
+    # The indexes live in the memory of the process and can not be rolled back, so they are updated
+    # only when the change is committed
+    transaction.on_commit(lambda: index_product_everywhere(instance))
+    bump_versions(f'product:{instance.id}', f'category:{instance.category_id}')
+
+
+def index_product_everywhere(product):
+    index_product(product)
+    autocomplete.index_product(product)
+
+
+def unindex_product_everywhere(product_id):
+    unindex_product(product_id)
+    autocomplete.unindex_product(product_id)
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: unindex_product_everywhere(product_id))
+    bump_versions(f'product:{instance.id}', f'category:{instance.category_id}')
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def variant_changed(sender, instance, raw=False, **kwargs):
+    '''
+    The stock of a product is the total stock of its variants, and its variants are searchable
+    as a part of the product, so both are updated.
+    '''
+    if raw:
+        return
+
+    update_product_stock([instance.product_id])
+    product = Product.objects.filter(id=instance.product_id).first()
+
+    # The product may be deleted together with its variants
+    if product is not None:
+        transaction.on_commit(lambda: index_product(product))
+        bump_versions(f'product:{product.id}', f'category:{product.category_id}')
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, raw=False, **kwargs):
+    if not raw:
+        transaction.on_commit(lambda: autocomplete.index_category(instance))
+        bump_versions('categories', f'category:{instance.id}')
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    category_id = instance.id
+    transaction.on_commit(lambda: autocomplete.unindex_category(category_id))
+    bump_versions('categories', f'category:{instance.id}')
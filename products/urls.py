@@ -3,12 +3,23 @@ from . import views
 
 urlpatterns = [
     path('products/search', views.ProductSearch().as_view()),
+    path('products/autocomplete', views.ProductAutocomplete.as_view()),
+    path('products/export', views.ProductExport.as_view()),
+    path('products/cache-stats', views.CatalogCacheStats.as_view()),
     path('categories', views.Categories.as_view()),
     path('categories/<str:category_name>', views.CategoryDetails.as_view()),
+    path(
+        'categories/<str:category_name>/top-rated',
+        views.TopRatedProducts.as_view()
+    ),
     path(
         'categories/<str:category_name>/<int:product_id>',
         views.ProductDetails.as_view()
     ),
+    path(
+        'categories/<str:category_name>/<int:product_id>/variants',
+        views.ProductVariants.as_view()
+    ),
     path(
         'categories/<str:category_name>/<int:product_id>/reviews',
         views.ReviewList.as_view()
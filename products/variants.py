@@ -0,0 +1,152 @@
+'''
+Variants of the products: size and color combinations with their own stock.
+
+The stock of a product with variants is the total stock of its variants. It is kept in
+Product.amount_remaining by the signal handlers in products/signals.py, so the catalog lists,
+the search and the facets keep working with the products only.
+'''
+from itertools import groupby
+from django.db import transaction
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from .counters import recount_reviews
+from .models import Product, ProductVariant
+
+# Products which differ only in these fields are variants of one product
+VARIANT_FIELDS = ['size', 'color', 'amount_remaining']
+SHARED_FIELDS = ['category_id', 'name', 'description', 'img', 'price', 'old_price']
+
+
+def update_product_stock(product_ids):
+    '''
+    Recalculates the stock of the products from their variants with one query.
+    '''
+    total = ProductVariant.objects.filter(product=OuterRef('pk')).order_by().values(
+        'product'
+    ).annotate(total=Sum('amount_remaining')).values('total')
+
+    Product.objects.filter(id__in=product_ids).update(
+        amount_remaining=Coalesce(Subquery(total), 0)
+    )
+
+
+def get_variant_matrix(product_id: int) -> dict:
+    '''
+    Returns the variants of the product read with one query, together with all of its sizes and colors
+    (in the order the variants were added), so a client can draw the size by color grid:
+    {
+        "sizes": ["S", "M"],
+        "colors": ["red", "blue"],
+        "variants": [{"id": 1, "size": "S", "color": "red", "amount_remaining": 3, "in_stock": true}, ...]
+    }
+    '''
+    variants = list(
+        ProductVariant.objects.filter(product_id=product_id).order_by('id').values(
+            'id', 'size', 'color', 'amount_remaining'
+        )
+    )
+
+    for variant in variants:
+        variant['in_stock'] = variant['amount_remaining'] > 0
+
+    return {
+        'sizes': list(dict.fromkeys(variant['size'] for variant in variants)),
+        'colors': list(dict.fromkeys(variant['color'] for variant in variants)),
+        'variants': variants,
+    }
+
+
+def find_duplicate_products():
+    '''
+    Yields groups of the products without variants which differ only in size, color and stock,
+    e.g. the same t-shirt added once for every size. Every group is a list of dictionaries.
+    '''
+    rows = Product.objects.filter(variants__isnull=True).order_by(
+        *SHARED_FIELDS, 'id'
+    ).values('id', *SHARED_FIELDS, *VARIANT_FIELDS)
+
+    for _, group in groupby(
+        rows.iterator(), key=lambda row: [row[field] for field in SHARED_FIELDS]
+    ):
+        group = list(group)
+
+        # Products with the same size and color cannot become variants of one product
+        combinations = {(row['size'], row['color']) for row in group}
+
+        if len(group) > 1 and len(combinations) == len(group):
+            yield group
+
+
+@transaction.atomic
+def merge_products(group) -> int:
+    '''
+    Turns a group of duplicate products (see find_duplicate_products) into one product with variants.
+    The first product of the group is kept, all the objects referring to the other ones (reviews,
+    cart items, order items and so on) are moved to it and get the matching variant if they can
+    refer to one. Objects which cannot be moved because of a unique constraint are deleted with
+    the merged products. Returns the ID of the kept product.
+    '''
+    product_id = group[0]['id']
+    variants = {
+        row['id']: ProductVariant.objects.create(
+            product_id=product_id,
+            size=row['size'],
+            color=row['color'],
+            amount_remaining=row['amount_remaining']
+        )
+        for row in group
+    }
+
+    for relation in get_movable_relations():
+        model = relation.related_model
+        field_name = relation.field.name
+        variant_field_name = next(
+            (
+                field.name for field in model._meta.get_fields()
+                if field.many_to_one and field.related_model is ProductVariant
+            ),
+            None,
+        )
+
+        for merged_product_id, variant in variants.items():
+            changes = {field_name: product_id}
+
+            if variant_field_name is not None:
+                changes[variant_field_name] = variant
+
+            model.objects.filter(**{field_name: merged_product_id}).update(**changes)
+
+    product = Product.objects.get(id=product_id)
+    product.size = ''
+    product.color = ''
+    product.save()
+
+    for merged_product in Product.objects.filter(id__in=list(variants)[1:]):
+        merged_product.delete()
+
+    recount_reviews([product_id])
+    update_product_stock([product_id])
+
+    return product_id
+
+
+def get_movable_relations():
+    '''
+    Returns the foreign keys to the products which can be moved to another product.
+    '''
+    relations = []
+
+    for relation in Product._meta.related_objects:
+        if not relation.one_to_many or relation.related_model is ProductVariant:
+            continue
+
+        unique_fields = [
+            constraint.fields
+            for constraint in relation.related_model._meta.constraints
+            if hasattr(constraint, 'fields')
+        ] + list(relation.related_model._meta.unique_together)
+
+        if not any(relation.field.name in fields for fields in unique_fields):
+            relations.append(relation)
+
+    return relations
@@ -1,11 +1,24 @@
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from rest_framework import generics, permissions, status
 from rest_framework.exceptions import NotFound, APIException
 from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
 from rest_framework.authentication import BasicAuthentication, TokenAuthentication
 from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
+from rest_framework.views import APIView
+from .autocomplete import get_autocomplete_index
+from .cache import conditional, get_cached_data, get_stats
 from .models import Category, Product, Review
-from .serializers import CategorySerializer, ProductListSerializer, ProductSerializer, ReviewSerializer
+from .export import EXPORT_FORMATS, iter_export
+from .facets import FACETS, count_facets
+from .fieldsets import ProductFieldsMixin, get_product_fields, select_product_fields
+from .pagination import ProductKeysetPagination, ReviewKeysetPagination
+from .permissions import CanExportProducts
+from .row_serializers import ProductRowSerializer
+from .search import get_search_index
+from .serializers import CategorySerializer, CompactReviewSerializer, ProductSerializer, ReviewSerializer
+from .variants import get_variant_matrix
 
 
 class Categories(generics.ListAPIView):
@@ -16,15 +29,45 @@ class Categories(generics.ListAPIView):
     serializer_class = CategorySerializer
     renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
 
+    def list(self, request, *args, **kwargs):
+        data = get_cached_data(
+            request,
+            'categories',
+            ['categories'],
+            lambda: self.get_serializer(self.get_queryset(), many=True).data,
+        )
+
+        return Response(data)
+
+
+def get_category_version_names(request, category_name):
+    category_id = Category.objects.filter(name=category_name).values_list(
+        'id', flat=True
+    ).first()
+
+    return [f'category:{category_id}'] if category_id is not None else None
+
+
+def get_product_version_names(request, category_name, product_id):
+    # The product contains its category, so renaming of a category changes the product too
+    return ['categories', f'product:{product_id}']
 
+
+@conditional(get_category_version_names)
 class CategoryDetails(generics.RetrieveAPIView):
     ''''
     This class is responsible for /categories/<category_name> endpoint. Returns details of an certain category including a 
-    list of all its items
+    list of its items.
+
+    The list of items is paginated with cursors, so the response stays small however big the category is.
+    Query parameters "page_size" and "ordering" (datetime_created, -datetime_created, price, -price)
+    are optional. Links to the neighbouring pages are placed in the "next" and "previous" fields.
+    Query parameters "fields" and "omit" choose the fields of the items (see products/fieldsets.py).
     '''
     queryset = Category.objects.all()
-    serializer_class = ProductListSerializer
+    serializer_class = CategorySerializer
     renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+    pagination_class = ProductKeysetPagination
     lookup_url_kwarg = 'category_name'
 
     def get_object(self):
@@ -34,37 +77,267 @@ class CategoryDetails(generics.RetrieveAPIView):
         )
         return obj
 
+    def retrieve(self, request, *args, **kwargs):
+        version_names = request.catalog_version_names
+
+        if version_names is None:
+            raise NotFound('Category with this name was not found.')
+
+        data = get_cached_data(
+            request,
+            'category',
+            version_names,
+            lambda: self.get_data(self.get_object()),
+        )
+
+        return Response(data)
+
+    def get_data(self, category):
+        # Products are read as plain rows, it is much faster than the serializer (see products/row_serializers.py)
+        row_serializer = ProductRowSerializer(get_product_fields(self.request))
+        # The columns of every ordering are loaded, the paginator builds the cursors from them
+        ordering_columns = [
+            field.lstrip('-')
+            for ordering in self.pagination_class.orderings.values()
+            for field in ordering
+        ]
+        rows = self.paginate_queryset(
+            row_serializer.get_rows(category.products.all(), ordering_columns)
+        )
+
+        data = self.get_serializer(category).data
+        data['products'] = [row_serializer.to_representation(row) for row in rows]
+
+        return self.paginator.get_paginated_data(data)
+
+
+@conditional(get_category_version_names)
+class TopRatedProducts(APIView):
+    '''
+    It responses with the best rated products of a category: the products are ranked by the lower bound
+    of the Wilson score interval of their likes (see products/counters.py), so a product with many good reviews
+    goes above a product with a single like. The ratings are kept up to date when the reviews are written,
+    so the list is read straight from the index (category, -rating). The optional parameter "limit" sets
+    the number of products, query parameters "fields" and "omit" choose their fields (see products/fieldsets.py).
+    Example of using: /categories/top%20clothes/top-rated?limit=5
+    '''
+    DEFAULT_LIMIT = 10
+    MAX_LIMIT = 50
+
+    renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+
+    def get(self, request, category_name):
+        version_names = request.catalog_version_names
+
+        if version_names is None:
+            raise NotFound('Category with this name was not found.')
+
+        try:
+            limit = min(int(request.query_params['limit']), self.MAX_LIMIT)
+        except (KeyError, ValueError):
+            limit = self.DEFAULT_LIMIT
+
+        # Products without likes have no rating at all, they are not a part of the list
+        queryset = Product.objects.filter(
+            category__name=category_name, rating__gt=0
+        ).order_by('-rating', 'id')[:max(limit, 1)]
+        data = get_cached_data(
+            request,
+            'top-rated',
+            version_names,
+            lambda: ProductRowSerializer(get_product_fields(request)).serialize(queryset),
+        )
+
+        return Response(data)
+
 
-class ProductDetails(generics.RetrieveAPIView):
+@conditional(get_product_version_names)
+class ProductDetails(ProductFieldsMixin, generics.RetrieveAPIView):
     '''
     It responses with details of a product with ID equals <product_id>.
-    Example of using: /categories/top%20clothes/5
+    Query parameters "fields" and "omit" choose the fields of the product (see products/fieldsets.py).
+    Example of using: /categories/top%20clothes/5?fields=id,name,price
     '''
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
     renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
     lookup_url_kwarg = 'product_id'
 
+    def get_queryset(self):
+        return select_product_fields(
+            Product.objects.all(), get_product_fields(self.request)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        data = get_cached_data(
+            request,
+            'product',
+            get_product_version_names(request, **kwargs),
+            lambda: self.get_serializer(self.get_object()).data,
+        )
+
+        return Response(data)
+
+
+@conditional(get_product_version_names)
+class ProductVariants(APIView):
+    '''
+    It responses with the sizes and colors of a product with ID equals <product_id> and the stock of every
+    combination of them (see products/variants.py), all of it is read with one query.
+    Example of using: /categories/top%20clothes/5/variants
+    '''
+    renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+
+    def get(self, request, category_name, product_id):
+        data = get_cached_data(
+            request,
+            'variants',
+            get_product_version_names(request, category_name, product_id),
+            lambda: get_variant_matrix(product_id),
+        )
+
+        # A product without variants is simply sold in one size and color
+        if not data['variants'] and not Product.objects.filter(id=product_id).exists():
+            raise NotFound(f'Product with ID { product_id } was not found')
+
+        return Response(data)
+
+
+class ProductAutocomplete(APIView):
+    '''
+    It responses with the names of the products and the categories which have a word starting with
+    the query parameter "q" (required parameter), the most popular go first. The suggestions are found
+    by the in-memory autocomplete index (see products/autocomplete.py) without any database queries, so it is
+    cheap enough to be requested on every keystroke. The optional parameter "limit" sets the number of suggestions.
+    Example of using: /products/autocomplete?q=pa&limit=5
+    '''
+    DEFAULT_LIMIT = 10
+
+    renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+
+    def get(self, request):
+        query = request.query_params.get('q')
+
+        if query is None:
+            raise APIException('Parameter "q" is required.')
+
+        try:
+            limit = min(int(request.query_params['limit']), settings.AUTOCOMPLETE_SUGGESTIONS_LIMIT)
+        except (KeyError, ValueError):
+            limit = self.DEFAULT_LIMIT
+
+        return Response(get_autocomplete_index().suggest(query, max(limit, 1)))
+
+
+class ProductExport(APIView):
+    '''
+    It streams the whole catalog in JSONL (by default) or CSV format, the format is chosen with the query
+    parameter "output". The response is written while the products are read from the database chunk by chunk,
+    so it does not need to fit in memory.
+    Only the users with the permission "products.export_product" have access to it: the export reads
+    the whole catalog, so it is too expensive to be public.
+    Example of using: /products/export?output=csv
+    '''
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+    permission_classes = [CanExportProducts]
+    EXPORT_CHUNK_SIZE = 2000
+
+    def get(self, request):
+        export_format = request.query_params.get('output', 'jsonl')
+
+        if export_format not in EXPORT_FORMATS:
+            raise APIException(
+                f'Parameter "output" may be only one of these: {", ".join(EXPORT_FORMATS)}.'
+            )
+
+        response = StreamingHttpResponse(
+            iter_export(export_format, self.EXPORT_CHUNK_SIZE),
+            content_type=EXPORT_FORMATS[export_format]
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{export_format}"'
+
+        return response
+
+
+class CatalogCacheStats(APIView):
+    '''
+    It responses with statistics of the catalog cache: number of hits, misses and the hit rate.
+    Only admins have access to it.
+    Example of using: /products/cache-stats
+    '''
+    renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+    authentication_classes = [TokenAuthentication, BasicAuthentication]
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(get_stats())
+
 
 class ReviewList(generics.ListAPIView):
     '''
     It looks for product reviews with ID equals <product_id>.
     Example of using: /categories/top%20clothes/5/reviews
+
+    It responses with the product and the list of its reviews, the reviews contain only ID of the product:
+    {
+        "product": Product,
+        "reviews": CompactReview[],
+    }
+
+    The list of full reviews with the nested product in every one of them is still available
+    by passing the query parameter "expand=product".
+
+    Reviews are paginated with cursors (see products/pagination.py): the links to the neighbouring pages
+    are placed in the "next" and "previous" fields (or in the "Link" header for the expanded list).
+    Pass "with_total=true" to get the total number of reviews, it is taken from the counter stored
+    in the product, so the reviews are not counted.
     '''
     queryset = Review.objects.all()
-    serializer_class = ReviewSerializer
+    serializer_class = CompactReviewSerializer
     renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+    pagination_class = ReviewKeysetPagination
     lookup_url_kwarg = 'product_id'
 
     def get_queryset(self):
         product_id = self.kwargs['product_id']
 
         try:
-            Product.objects.get(id=self.kwargs['product_id'])
+            self.product = Product.objects.select_related('category').get(
+                id=product_id
+            )
         except Product.DoesNotExist:
             raise NotFound(f'Product with ID { product_id } was not found')
 
-        return Review.objects.filter(product__id=product_id)
+        return Review.objects.filter(product__id=product_id
+                                    ).select_related('author')
+
+    def list(self, request, *args, **kwargs):
+        reviews = self.paginate_queryset(self.get_queryset())
+        with_total = request.query_params.get('with_total') == 'true'
+
+        if request.query_params.get('expand') == 'product':
+            # Every review gets the same product instance, so it is not loaded again for each of them
+            for review in reviews:
+                review.product = self.product
+
+            return self.get_paginated_response(
+                ReviewSerializer(reviews, many=True).data,
+                headers={'X-Total-Count': self.product.reviews_count}
+                if with_total else None
+            )
+
+        data = {
+            'product': ProductSerializer(self.product).data,
+            'reviews': self.get_serializer(reviews, many=True).data,
+        }
+
+        if with_total:
+            data['total'] = self.product.reviews_count
+
+        return self.get_paginated_response(data)
+
+    def get_paginated_response(self, data, headers=None):
+        return self.paginator.get_paginated_response(data, headers=headers)
 
 
 class ReviewCreate(generics.CreateAPIView):
@@ -101,16 +374,22 @@ class ProductSearch(generics.ListAPIView):
 
     def get_queryset(self):
         '''
-        Looks for the products with names that starts with a value from the query parameter
-        "q" (query, required parameter), then filters a result by the value of the 
+        Looks for the products that match every word from the query parameter "q" (query, required
+        parameter) in their name, description, color or size, then filters a result by the value of the
         parameter "lte" (less than or equal to) and then, finally, filters a result by the parameter "gte" 
         (greater than or equal to).
 
+        A word from the query matches a word of a product if it is equal to it, is its beginning or
+        is a part of it (the last works for the words of three or more characters). The search itself is
+        done by the in-memory search index (see products/search.py), the database only loads the found products.
+
         Example of using:
         /search?q=pan&lte=25.0
 
-        This will return all of the products with names that starts with "pan" (for example, "pants") and 
+        This will return all of the products with words that starts with "pan" (for example, "pants") and 
         with the price that less than or equal to 25.0
+
+        Query parameters "fields" and "omit" choose the fields of the found products (see products/fieldsets.py).
         '''
         queryset = Product.objects.all()
         query = self.request.query_params.get('q')
@@ -121,9 +400,6 @@ class ProductSearch(generics.ListAPIView):
         if query is None:
             raise APIException('Parameter "q" is required.')
 
-        # Firstly, filter all products by a start of the name
-        queryset = queryset.filter(name__startswith=query)
-
         # Than goes not required parameters
 
         if less_than is not None:
@@ -131,8 +407,8 @@ class ProductSearch(generics.ListAPIView):
             # to ensure that a value of the parameter is certainly an integer or a float by
             # using the try/except statement.
             try:
-                filter_value_converted = float(less_than)
-                queryset = queryset.filter(price__lte=filter_value_converted)
+                less_than = float(less_than)
+                queryset = queryset.filter(price__lte=less_than)
             except ValueError:
                 raise APIException(
                     'Parameter "lte" is needed to be an integer or a float.'
@@ -143,11 +419,66 @@ class ProductSearch(generics.ListAPIView):
             # to ensure that a value of the parameter is certainly an integer or a float by
             # using the try/except statement.
             try:
-                filter_value_converted = float(greater_than)
-                queryset = queryset.filter(price__gte=filter_value_converted)
+                greater_than = float(greater_than)
+                queryset = queryset.filter(price__gte=greater_than)
             except ValueError:
                 raise APIException(
                     'Parameter "gte" is needed to be an integer or a float.'
                 )
 
-        return queryset
\ No newline at end of file
+        # The index filters by price too, so the limit is applied to the suitable products only.
+        # The database filters are still applied to skip products whose price was changed in another process.
+        # Facets are counted in memory over all the found products, so the limit is not applied to the search
+        # when they are requested, but only the limited number of products is loaded anyway.
+        # The index may be swapped by a rebuild, so the same one is used for the facets
+        self.search_index = get_search_index()
+        self.found_ids = self.search_index.search(
+            query,
+            lte=less_than,
+            gte=greater_than,
+            limit=None
+            if self.get_facet_names() else settings.PRODUCT_SEARCH_RESULTS_LIMIT
+        )
+        self.ranked_ids = self.found_ids[:settings.PRODUCT_SEARCH_RESULTS_LIMIT]
+
+        return queryset.filter(id__in=self.ranked_ids)
+
+    def get_facet_names(self):
+        '''
+        Parses the optional parameter "facets", a comma-separated list of facets to count
+        next to the search results. For example, /search?q=pan&facets=color,size,price
+        '''
+        facets = self.request.query_params.get('facets')
+
+        if not facets:
+            return []
+
+        facet_names = list(dict.fromkeys(facets.split(',')))
+
+        for name in facet_names:
+            if name not in FACETS:
+                raise APIException(
+                    f'Parameter "facets" may contain only these values: {", ".join(FACETS)}.'
+                )
+
+        return facet_names
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        facet_names = self.get_facet_names()
+
+        # Products are loaded in an arbitrary order, so they need to be sorted by relevance again
+        rank = {product_id: index for index, product_id in enumerate(self.ranked_ids)}
+        row_serializer = ProductRowSerializer(get_product_fields(request))
+        rows = sorted(row_serializer.get_rows(queryset), key=lambda row: rank[row['id']])
+        results = [row_serializer.to_representation(row) for row in rows]
+
+        if not facet_names:
+            return Response(results)
+
+        return Response(
+            {
+                'results': results,
+                'facets': count_facets(self.search_index, self.found_ids, facet_names),
+            }
+        )
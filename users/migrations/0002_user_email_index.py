@@ -0,0 +1,29 @@
+# Generated by Django 3.2.6 on 2026-10-18 18:26
+
+from django.conf import settings
+from django.db import migrations, models
+
+# The registration checks that the email is not taken yet, but the user model of
+# django.contrib.auth has no index on it. The model cannot be changed, so the index
+# is created with the schema editor directly.
+EMAIL_INDEX = models.Index(fields=['email'], name='users_auth_user_email_idx')
+
+
+def add_email_index(apps, schema_editor):
+    schema_editor.add_index(apps.get_model(settings.AUTH_USER_MODEL), EMAIL_INDEX)
+
+
+def remove_email_index(apps, schema_editor):
+    schema_editor.remove_index(apps.get_model(settings.AUTH_USER_MODEL), EMAIL_INDEX)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(add_email_index, remove_email_index),
+    ]
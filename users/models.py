@@ -1,10 +1,13 @@
 from django.db import models
-from products.models import Product
+from products.models import Product, ProductVariant
 from django.contrib.auth.models import User
 
 class WishlistItem(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="wishlist")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    variant = models.ForeignKey(
+        ProductVariant, on_delete=models.CASCADE, blank=True, null=True
+    )
 
     def __str__(self) -> str:
         return f'{self.product.name}'
@@ -13,6 +16,9 @@ class WishlistItem(models.Model):
 class CartItem(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name="cart")
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    variant = models.ForeignKey(
+        ProductVariant, on_delete=models.CASCADE, blank=True, null=True
+    )
     amount = models.PositiveSmallIntegerField()
 
     def __str__(self) -> str:
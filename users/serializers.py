@@ -1,4 +1,4 @@
-from products.serializers import ProductSerializer
+from products.serializers import ProductSerializer, ProductVariantSerializer
 from rest_framework import serializers
 from django.contrib.auth.models import User
 
@@ -6,12 +6,14 @@ from django.contrib.auth.models import User
 class CartItemSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     product = ProductSerializer()
+    variant = ProductVariantSerializer(allow_null=True)
     amount = serializers.IntegerField(max_value=32767, min_value=0)
 
 
 class WishlistItemSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     product = ProductSerializer()
+    variant = ProductVariantSerializer(allow_null=True)
 
 class UserSerializer(serializers.ModelSerializer):
     reviews_count = serializers.SerializerMethodField()
@@ -21,6 +23,10 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'date_joined', 'last_login', 'reviews_count']
 
     def get_reviews_count(self, user):
+        # Lists of the orders annotate the count to not count it for every order
+        if hasattr(user, 'commentaries_count'):
+            return user.commentaries_count
+
         return user.commentaries.count()
 
 
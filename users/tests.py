@@ -1,7 +1,7 @@
 from rest_framework import status
 from rest_framework.test import APITestCase
 from django.contrib.auth.models import User
-from products.models import Category, Product
+from products.models import Category, Product, ProductVariant
 
 test_data = {
     'user data 1':
@@ -264,6 +264,46 @@ class CartsTest(APITestCase):
         self.assertTrue(response.data['product'])
         self.assertTrue(response.data['amount'])
 
+    def test_add_variant_to_cart(self):
+        '''
+        Ensure we can add a variant of a product to a user's cart, but not a variant of another product
+        '''
+        variant = ProductVariant.objects.create(
+            product=self.p1, size='M', color='black', amount_remaining=2
+        )
+        other_product = Product.objects.create(
+            **test_data['product data'], category=self.p1.category
+        )
+
+        response = self.client.post(
+            f'/users/{self.user_1["id"]}/cart', {
+                'product_id': other_product.id,
+                'variant_id': variant.id,
+                'amount': 1
+            },
+            format='json',
+            HTTP_AUTHORIZATION='Token ' + self.token_1
+        )
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(
+            f'/users/{self.user_1["id"]}/cart', {
+                'product_id': self.p1.id,
+                'variant_id': variant.id,
+                'amount': 1
+            },
+            format='json',
+            HTTP_AUTHORIZATION='Token ' + self.token_1
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get(
+            f'/users/{self.user_1["id"]}/cart',
+            HTTP_ACCEPT='application/json',
+            HTTP_AUTHORIZATION='Token ' + self.token_1
+        )
+        self.assertEqual(response.data[0]['variant']['color'], 'black')
+
     def test_add_not_existing_item_to_cart(self):
         '''
         Ensure we cannot add a not existing item to an user's cart
@@ -306,6 +346,34 @@ class CartsTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertEqual(response.data['detail'].code, 'invalid_data')
 
+    def test_get_user_cart_with_fields(self):
+        '''
+        Ensure we get only the requested fields of the products in the cart
+        '''
+        for _ in range(3):
+            self.client.post(
+                f'/users/{self.user_1["id"]}/cart', {
+                    'product_id': self.p1.id,
+                    'amount': 5
+                },
+                format='json',
+                HTTP_AUTHORIZATION='Token ' + self.token_1
+            )
+
+        # The token with its user and the cart items with their products
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f'/users/{self.user_1["id"]}/cart', {'fields': 'id,name,price'},
+                HTTP_ACCEPT='application/json',
+                HTTP_AUTHORIZATION='Token ' + self.token_1
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 3)
+        self.assertEqual(
+            set(response.data[0]['product']), {'id', 'name', 'price'}
+        )
+
 
 class WishlistItemDeleteTest(APITestCase):
     def setUp(self):
@@ -642,6 +710,32 @@ class ReviewDelete(APITestCase):
         reviews = self.client.get(f'/users/{self.user_1["id"]}/reviews').data
         self.assertEqual(reviews, [])
 
+    def test_paginate_reviews_of_user(self):
+        '''
+        Test that reviews of a user are paginated and the links are placed in the headers
+        '''
+        for _ in range(0, 3):
+            self.client.post(
+                f'/categories/{self.category.name}/{self.p1.id}/reviews/create',
+                test_data['review data'],
+                format='json',
+                HTTP_AUTHORIZATION='Token ' + self.token_1
+            )
+
+        response = self.client.get(
+            f'/users/{self.user_1["id"]}/reviews?page_size=2&with_total=true'
+        )
+
+        self.assertEqual(len(response.data), 2)
+        self.assertEqual(response['X-Total-Count'], '3')
+
+        next_link = response['Link'].split(';')[0].strip('<>')
+        response = self.client.get(next_link)
+
+        self.assertEqual(len(response.data), 1)
+        self.assertIn('rel="previous"', response['Link'])
+        self.assertNotIn('rel="next"', response['Link'])
+
     def test_delete_one_review_logged_out(self):
         '''
         Test that we cannot delete anything if we're not authorized
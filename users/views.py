@@ -6,6 +6,8 @@ from rest_framework.authentication import BasicAuthentication, TokenAuthenticati
 from rest_framework import permissions, generics
 from . import serializers, models, permissions as user_permissions
 from products import models as product_models, serializers as product_serializers
+from products.fieldsets import ProductFieldsMixin, get_product_fields, select_product_fields
+from products.pagination import ReviewKeysetPagination, count_up_to
 from django.contrib.auth.models import User
 
 
@@ -28,7 +30,28 @@ class UserRegister(generics.CreateAPIView):
     renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
 
 
-class Wishlist(generics.ListCreateAPIView):
+# Columns of the variants loaded together with the cart and wish list items
+VARIANT_COLUMNS = [
+    'variant__id', 'variant__size', 'variant__color', 'variant__amount_remaining'
+]
+
+
+def get_variant(product, variant_id):
+    '''
+    Returns the variant of the product with the given ID, or None if no variant was chosen.
+    '''
+    if variant_id is None:
+        return None
+
+    try:
+        return product.variants.get(id=variant_id)
+    except (product_models.ProductVariant.DoesNotExist, ValueError, TypeError):
+        raise NotFound(
+            'Variant with this ID was not found for this product.', 'not_found'
+        )
+
+
+class Wishlist(ProductFieldsMixin, generics.ListCreateAPIView):
     '''
     Wishlist class is responsible for working with users' wish lists.
     To work with them via GET or POST request, user must be logged in.
@@ -37,9 +60,12 @@ class Wishlist(generics.ListCreateAPIView):
     To add new item to user's wish list, you have to send POST request with following schema in the request body:
 
     {
-        "product_id": <int:product ID>
+        "product_id": <int:product ID>,
+        "variant_id": <int:variant ID>, (optional)
     }
 
+    Query parameters "fields" and "omit" choose the fields of the products (see products/fieldsets.py).
+
     TODO: Create handler for delete method (#552068c1)
     '''
     queryset = models.WishlistItem.objects.all()
@@ -50,12 +76,23 @@ class Wishlist(generics.ListCreateAPIView):
     renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
     lookup_field = 'product_id'
 
+    def get_queryset(self):
+        return select_product_fields(
+            models.WishlistItem.objects.filter(owner__id=self.kwargs['user_id']
+                                              ).select_related('variant'),
+            get_product_fields(self.request),
+            prefix='product__',
+            extra_columns=['id', *VARIANT_COLUMNS],
+        )
+
     def create(self, request, user_id):
         try:
             product_id = request.data['product_id']
             product = product_models.Product.objects.get(id=product_id)
             wishlist_item = models.WishlistItem(
-                owner=request.user, product=product
+                owner=request.user,
+                product=product,
+                variant=get_variant(product, request.data.get('variant_id'))
             )
             wishlist_item_serialized = serializers.WishlistItemSerializer(
                 wishlist_item
@@ -82,9 +119,12 @@ class Cart(generics.ListCreateAPIView):
     
     {
         "product_id": <int:product ID>,
+        "variant_id": <int:variant ID>, (optional)
         "amount": <int>
     }
 
+    Query parameters "fields" and "omit" choose the fields of the products (see products/fieldsets.py).
+
     TODO: Create handler for delete method
     '''
 
@@ -97,8 +137,17 @@ class Cart(generics.ListCreateAPIView):
 
     def list(self, request, user_id):
         self.check_object_permissions(self.request, user_id)
-        queryset = self.get_queryset().filter(owner__id=user_id)
-        serialized = self.serializer_class(queryset, many=True)
+        product_fields = get_product_fields(request)
+        queryset = select_product_fields(
+            self.get_queryset().filter(owner__id=user_id
+                                      ).select_related('variant'),
+            product_fields,
+            prefix='product__',
+            extra_columns=['id', 'amount', *VARIANT_COLUMNS],
+        )
+        serialized = self.serializer_class(
+            queryset, many=True, context={'product_fields': product_fields}
+        )
         return Response(serialized.data)
 
     def create(self, request, user_id):
@@ -109,7 +158,10 @@ class Cart(generics.ListCreateAPIView):
             amount = request.data['amount']
             product = product_models.Product.objects.get(id=product_id)
             cart_item = models.CartItem(
-                owner=request.user, product=product, amount=amount
+                owner=request.user,
+                product=product,
+                variant=get_variant(product, request.data.get('variant_id')),
+                amount=amount
             )
             cart_item_serialized = serializers.CartItemSerializer(cart_item)
             cart_item.save()
@@ -156,10 +208,17 @@ class ReviewList(generics.ListAPIView):
     '''
     It responses with a list of reviews made by a requested user.
     Example of using: /users/2/reviews
+
+    Reviews are paginated with cursors, links to the neighbouring pages are placed in the "Link" header.
+    Pass "with_total=true" to get the number of reviews in the "X-Total-Count" header. Reviews are counted
+    up to TOTAL_COUNT_LIMIT, if there are more of them the header looks like "10000+".
     '''
+    TOTAL_COUNT_LIMIT = 10000
+
     queryset = product_models.Review.objects.all()
     serializer_class = product_serializers.ReviewSerializer
     renderer_classes = [BrowsableAPIRenderer, JSONRenderer]
+    pagination_class = ReviewKeysetPagination
 
     def get_queryset(self):
         user_id = self.kwargs['user_id']
@@ -169,7 +228,27 @@ class ReviewList(generics.ListAPIView):
         except User.DoesNotExist:
             raise NotFound(f'User with ID { user_id } was not found.')
 
-        return product_models.Review.objects.filter(author__id=user_id)
+        return product_models.Review.objects.filter(
+            author__id=user_id
+        ).select_related('author', 'product__category')
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        reviews = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(reviews, many=True)
+        headers = None
+
+        if request.query_params.get('with_total') == 'true':
+            total = count_up_to(queryset, self.TOTAL_COUNT_LIMIT + 1)
+            headers = {
+                'X-Total-Count':
+                    total if total <= self.TOTAL_COUNT_LIMIT else
+                    f'{self.TOTAL_COUNT_LIMIT}+'
+            }
+
+        return self.paginator.get_paginated_response(
+            serializer.data, headers=headers
+        )
 
 
 class ReviewDelete(generics.DestroyAPIView):